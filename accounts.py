@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import logging
+import configparser
+from typing import List, NamedTuple
+
+import pandas as pd
+
+from kline_data import _table_exists
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
+ACCOUNTS_TABLE = 'accounts'
+# 成交明細 (新倉 / 平倉) 資料表，每筆成交屬於一個帳戶
+FILLS_TABLE = 'TransactionData'
+# 未指定帳戶時使用的帳戶；config.ini 的 [Account] 區段即為此帳戶的設定，既有交易皆歸入此帳戶
+DEFAULT_ACCOUNT = 'default'
+ACCOUNT_SECTION = 'Account'
+# 其他帳戶的設定區段為 [Account:<帳戶代號>]，未列出的項目沿用 [Account]
+ACCOUNT_SECTION_PREFIX = 'Account:'
+# 帳戶代號: 英數字、底線與連字號
+ACCOUNT_ID_PATTERN = r'[A-Za-z0-9_-]{1,32}'
+
+logger = logging.getLogger(__name__)
+
+
+class AccountConfig(NamedTuple):
+    account_id: str
+    name: str
+    monthly_start_capital: float
+    current_scale: str
+    operation_contracts: int
+    # 資金路徑 (歷史月份連鎖計算) 第一個月的規模，未設定時同 current_scale
+    start_scale: str
+
+
+def read_config(config_path: str = CONFIG_PATH) -> configparser.ConfigParser:
+    if not os.path.exists(config_path):
+        raise FileNotFoundError(f"Configuration file '{config_path}' not found.")
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    return config
+
+
+def configured_account_ids(config: configparser.ConfigParser) -> List[str]:
+    """The default account (when [Account] exists) followed by every [Account:<id>] section, in file order."""
+    ids = [DEFAULT_ACCOUNT] if config.has_section(ACCOUNT_SECTION) else []
+    ids += [section[len(ACCOUNT_SECTION_PREFIX):] for section in config.sections()
+            if section.startswith(ACCOUNT_SECTION_PREFIX)]
+    return ids
+
+
+def load_account_config(config: configparser.ConfigParser, account_id: str = DEFAULT_ACCOUNT) -> AccountConfig:
+    """
+    Audit parameters of `account_id`. Keys missing from its [Account:<id>] section fall back to [Account];
+    `start_scale` set in neither falls back to the account's `current_scale`.
+    Raises ValueError for an account without a section.
+    """
+    section = ACCOUNT_SECTION if account_id == DEFAULT_ACCOUNT else f"{ACCOUNT_SECTION_PREFIX}{account_id}"
+    if not config.has_section(section):
+        raise ValueError(f"Unknown account '{account_id}'. Configured accounts: {configured_account_ids(config)}")
+
+    def get(key: str) -> str:
+        value = config.get(section, key, fallback=None)
+        if value is None:
+            value = config.get(ACCOUNT_SECTION, key)
+        return value
+
+    current_scale = get('current_scale')
+    return AccountConfig(
+        account_id=account_id,
+        name=config.get(section, 'name', fallback=account_id),
+        monthly_start_capital=float(get('monthly_start_capital')),
+        current_scale=current_scale,
+        operation_contracts=int(get('operation_contracts')),
+        start_scale=config.get(section, 'start_scale',
+                               fallback=config.get(ACCOUNT_SECTION, 'start_scale', fallback=current_scale)),
+    )
+
+
+def create_accounts_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ACCOUNTS_TABLE} (
+            account_id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def add_account_columns(conn: sqlite3.Connection):
+    """
+    Migration step: creates the accounts table with the default account and adds `account_id`
+    (default account for existing rows) to trades. Does not commit.
+    """
+    create_accounts_table(conn)
+    conn.execute(f"INSERT OR IGNORE INTO {ACCOUNTS_TABLE} (account_id, name) VALUES (?, ?)",
+                 (DEFAULT_ACCOUNT, DEFAULT_ACCOUNT))
+    if not _table_exists(conn, 'trades'):
+        return
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(trades)")]
+    if 'account_id' not in columns:
+        conn.execute(f"ALTER TABLE trades ADD COLUMN account_id TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'")
+
+
+def add_fill_account_column(conn: sqlite3.Connection):
+    """
+    Migration step: rebuilds TransactionData with `account_id` (default account for existing fills),
+    order ids being unique per account instead of across accounts. Does not commit.
+    """
+    if not _table_exists(conn, FILLS_TABLE):
+        return
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({FILLS_TABLE})")]
+    if 'account_id' in columns:
+        return
+    conn.execute(f"ALTER TABLE {FILLS_TABLE} RENAME TO {FILLS_TABLE}_old")
+    conn.execute(f"""
+        CREATE TABLE {FILLS_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            transaction_time DATETIME NOT NULL,
+            trade_type VARCHAR(4) NOT NULL,
+            product_name VARCHAR(20) NOT NULL,
+            quantity INT NOT NULL,
+            price DECIMAL(10, 2) NOT NULL,
+            commission_fee INT,
+            transaction_tax INT,
+            net_amount DECIMAL(12, 2),
+            order_id VARCHAR(10),
+            position_type VARCHAR(4),
+            account_id TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}',
+            UNIQUE (account_id, order_id)
+        )
+    """)
+    conn.execute(f"INSERT INTO {FILLS_TABLE} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {FILLS_TABLE}_old")
+    # The old table's indexes go with it.
+    conn.execute(f"DROP TABLE {FILLS_TABLE}_old")
+
+
+def sync_accounts(conn: sqlite3.Connection, config: configparser.ConfigParser) -> List[str]:
+    """Registers every configured account (updating display names) without committing. Returns their ids."""
+    create_accounts_table(conn)
+    ids = configured_account_ids(config)
+    conn.executemany(
+        f"INSERT INTO {ACCOUNTS_TABLE} (account_id, name) VALUES (?, ?) "
+        "ON CONFLICT (account_id) DO UPDATE SET name = excluded.name",
+        [(account_id, load_account_config(config, account_id).name) for account_id in ids],
+    )
+    return ids
+
+
+def list_accounts(conn: sqlite3.Connection) -> pd.DataFrame:
+    """Registered accounts (in registration order) with their trade count, number of source files and first/last trade time."""
+    return pd.read_sql_query(f"""
+        SELECT a.account_id, a.name, a.created_at,
+               COUNT(t.trade_id) AS trade_count,
+               COUNT(DISTINCT t.source_file) AS source_files,
+               MIN(t.trade_time) AS first_trade_time,
+               MAX(t.trade_time) AS last_trade_time
+        FROM {ACCOUNTS_TABLE} a LEFT JOIN trades t ON t.account_id = a.account_id
+        GROUP BY a.account_id ORDER BY a.rowid
+    """, conn)
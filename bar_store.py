@@ -0,0 +1,247 @@
+import os
+import sqlite3
+import argparse
+import logging
+import configparser
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from kline_data import TABLE_NAME, DEFAULT_SYMBOL, list_symbols, normalize_symbol
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
+DB_PATH = os.path.join(SCRIPT_DIR, 'trade_notes.db')
+# 預設的二進位 K 棒檔目錄 (可由 config.ini [KData] bar_store_dir 覆寫)
+DEFAULT_BAR_STORE_DIR = os.path.join(SCRIPT_DIR, 'BarStore')
+# 每根 1 分鐘 K 棒固定 48 bytes，依 epoch 遞增存放
+BAR_DTYPE = np.dtype([
+    ('epoch', '<i8'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'), ('volume', '<i8'),
+])
+# 稀疏日索引：每個台北日期一筆 (當日 00:00 的 epoch, 當日第一根 K 棒的列號)
+DAY_INDEX_DTYPE = np.dtype([('day', '<i8'), ('row', '<i8')])
+# 台北時間固定為 UTC+8 (無日光節約時間)，日期可直接由 epoch 計算
+MARKET_UTC_OFFSET = 8 * 3600
+SECONDS_PER_DAY = 86400
+# 由資料庫建立或同步時每次讀取的列數
+SYNC_BATCH_ROWS = 200_000
+
+logger = logging.getLogger(__name__)
+
+
+def _day_starts(epochs: np.ndarray) -> np.ndarray:
+    """Epoch of the Taipei midnight starting the day of each bar."""
+    return (epochs + MARKET_UTC_OFFSET) // SECONDS_PER_DAY * SECONDS_PER_DAY - MARKET_UTC_OFFSET
+
+
+def _day_index(epochs: np.ndarray, first_row: int = 0, previous_day: Optional[int] = None) -> np.ndarray:
+    """Index entries for the days that start within `epochs` (rows numbered from `first_row`)."""
+    days = _day_starts(epochs)
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]]) if len(days) else np.empty(0, dtype='int64')
+    if len(starts) and previous_day is not None and days[0] == previous_day:
+        starts = starts[1:]
+    index = np.empty(len(starts), dtype=DAY_INDEX_DTYPE)
+    index['day'] = days[starts]
+    index['row'] = starts + first_row
+    return index
+
+
+def _fetch_bars(conn: sqlite3.Connection, symbol: str, after: Optional[int] = None, batch_rows: int = SYNC_BATCH_ROWS):
+    """Yields the bars of `symbol` with epoch >= `after` (all when None) as BAR_DTYPE arrays, in epoch order."""
+    query = f"SELECT epoch, open, high, low, close, volume FROM {TABLE_NAME} WHERE symbol = ?"
+    params = [symbol]
+    if after is not None:
+        query += " AND epoch >= ?"
+        params.append(int(after))
+    cursor = conn.execute(query + " ORDER BY epoch", params)
+    while True:
+        batch = cursor.fetchmany(batch_rows)
+        if not batch:
+            break
+        yield np.array(batch, dtype=BAR_DTYPE)
+
+
+class BarStore:
+    """
+    Optional on-disk copy of the 1-minute bars: one fixed-width memmap file per symbol
+    (`{symbol}.bars`, BAR_DTYPE records in epoch order) plus a sparse day index (`{symbol}.days.npy`).
+
+    Range reads find the day's rows in the index, binary-search the epochs inside that day and
+    return a zero-copy view of the memmap. Files are extended in place when new bars come after the
+    stored ones and rewritten through a temporary file otherwise, so open readers never see a
+    truncated file; readers re-map a symbol when its files change on disk.
+    """
+
+    def __init__(self, directory: str = DEFAULT_BAR_STORE_DIR):
+        self.directory = directory
+        self._mapped: Dict[str, Tuple[tuple, np.ndarray, np.ndarray]] = {}
+
+    def _paths(self, symbol: str) -> Tuple[str, str]:
+        base = os.path.join(self.directory, symbol)
+        return f"{base}.bars", f"{base}.days.npy"
+
+    def symbols(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len('.bars')] for name in os.listdir(self.directory) if name.endswith('.bars'))
+
+    def has_symbol(self, symbol: str) -> bool:
+        return all(os.path.exists(path) for path in self._paths(symbol))
+
+    # --- Reading ---
+
+    def bars(self, symbol: str = DEFAULT_SYMBOL) -> np.ndarray:
+        """All stored bars of `symbol` as a read-only memmap (empty when the symbol is not stored)."""
+        return self._open(symbol)[0]
+
+    def _open(self, symbol: str) -> Tuple[np.ndarray, np.ndarray]:
+        data_path, index_path = self._paths(symbol)
+        try:
+            signature = tuple((s.st_size, s.st_mtime_ns, s.st_ino) for s in map(os.stat, (data_path, index_path)))
+        except FileNotFoundError:
+            self._mapped.pop(symbol, None)
+            return np.empty(0, dtype=BAR_DTYPE), np.empty(0, dtype=DAY_INDEX_DTYPE)
+        cached = self._mapped.get(symbol)
+        if cached is None or cached[0] != signature:
+            rows = signature[0][0] // BAR_DTYPE.itemsize
+            data = (np.memmap(data_path, dtype=BAR_DTYPE, mode='r', shape=(rows,)) if rows
+                    else np.empty(0, dtype=BAR_DTYPE))
+            index = np.load(index_path)
+            index = index[index['row'] < rows]
+            if len(index) and not np.array_equal(_day_starts(data['epoch'][index['row']]), index['day']):
+                # Caught between a rewrite of the data file and its index: derive the index from the data.
+                index = _day_index(np.asarray(data['epoch']))
+            cached = (signature, data, index)
+            self._mapped[symbol] = cached
+        return cached[1], cached[2]
+
+    def _row_bounds(self, data: np.ndarray, index: np.ndarray, epoch: int) -> int:
+        """Position of the first bar at or after `epoch`, searching only within that day's rows."""
+        if not len(index):
+            return 0
+        position = np.searchsorted(index['day'], _day_starts(np.int64(epoch)), side='right') - 1
+        if position < 0:
+            return 0
+        lo = int(index['row'][position])
+        hi = int(index['row'][position + 1]) if position + 1 < len(index) else len(data)
+        return lo + int(np.searchsorted(data['epoch'][lo:hi], epoch, side='left'))
+
+    def read_range(self, symbol: str = DEFAULT_SYMBOL, start: Optional[int] = None,
+                   end: Optional[int] = None) -> np.ndarray:
+        """Bars of `symbol` with start <= epoch < end (UNIX seconds) as a zero-copy view of the memmap."""
+        data, index = self._open(symbol)
+        lo = 0 if start is None else self._row_bounds(data, index, int(start))
+        hi = len(data) if end is None else self._row_bounds(data, index, int(end))
+        return data[lo:max(lo, hi)]
+
+    def load_bar_arrays(self, lower: Optional[int] = None, upper: Optional[int] = None, columns=('high', 'low'),
+                        symbol: str = DEFAULT_SYMBOL) -> Dict[str, np.ndarray]:
+        """
+        Same result as `kline_data.load_bar_arrays` ('time' plus `columns` for bars in [lower, upper),
+        here given as UNIX seconds), as views into the store.
+        """
+        bars = self.read_range(symbol, lower, upper)
+        arrays = {'time': bars['epoch']}
+        arrays.update({column: bars[column] for column in columns})
+        return arrays
+
+    # --- Writing ---
+
+    def _write_index(self, index_path: str, index: np.ndarray):
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, index)
+        os.replace(tmp_path, index_path)
+
+    def build(self, conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL) -> int:
+        """(Re)writes the files of `symbol` from `market_data`. Returns the number of bars stored."""
+        return self._rewrite(conn, symbol, np.empty(0, dtype=BAR_DTYPE), None)
+
+    def _rewrite(self, conn: sqlite3.Connection, symbol: str, head: np.ndarray, after: Optional[int]) -> int:
+        """Writes `head` followed by the database bars from `after` to a new file and swaps it in."""
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, index_path = self._paths(symbol)
+        tmp_path = f"{data_path}.tmp"
+        rows, index, last_day = len(head), [_day_index(head['epoch'])], None
+        if rows:
+            last_day = int(_day_starts(head['epoch'][-1:])[0])
+        with open(tmp_path, 'wb') as f:
+            head.tofile(f)
+            for batch in _fetch_bars(conn, symbol, after):
+                batch.tofile(f)
+                index.append(_day_index(batch['epoch'], rows, last_day))
+                rows += len(batch)
+                last_day = int(_day_starts(batch['epoch'][-1:])[0])
+        os.replace(tmp_path, data_path)
+        self._write_index(index_path, np.concatenate(index))
+        return rows
+
+    def sync(self, conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL, first_epoch: Optional[int] = None) -> int:
+        """
+        Brings the files of `symbol` up to date after bars from `first_epoch` on were added to
+        `market_data`. Bars after the last stored one are appended in place; a backfill rewrites the
+        file from the first affected bar. Returns the number of bars written.
+        """
+        data, index = self._open(symbol)
+        if not self.has_symbol(symbol):
+            return self.build(conn, symbol)
+        last_epoch = int(data['epoch'][-1]) if len(data) else None
+        data_path, index_path = self._paths(symbol)
+
+        if last_epoch is None or (first_epoch is not None and first_epoch > last_epoch):
+            rows, new_entries = len(data), [index]
+            last_day = int(index['day'][-1]) if len(index) else None
+            with open(data_path, 'ab') as f:
+                for batch in _fetch_bars(conn, symbol, None if last_epoch is None else last_epoch + 1):
+                    batch.tofile(f)
+                    new_entries.append(_day_index(batch['epoch'], rows, last_day))
+                    rows += len(batch)
+                    last_day = int(_day_starts(batch['epoch'][-1:])[0])
+            self._write_index(index_path, np.concatenate(new_entries))
+            return rows - len(data)
+
+        keep = 0 if first_epoch is None else int(np.searchsorted(data['epoch'], first_epoch, side='left'))
+        head = np.array(data[:keep])
+        return self._rewrite(conn, symbol, head, first_epoch) - keep
+
+
+def load_bar_store(config_path: str = CONFIG_PATH) -> Optional[BarStore]:
+    """
+    Returns the bar store when enabled with `bar_store = true` in the [KData] section of config.ini
+    (directory from `bar_store_dir`, relative to the program directory), else None.
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    try:
+        enabled = config.getboolean('KData', 'bar_store', fallback=False)
+    except ValueError:
+        logger.warning("忽略無效的 bar_store 設定")
+        enabled = False
+    if not enabled:
+        return None
+    directory = config.get('KData', 'bar_store_dir', fallback=DEFAULT_BAR_STORE_DIR)
+    return BarStore(os.path.join(SCRIPT_DIR, directory))
+
+
+def main():
+    """Builds the bar store from market_data (all symbols unless --symbol is given)."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build the memory-mapped 1-minute bar store from market_data.")
+    parser.add_argument('--symbol', action='append', help='Symbol to build (repeatable; default: all symbols).')
+    parser.add_argument('--dir', help='Store directory (default: config.ini bar_store_dir or BarStore/).')
+    args = parser.parse_args()
+
+    store = BarStore(args.dir) if args.dir else (load_bar_store() or BarStore())
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        symbols = [normalize_symbol(s) for s in args.symbol] if args.symbol else list_symbols(conn)
+        for symbol in symbols:
+            rows = store.build(conn, symbol)
+            logger.info(f"Bar store: wrote {rows} {symbol} bars to {store.directory}")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import logging
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from rules_replay import _kpi_frame
+
+# --- Configuration ---
+# 快樂獎金：當月獲利且 KPI 達標時，提領當月損益的 10%
+HAPPINESS_INCENTIVE_RATE = 0.10
+
+logger = logging.getLogger(__name__)
+
+
+def kpi_criteria(upgrade_criteria: Dict[str, Dict[str, Any]], scale: str) -> Dict[str, Any]:
+    """
+    KPI thresholds that apply at `scale`: its own upgrade criteria, or for the top scale (which has no
+    further upgrade) the criteria of the scale that leads to it. Raises ValueError for an unknown scale.
+    """
+    if scale in upgrade_criteria:
+        return upgrade_criteria[scale]
+    for criteria in upgrade_criteria.values():
+        if criteria['next_scale'] == scale:
+            return criteria
+    known = list(upgrade_criteria) + [c['next_scale'] for c in upgrade_criteria.values() if c['next_scale'] not in upgrade_criteria]
+    raise ValueError(f"Unknown scale '{scale}'. Must be one of {known}")
+
+
+def kpi_met(criteria: Dict[str, Any], win_rate: float, risk_reward_ratio: float) -> bool:
+    """True when the win rate and RR (np.inf without losses) both reach `criteria`."""
+    return risk_reward_ratio >= criteria['rr_key'] and win_rate >= criteria['wr_key']
+
+
+def monthly_path_inputs(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-month inputs of the capital path, computed once with a single groupby: trade count, PnL,
+    win rate and RR (rounded like TradeAuditor._calculate_kpis), indexed by 'YYYY-MM' over every calendar
+    month from the first to the last trade. Months without trades have zero PnL and no KPIs.
+    """
+    columns = ['trades', 'pnl', 'win_rate', 'risk_reward_ratio']
+    if trades.empty:
+        return pd.DataFrame(columns=columns)
+    times = pd.to_datetime(trades['trade_time'])
+    kpis = _kpi_frame(times.dt.strftime('%Y-%m'), trades['net_pnl'].astype(float))[columns]
+    months = pd.period_range(times.min().to_period('M'), times.max().to_period('M'), freq='M').strftime('%Y-%m')
+    inputs = kpis.reindex(months).fillna({'trades': 0, 'pnl': 0.0, 'win_rate': 0.0, 'risk_reward_ratio': 0.0})
+    inputs['trades'] = inputs['trades'].astype('int64')
+    inputs['risk_reward_ratio'] = inputs['risk_reward_ratio'].round(2)
+    inputs.index.name = 'month'
+    return inputs
+
+
+def capital_path(inputs: pd.DataFrame, start_capital: float, start_scale: str,
+                 upgrade_criteria: Dict[str, Dict[str, Any]], quarterly_cost: float, quarterly_months: List[int],
+                 incentive_rate: float = HAPPINESS_INCENTIVE_RATE) -> pd.DataFrame:
+    """
+    Walks the months of `inputs` (from monthly_path_inputs) in order, carrying capital and scale forward.
+    Each month starts from the previous month's closing capital and scale:
+      1. the month's PnL is applied (`capital_after_pnl`);
+      2. in `quarterly_months` the quarterly cost is deducted (`capital_after_cost`); every month the
+         upgrade check compares this capital and the month's KPIs with the scale's criteria;
+      3. when profitable with KPIs met, the happiness incentive (`incentive_rate` x PnL) is paid out;
+      4. an upgrade takes effect from the next month (`next_scale`).
+    One pass over plain arrays, so a decade of history is a few hundred steps.
+    """
+    count = len(inputs)
+    pnl = inputs['pnl'].to_numpy(dtype=float)
+    win_rate = inputs['win_rate'].to_numpy(dtype=float)
+    rr = inputs['risk_reward_ratio'].to_numpy(dtype=float)
+    quarter_end = np.isin(pd.PeriodIndex(inputs.index, freq='M').month, quarterly_months)
+
+    capital_start = np.empty(count)
+    cost = np.where(quarter_end, float(quarterly_cost), 0.0)
+    incentive = np.zeros(count)
+    upgraded = np.zeros(count, dtype=bool)
+    scales: List[str] = []
+    next_scales: List[str] = []
+
+    capital, scale = float(start_capital), start_scale
+    for i in range(count):
+        capital_start[i] = capital
+        after_cost = capital + pnl[i] - cost[i]
+        criteria = upgrade_criteria.get(scale)
+        performance_ok = kpi_met(kpi_criteria(upgrade_criteria, scale), win_rate[i], rr[i])
+        if pnl[i] > 0 and performance_ok:
+            incentive[i] = round(pnl[i] * incentive_rate)
+        upgraded[i] = bool(criteria) and performance_ok and after_cost >= criteria['capital_key']
+        scales.append(scale)
+        if upgraded[i]:
+            scale = criteria['next_scale']
+        next_scales.append(scale)
+        capital = after_cost - incentive[i]
+
+    logger.info(f"Capital path over {count} months: {start_capital:,.0f} ({start_scale}) -> {capital:,.0f} ({scale}).")
+    return pd.DataFrame({
+        'scale': scales,
+        'capital_start': capital_start,
+        'pnl': pnl,
+        'capital_after_pnl': capital_start + pnl,
+        'quarterly_cost': cost,
+        'capital_after_cost': capital_start + pnl - cost,
+        'happiness_incentive': incentive,
+        'capital_end': capital_start + pnl - cost - incentive,
+        'upgraded': upgraded,
+        'next_scale': next_scales,
+    }, index=inputs.index)
+
+
+def capital_path_summary(path: pd.DataFrame) -> Dict[str, Any]:
+    """Report layout of a capital path: final capital and scale, totals, upgrade months and every month's row."""
+    if path.empty:
+        return {"final_capital": None, "final_scale": None, "upgrades": [], "months": []}
+    return {
+        "start_capital": float(path['capital_start'].iloc[0]),
+        "start_scale": path['scale'].iloc[0],
+        "final_capital": float(path['capital_end'].iloc[-1]),
+        "final_scale": path['next_scale'].iloc[-1],
+        "total_pnl": float(path['pnl'].sum()),
+        "total_quarterly_cost": float(path['quarterly_cost'].sum()),
+        "total_happiness_incentive": float(path['happiness_incentive'].sum()),
+        "upgrades": [{"month": month, "from": row['scale'], "to": row['next_scale']}
+                     for month, row in path[path['upgraded']].iterrows()],
+        "months": path.reset_index().to_dict('records'),
+    }
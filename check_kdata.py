@@ -1,39 +1,295 @@
-
-import sqlite3
 import os
+import sqlite3
+import argparse
+import logging
+from typing import Any, Dict, Optional
 
-DB_FILE = os.path.join('TradeCheck', 'trade_notes.db')
-TABLE_NAME = 'market_data'
+import numpy as np
+import pandas as pd
 
-def check_data():
-    if not os.path.exists(DB_FILE):
-        print(f"資料庫檔案不存在: {DB_FILE}")
-        return
+from kline_data import TABLE_NAME, DEFAULT_SYMBOL, epochs_to_market_index, normalize_symbol, _table_exists
+from kdata_csv import read_csv_chunks, symbol_from_filename
+from trading_session import assign_sessions, get_session_calendar, _minutes
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(SCRIPT_DIR, 'trade_notes.db')
+BAR_SECONDS = 60
+# 連續成交量為 0 的 K 棒達此數量才列入報告
+ZERO_VOLUME_RUN_MIN_BARS = 5
+# 價格跳動判定: 1 分鐘報酬的穩健 z 分數 (以 MAD 估計) 超過門檻，且漲跌幅超過最小百分比
+SPIKE_ROBUST_Z = 12.0
+SPIKE_MIN_RETURN = 0.005
+# 每次從資料庫讀取的列數，讀入後即轉為 numpy 陣列
+SCAN_BATCH_ROWS = 200_000
+
+logger = logging.getLogger(__name__)
+
+BAR_FIELDS = ('epoch', 'open', 'high', 'low', 'close', 'volume')
+
+
+def read_bar_arrays(conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL,
+                    batch_rows: int = SCAN_BATCH_ROWS) -> Dict[str, np.ndarray]:
+    """
+    Reads every 1-minute bar of `symbol` in key order into numpy arrays. Rows are fetched in
+    batches and converted immediately, so only one batch of Python tuples exists at a time.
+    """
+    cursor = conn.execute(
+        f"SELECT epoch, open, high, low, close, volume FROM {TABLE_NAME} WHERE symbol = ? ORDER BY epoch", (symbol,))
+    parts = []
+    while True:
+        batch = cursor.fetchmany(batch_rows)
+        if not batch:
+            break
+        parts.append(np.array(batch, dtype=float))
+    table = np.concatenate(parts) if parts else np.empty((0, len(BAR_FIELDS)))
+    arrays = {field: table[:, i] for i, field in enumerate(BAR_FIELDS)}
+    arrays['epoch'] = arrays['epoch'].astype('int64')
+    return arrays
+
+
+def _runs(mask: np.ndarray):
+    """Returns (start, stop) positions of the runs of True in a boolean array."""
+    edges = np.diff(np.r_[0, mask.astype('int8'), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _session_lengths(symbol: str) -> Dict[str, int]:
+    """Minutes per calendar session, e.g. {'day': 300, 'night': 840}."""
+    return {s['name']: (_minutes(s['close']) - _minutes(s['open'])) % (24 * 60)
+            for s in get_session_calendar(symbol)['sessions']}
+
+
+def scan_bars(bars: Dict[str, np.ndarray], symbol: str = DEFAULT_SYMBOL) -> Dict[str, Any]:
+    """
+    Runs every data-quality check over 1-minute bars given as arrays (`epoch`, `open`, `high`,
+    `low`, `close`, `volume`) in their stored or file order. All checks are vectorized.
+
+    - order: duplicate epochs, epochs going backwards, epochs not on a minute boundary
+    - ohlc: high below max(open, close), low above min(open, close), high < low, non-positive prices,
+      negative volume
+    - gaps: missing minutes inside each TAIFEX session that has data (see trading_session.SESSION_CALENDARS),
+      including a late first bar or an early last bar; bars outside session hours are counted separately
+    - zero-volume runs of at least ZERO_VOLUME_RUN_MIN_BARS bars
+    - spikes: close-to-close returns within a session whose robust z-score exceeds SPIKE_ROBUST_Z
+    - coverage: bars present vs. expected per trading day, plus a week x weekday heatmap of it
+
+    Returns a dict with `summary` (counts) and one DataFrame per report.
+    """
+    epochs = np.asarray(bars['epoch'], dtype='int64')
+    order = np.argsort(epochs, kind='stable')
+    first_seen = np.r_[True, np.diff(epochs[order]) != 0] if len(order) else np.empty(0, dtype=bool)
+    summary = {
+        'symbol': symbol,
+        'bars': int(len(epochs)),
+        'duplicates': int((~first_seen).sum()),
+        'out_of_order': int((np.diff(epochs) < 0).sum()),
+        'misaligned': int((epochs % BAR_SECONDS != 0).sum()),
+    }
+
+    # The remaining checks run on the time-sorted, de-duplicated series (first occurrence kept).
+    keep = order[first_seen]
+    epochs = epochs[keep]
+    open_, high, low, close, volume = (np.asarray(bars[f], dtype=float)[keep] for f in BAR_FIELDS[1:])
+    times = epochs_to_market_index(epochs)
+
+    # --- OHLC consistency ---
+    problems = {
+        'high_below_body': high < np.maximum(open_, close),
+        'low_above_body': low > np.minimum(open_, close),
+        'high_below_low': high < low,
+        'non_positive_price': (np.minimum(np.minimum(open_, close), np.minimum(high, low)) <= 0),
+        'negative_volume': volume < 0,
+    }
+    bad = np.zeros(len(epochs), dtype=bool)
+    for name, mask in problems.items():
+        summary[name] = int(mask.sum())
+        bad |= mask
+    ohlc_issues = pd.DataFrame({
+        'time': times[bad], 'open': open_[bad], 'high': high[bad], 'low': low[bad], 'close': close[bad],
+        'volume': volume[bad],
+        'issues': [','.join(name for name, mask in problems.items() if mask[i]) for i in np.flatnonzero(bad)],
+    })
+
+    # --- Sessions ---
+    sessions = assign_sessions(times, symbol)
+    lengths = _session_lengths(symbol)
+    session_open = pd.DatetimeIndex(sessions['session_open']).as_unit('s').asi8
+    session_minutes = sessions['session'].map(lengths).to_numpy(dtype='int64')
+    offsets = (epochs - session_open) // BAR_SECONDS
+    in_session = offsets < session_minutes
+    summary['off_session_bars'] = int((~in_session).sum())
+
+    # --- Intra-session gaps (only bars inside session hours) ---
+    s_epochs, s_open, s_minutes = epochs[in_session], session_open[in_session], session_minutes[in_session]
+    s_names = sessions['session'].to_numpy()[in_session]
+    gap_starts, gap_ends, gap_sessions, gap_names = [], [], [], []
+    if len(s_epochs):
+        new_session = np.r_[True, s_open[1:] != s_open[:-1]]
+        first, last = np.flatnonzero(new_session), np.r_[np.flatnonzero(new_session)[1:], len(s_epochs)] - 1
+        # Missing minutes between consecutive bars of the same session.
+        inner = np.flatnonzero((np.diff(s_epochs) > BAR_SECONDS) & ~new_session[1:])
+        # A session starting late or ending early.
+        late = first[s_epochs[first] > s_open[first]]
+        session_close = s_open + s_minutes * BAR_SECONDS
+        early = last[s_epochs[last] + BAR_SECONDS < session_close[last]]
+        gap_starts = np.r_[s_epochs[inner] + BAR_SECONDS, s_open[late], s_epochs[early] + BAR_SECONDS]
+        gap_ends = np.r_[s_epochs[inner + 1], s_epochs[late], session_close[early]]
+        gap_sessions = np.r_[s_open[inner], s_open[late], s_open[early]]
+        gap_names = np.r_[s_names[inner], s_names[late], s_names[early]]
+    gaps = pd.DataFrame({
+        'session': gap_names,
+        'session_open': epochs_to_market_index(np.asarray(gap_sessions, dtype='int64')),
+        'start': epochs_to_market_index(np.asarray(gap_starts, dtype='int64')),
+        'end': epochs_to_market_index(np.asarray(gap_ends, dtype='int64')),
+        'missing_bars': (np.asarray(gap_ends, dtype='int64') - np.asarray(gap_starts, dtype='int64')) // BAR_SECONDS,
+    }).sort_values('start', ignore_index=True)
+    summary['gaps'] = int(len(gaps))
+    summary['missing_bars'] = int(gaps['missing_bars'].sum())
 
-    try:
+    # --- Zero-volume runs ---
+    run_starts, run_stops = _runs(volume == 0)
+    long_runs = (run_stops - run_starts) >= ZERO_VOLUME_RUN_MIN_BARS
+    run_starts, run_stops = run_starts[long_runs], run_stops[long_runs]
+    zero_volume_runs = pd.DataFrame({
+        'start': times[run_starts], 'end': times[run_stops - 1], 'bars': run_stops - run_starts,
+    })
+    summary['zero_volume_runs'] = int(len(zero_volume_runs))
+
+    # --- Price spikes (returns between consecutive bars of the same session) ---
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(np.log(np.where(close > 0, close, np.nan)))
+    same_session = session_open[1:] == session_open[:-1]
+    valid = same_session & np.isfinite(returns)
+    spikes = pd.DataFrame(columns=['time', 'previous_close', 'close', 'return', 'robust_z'])
+    if valid.any():
+        median = np.median(returns[valid])
+        mad = np.median(np.abs(returns[valid] - median)) * 1.4826
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.abs(returns - median) / mad if mad > 0 else np.where(returns != median, np.inf, 0.0)
+        flagged = np.flatnonzero(valid & (z > SPIKE_ROBUST_Z) & (np.abs(returns) > SPIKE_MIN_RETURN))
+        spikes = pd.DataFrame({
+            'time': times[flagged + 1], 'previous_close': close[flagged], 'close': close[flagged + 1],
+            'return': np.expm1(returns[flagged]), 'robust_z': z[flagged],
+        })
+    summary['spikes'] = int(len(spikes))
+
+    coverage = _daily_coverage(sessions['trading_date'][in_session], lengths)
+    summary['trading_days'] = int(len(coverage))
+    summary['coverage'] = float(coverage['actual'].sum() / coverage['expected'].sum()) if len(coverage) else 0.0
+    return {
+        'summary': summary,
+        'gaps': gaps,
+        'ohlc_issues': ohlc_issues,
+        'zero_volume_runs': zero_volume_runs,
+        'spikes': spikes,
+        'coverage': coverage,
+        'heatmap': coverage_heatmap(coverage),
+    }
+
+
+def _daily_coverage(trading_dates: pd.Series, lengths: Dict[str, int]) -> pd.DataFrame:
+    """
+    In-session bars per trading day against the full calendar, for every business day between the
+    first and last trading day (days without any bar, e.g. holidays or missing files, show 0).
+    """
+    if trading_dates.empty:
+        return pd.DataFrame(columns=['trading_date', 'expected', 'actual', 'coverage'])
+    days = trading_dates.dt.tz_localize(None).dt.normalize()
+    actual = days.value_counts()
+    calendar = pd.bdate_range(days.min(), days.max())
+    coverage = pd.DataFrame({'trading_date': calendar.date, 'expected': sum(lengths.values()),
+                             'actual': actual.reindex(calendar, fill_value=0).to_numpy()})
+    coverage['coverage'] = coverage['actual'] / coverage['expected']
+    return coverage
+
+
+def coverage_heatmap(coverage: pd.DataFrame) -> pd.DataFrame:
+    """Pivots daily coverage into a calendar heatmap: one row per week (its Monday), one column per weekday."""
+    if coverage.empty:
+        return pd.DataFrame(columns=['Mon', 'Tue', 'Wed', 'Thu', 'Fri'])
+    dates = pd.to_datetime(coverage['trading_date'])
+    frame = pd.DataFrame({
+        'week': (dates - pd.to_timedelta(dates.dt.weekday, unit='D')).dt.date,
+        'weekday': dates.dt.weekday,
+        'coverage': coverage['coverage'].to_numpy(),
+    })
+    heatmap = frame.pivot(index='week', columns='weekday', values='coverage')
+    heatmap = heatmap.reindex(columns=range(5))
+    heatmap.columns = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri']
+    return heatmap
+
+
+def scan_market_data(conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL) -> Dict[str, Any]:
+    """Scans the stored 1-minute bars of `symbol` (see `scan_bars`)."""
+    if not _table_exists(conn, TABLE_NAME):
+        return scan_bars({field: np.empty(0) for field in BAR_FIELDS}, symbol)
+    return scan_bars(read_bar_arrays(conn, symbol), symbol)
+
+
+def scan_csv_file(csv_file_path: str, symbol: Optional[str] = None) -> Dict[str, Any]:
+    """Scans a K-line CSV file in file order, which is where duplicate and out-of-order rows show up."""
+    symbol = symbol or symbol_from_filename(csv_file_path)
+    chunks = [rows[rows['symbol'] == symbol] for rows, _ in read_csv_chunks(csv_file_path, symbol=symbol)]
+    rows = pd.concat(chunks) if chunks else pd.DataFrame(columns=list(BAR_FIELDS))
+    return scan_bars({field: rows[field].to_numpy() for field in BAR_FIELDS}, symbol)
+
+
+def _print_report(report: Dict[str, Any], limit: int = 20):
+    summary = report['summary']
+    print(f"=== {summary['symbol']} K 線資料品質報告 ===")
+    for key, value in summary.items():
+        if key != 'symbol':
+            print(f"{key:>20}: {value:.2%}" if key == 'coverage' else f"{key:>20}: {value}")
+    for name, title in (('gaps', '交易時段內缺漏 (依缺漏 K 棒數排序)'), ('ohlc_issues', 'OHLC 不一致'),
+                        ('zero_volume_runs', '連續零成交量'), ('spikes', '價格跳動')):
+        frame = report[name]
+        if frame.empty:
+            continue
+        if name == 'gaps':
+            frame = frame.sort_values('missing_bars', ascending=False)
+        print(f"\n--- {title}: {len(frame)} 筆 (顯示前 {limit} 筆) ---")
+        print(frame.head(limit).to_string(index=False))
+    if not report['heatmap'].empty:
+        print("\n--- 每日覆蓋率 (週 x 星期) ---")
+        print(report['heatmap'].map(lambda v: '' if pd.isna(v) else f"{v:.0%}").to_string())
+
+
+def check_data(symbol: str = DEFAULT_SYMBOL, csv_file: Optional[str] = None, output_dir: Optional[str] = None):
+    """Prints the quality report of the stored bars (or of a CSV file) and optionally writes it as CSV files."""
+    if csv_file:
+        report = scan_csv_file(csv_file, symbol)
+    else:
+        if not os.path.exists(DB_FILE):
+            print(f"資料庫檔案不存在: {DB_FILE}")
+            return
         conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # 檢查資料表是否存在
-        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{TABLE_NAME}';")
-        if cursor.fetchone() is None:
-            print(f"資料表 '{TABLE_NAME}' 不存在於資料庫中。")
+        try:
+            report = scan_market_data(conn, symbol)
+        except sqlite3.Error as e:
+            print(f"查詢資料庫時發生錯誤: {e}")
             return
-
-        # 查詢資料筆數
-        cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME};")
-        count = cursor.fetchone()[0]
-        
-        if count > 0:
-            print(f"資料庫中存在K線資料。'{TABLE_NAME}' 資料表中有 {count} 筆記錄。")
-        else:
-            print(f"資料庫中沒有K線資料。'{TABLE_NAME}' 資料表是空的。")
-            
-    except sqlite3.Error as e:
-        print(f"查詢資料庫時發生錯誤: {e}")
-    finally:
-        if conn:
+        finally:
             conn.close()
 
+    if report['summary']['bars'] == 0:
+        print(f"資料庫中沒有 {symbol} 的K線資料。")
+        return
+    _print_report(report)
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        prefix = os.path.join(output_dir, f"kdata_quality_{report['summary']['symbol']}")
+        for name in ('gaps', 'ohlc_issues', 'zero_volume_runs', 'spikes', 'coverage'):
+            report[name].to_csv(f"{prefix}_{name}.csv", index=False)
+        report['heatmap'].to_csv(f"{prefix}_heatmap.csv")
+        print(f"\n報告已輸出至 {output_dir}")
+
+
 if __name__ == '__main__':
-    check_data()
+    parser = argparse.ArgumentParser(description="Scan 1-minute K-line data for gaps, bad bars and coverage.")
+    parser.add_argument('--symbol', default=DEFAULT_SYMBOL, help='Symbol to scan (default: TXF).')
+    parser.add_argument('--csv', help='Scan a K-line CSV file instead of the database.')
+    parser.add_argument('--out', help='Directory to write the report CSV files to.')
+    args = parser.parse_args()
+    check_data(normalize_symbol(args.symbol), args.csv, args.out)
@@ -0,0 +1,282 @@
+import re
+import os
+import sqlite3
+import argparse
+import logging
+import configparser
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from kline_data import (
+    TABLE_NAME, BAR_ALIGNMENTS, BASE_TIMEFRAME, list_symbols, load_bar_arrays, epochs_to_market_index,
+    normalize_timeframe, rebuild_aggregate_table, _table_exists,
+)
+from trading_session import assign_sessions
+from position_engine import contract_keys
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
+DB_PATH = os.path.join(SCRIPT_DIR, 'trade_notes.db')
+# 單一月份契約的 K 線以「商品代號 + 交割年月」為代號，例如 MTX202509 (檔名 MTX202509_1m_....csv)
+CONTRACT_PATTERN = re.compile(r'^([A-Z]{2,4})(\d{4})(\d{2})$')
+# 連續月 K 線存放於 market_data，代號為商品代號加上此後綴，例如 MTXCONT
+CONTINUOUS_SUFFIX = 'CONT'
+# 換月規則: settlement (於最後結算日的交易日換到次月) 或 volume (次月成交量超過近月的下一個交易日換月，最晚於結算日)
+ROLL_RULES = ('settlement', 'volume')
+# 價格調整: none (不調整)、difference (換月價差往前累加)、ratio (換月價格比往前累乘)
+ADJUSTMENTS = ('none', 'difference', 'ratio')
+DEFAULT_ROLL_RULE = 'settlement'
+DEFAULT_ADJUSTMENT = 'difference'
+ROLLS_TABLE = 'continuous_rolls'
+# 交易紀錄中的商品名稱 (不含月份) 對應的商品代號
+PRODUCT_ROOTS = {
+    '大型期': 'TXF', '台指期': 'TXF', '小型期': 'MTX', '小台': 'MTX', '微型台指期': 'TMF', '微型期': 'TMF',
+}
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+logger = logging.getLogger(__name__)
+
+
+def settlement_date(year: int, month: int) -> pd.Timestamp:
+    """Final settlement day of a TAIFEX index futures contract: the third Wednesday of the delivery month."""
+    first = pd.Timestamp(year=year, month=month, day=1)
+    return first + pd.Timedelta(days=(2 - first.weekday()) % 7 + 14)
+
+
+def continuous_symbol(root: str) -> str:
+    return f"{root}{CONTINUOUS_SUFFIX}"
+
+
+def contract_symbols(product_names: pd.Series, times: pd.Series) -> pd.Series:
+    """
+    Maps broker product names with a delivery month (e.g. '小型期09') traded at `times` to contract
+    symbols ('MTX202509'), using the same delivery-year rule as `position_engine.contract_keys`.
+    Names without a known root or month map to NA.
+    """
+    keys = contract_keys(product_names.astype(str).str.strip(), pd.to_datetime(times))
+    parts = keys.str.extract(r'^(?P<name>.*?)(?P<month>\d{2})@(?P<year>\d{4})$')
+    roots = parts['name'].map(PRODUCT_ROOTS)
+    symbols = roots + parts['year'] + parts['month']
+    return symbols
+
+
+def list_contracts(conn: sqlite3.Connection, root: str) -> List[Tuple[str, pd.Timestamp]]:
+    """Contract-month symbols of `root` with 1-minute bars, with their settlement days, nearest first."""
+    contracts = []
+    for symbol in list_symbols(conn):
+        match = CONTRACT_PATTERN.match(symbol)
+        if match and match.group(1) == root:
+            contracts.append((symbol, settlement_date(int(match.group(2)), int(match.group(3)))))
+    return sorted(contracts, key=lambda item: item[1])
+
+
+def contract_roots(symbols) -> List[str]:
+    """Roots that appear among `symbols` as contract months (e.g. {'MTX202509', 'TXF'} -> ['MTX'])."""
+    return sorted({match.group(1) for match in map(CONTRACT_PATTERN.match, symbols) if match})
+
+
+def _contract_bars(conn: sqlite3.Connection, symbol: str, root: str) -> Dict[str, np.ndarray]:
+    """All bars of a contract as arrays, plus the TAIFEX trading date of each bar (as datetime64[D])."""
+    bars = load_bar_arrays(conn, columns=BAR_COLUMNS, symbol=symbol)
+    sessions = assign_sessions(epochs_to_market_index(bars['time']), root)
+    bars['trading_date'] = sessions['trading_date'].dt.tz_localize(None).to_numpy().astype('datetime64[D]')
+    return bars
+
+
+def _daily_volume(bars: Dict[str, np.ndarray]) -> pd.Series:
+    return pd.Series(bars['volume'], index=bars['trading_date']).groupby(level=0).sum()
+
+
+def roll_dates(contracts: List[Tuple[str, pd.Timestamp]], bars: Dict[str, Dict[str, np.ndarray]],
+               rule: str = DEFAULT_ROLL_RULE) -> List[np.datetime64]:
+    """
+    Returns, for each pair of consecutive contracts, the first trading date served by the later one.
+
+    - 'settlement': the final settlement day itself, so the expiring contract is not used on its last,
+      thinly traded day (its night session before belongs to the same trading date).
+    - 'volume': the trading date after the first day on which the next contract traded more than the
+      current one (decided on a completed day, so no look-ahead), but no later than settlement.
+    """
+    if rule not in ROLL_RULES:
+        raise ValueError(f"Unknown roll rule: {rule}")
+    dates = []
+    for (current, settlement), (following, _) in zip(contracts, contracts[1:]):
+        roll = np.datetime64(settlement.date(), 'D')
+        if rule == 'volume':
+            volumes = pd.concat([_daily_volume(bars[current]), _daily_volume(bars[following])],
+                                axis=1, keys=['current', 'next']).fillna(0)
+            crossed = volumes.index[(volumes['next'] > volumes['current']).to_numpy()]
+            crossed = crossed[crossed < roll]
+            if len(crossed):
+                roll = min(roll, np.busday_offset(np.datetime64(crossed[0], 'D'), 1, roll='forward'))
+        if dates and roll < dates[-1]:
+            roll = dates[-1]
+        dates.append(roll)
+    return dates
+
+
+def build_continuous_series(conn: sqlite3.Connection, root: str, rule: str = DEFAULT_ROLL_RULE,
+                            adjustment: str = DEFAULT_ADJUSTMENT) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Stitches the contract months of `root` into one continuous 1-minute series. Contract i serves
+    the trading dates [roll i-1, roll i). At each roll the price gap is measured between the last
+    bar of the old segment and the new contract's latest bar at or before it; with back-adjustment
+    every earlier segment is shifted by the gaps of all later rolls ('difference') or scaled by
+    their ratios ('ratio'), so the latest segment keeps real prices.
+
+    Returns the bars (`epoch`, OHLCV, `contract`) and the rolls (`roll_date`, `roll_epoch`,
+    `from_contract`, `to_contract`, `gap`, `ratio`).
+    """
+    if adjustment not in ADJUSTMENTS:
+        raise ValueError(f"Unknown adjustment: {adjustment}")
+    contracts = list_contracts(conn, root)
+    bars = {symbol: _contract_bars(conn, symbol, root) for symbol, _ in contracts}
+    dates = roll_dates(contracts, bars, rule)
+
+    segments, rolls = [], []
+    bounds = [np.datetime64('NaT')] + dates + [np.datetime64('NaT')]
+    for i, (symbol, _) in enumerate(contracts):
+        contract = bars[symbol]
+        lower, upper = bounds[i], bounds[i + 1]
+        keep = np.ones(len(contract['time']), dtype=bool)
+        if not np.isnat(lower):
+            keep &= contract['trading_date'] >= lower
+        if not np.isnat(upper):
+            keep &= contract['trading_date'] < upper
+        segment = {column: contract[column][keep] for column in ('time',) + BAR_COLUMNS}
+        segments.append(segment)
+
+    for i, roll in enumerate(dates):
+        old, new = segments[i], bars[contracts[i + 1][0]]
+        gap, ratio = 0.0, 1.0
+        if len(old['time']):
+            last_time = old['time'][-1]
+            position = np.searchsorted(new['time'], last_time, side='right') - 1
+            if position >= 0:
+                gap = float(new['close'][position] - old['close'][-1])
+                ratio = float(new['close'][position] / old['close'][-1])
+            else:
+                logger.warning(f"{contracts[i + 1][0]} has no bar before the roll on {roll}; rolled without adjustment.")
+        following = segments[i + 1]['time']
+        rolls.append({
+            'roll_date': str(roll), 'roll_epoch': int(following[0]) if len(following) else None,
+            'from_contract': contracts[i][0], 'to_contract': contracts[i + 1][0], 'gap': gap, 'ratio': ratio,
+        })
+
+    # Each segment is adjusted by the gaps (ratios) of every later roll.
+    gaps = np.array([r['gap'] for r in rolls], dtype=float)
+    ratios = np.array([r['ratio'] for r in rolls], dtype=float)
+    offsets = np.r_[np.cumsum(gaps[::-1])[::-1], 0.0]
+    factors = np.r_[np.cumprod(ratios[::-1])[::-1], 1.0]
+
+    frames = []
+    for i, segment in enumerate(segments):
+        frame = pd.DataFrame({'epoch': segment['time'], **{c: segment[c] for c in BAR_COLUMNS}})
+        prices = ['open', 'high', 'low', 'close']
+        if adjustment == 'difference':
+            frame[prices] = frame[prices] + offsets[i]
+        elif adjustment == 'ratio':
+            frame[prices] = frame[prices] * factors[i]
+        frame['contract'] = contracts[i][0]
+        frames.append(frame)
+    series = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=['epoch', *BAR_COLUMNS, 'contract'])
+    return series, pd.DataFrame(rolls, columns=['roll_date', 'roll_epoch', 'from_contract', 'to_contract', 'gap', 'ratio'])
+
+
+def create_rolls_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLS_TABLE} (
+            symbol TEXT NOT NULL,
+            roll_date TEXT NOT NULL,
+            roll_epoch INTEGER,
+            from_contract TEXT NOT NULL,
+            to_contract TEXT NOT NULL,
+            gap REAL,
+            ratio REAL,
+            rule TEXT,
+            adjustment TEXT,
+            PRIMARY KEY (symbol, roll_date)
+        )
+    """)
+
+
+def store_continuous_series(conn: sqlite3.Connection, root: str, rule: str = DEFAULT_ROLL_RULE,
+                            adjustment: str = DEFAULT_ADJUSTMENT, aggregate_timeframes: Optional[List[str]] = None) -> int:
+    """
+    Builds the continuous series of `root` and stores it in `market_data` as `{root}CONT` (replacing
+    the previous copy, since a new roll re-adjusts the whole history), its rolls in `continuous_rolls`,
+    and rebuilds that symbol's pre-aggregated bar tables. Returns the number of bars stored.
+    """
+    symbol = continuous_symbol(root)
+    series, rolls = build_continuous_series(conn, root, rule, adjustment)
+    create_rolls_table(conn)
+    conn.execute(f"DELETE FROM {TABLE_NAME} WHERE symbol = ?", (symbol,))
+    conn.execute(f"DELETE FROM {ROLLS_TABLE} WHERE symbol = ?", (symbol,))
+    rows = zip([symbol] * len(series), series['epoch'].astype('int64').tolist(),
+               series['open'].tolist(), series['high'].tolist(), series['low'].tolist(), series['close'].tolist(),
+               series['volume'].astype('int64').tolist())
+    conn.executemany(f"INSERT INTO {TABLE_NAME} (symbol, epoch, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany(
+        f"INSERT INTO {ROLLS_TABLE} (symbol, roll_date, roll_epoch, from_contract, to_contract, gap, ratio, rule, adjustment) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(symbol, r.roll_date, None if pd.isna(r.roll_epoch) else int(r.roll_epoch), r.from_contract, r.to_contract,
+          r.gap, r.ratio, rule, adjustment) for r in rolls.itertuples(index=False)],
+    )
+    for timeframe in aggregate_timeframes or []:
+        freq = normalize_timeframe(timeframe)
+        if freq == BASE_TIMEFRAME:
+            continue
+        for align in BAR_ALIGNMENTS:
+            rebuild_aggregate_table(conn, freq, align, symbols=[symbol])
+    conn.commit()
+    logger.info(f"Stored {len(series)} {symbol} bars from {len(rolls) + 1 if len(series) else 0} contracts "
+                f"(roll: {rule}, adjustment: {adjustment}).")
+    return len(series)
+
+
+def load_continuous_settings(config_path: str = CONFIG_PATH) -> Tuple[str, str]:
+    """Returns the roll rule and adjustment (`continuous_roll` / `continuous_adjustment` in [KData])."""
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    rule = config.get('KData', 'continuous_roll', fallback=DEFAULT_ROLL_RULE).strip().lower()
+    adjustment = config.get('KData', 'continuous_adjustment', fallback=DEFAULT_ADJUSTMENT).strip().lower()
+    if rule not in ROLL_RULES:
+        logger.warning(f"忽略無效的 continuous_roll 設定: {rule}")
+        rule = DEFAULT_ROLL_RULE
+    if adjustment not in ADJUSTMENTS:
+        logger.warning(f"忽略無效的 continuous_adjustment 設定: {adjustment}")
+        adjustment = DEFAULT_ADJUSTMENT
+    return rule, adjustment
+
+
+def main():
+    """Rebuilds the stored continuous series (all roots with contract-month data unless --root is given)."""
+    from import_kdata import load_aggregate_timeframes
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    rule, adjustment = load_continuous_settings()
+    parser = argparse.ArgumentParser(description="Stitch contract-month K-lines into continuous series.")
+    parser.add_argument('--root', action='append', help='Product root such as MTX (repeatable; default: all).')
+    parser.add_argument('--roll', choices=ROLL_RULES, default=rule, help='Roll rule.')
+    parser.add_argument('--adjust', choices=ADJUSTMENTS, default=adjustment, help='Back-adjustment method.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if not _table_exists(conn, TABLE_NAME):
+            print("資料庫中沒有K線資料。")
+            return
+        roots = [root.upper() for root in args.root] if args.root else contract_roots(list_symbols(conn))
+        for root in roots:
+            count = store_continuous_series(conn, root, args.roll, args.adjust, load_aggregate_timeframes())
+            print(f"{continuous_symbol(root)}: {count} bars")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import logging
+import sqlite3
+from typing import Callable, List, NamedTuple, Union
+
+from kline_data import upgrade_bar_tables
+from trade_cube import rebuild_trade_cube, CUBE_TABLE
+from accounts import add_account_columns, add_fill_account_column
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    # SQL statements, or callables taking the connection for steps that need Python (data conversion)
+    statements: List[Union[str, Callable[[sqlite3.Connection], None]]]
+
+
+# 資料庫結構版本紀錄於 `PRAGMA user_version`。
+# 新增索引或調整資料表時，請在清單尾端加上新的版本，切勿修改已發布的版本內容。
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Index trades by source file and trade time", [
+        # TradeAuditor reloads a file's trades with `WHERE source_file = ?`.
+        "CREATE INDEX IF NOT EXISTS idx_trades_source_file ON trades (source_file)",
+        # /api/trade_data reads a visible time window.
+        "CREATE INDEX IF NOT EXISTS idx_trades_trade_time ON trades (trade_time)",
+    ]),
+    Migration(2, "Index TransactionData for time-range reads and open-fill lookups", [
+        "CREATE INDEX IF NOT EXISTS idx_transactiondata_transaction_time ON TransactionData (transaction_time)",
+        # Covers the (position_type, product, price) -> time lookup used to match opening fills.
+        "CREATE INDEX IF NOT EXISTS idx_transactiondata_open_fill "
+        "ON TransactionData (position_type, product_name, price, transaction_time)",
+    ]),
+    Migration(3, "Keyed trades_merged table and merge watermarks for incremental merging", [
+        # trades_merged is derived data; the old replace-on-merge copy is dropped and rebuilt by the next merge.
+        "DROP TABLE IF EXISTS trades_merged",
+        """
+        CREATE TABLE trades_merged (
+            trade_id TEXT PRIMARY KEY,
+            trade_time DATETIME,
+            action TEXT,
+            net_pnl REAL,
+            contracts INTEGER,
+            product_name TEXT,
+            source_file TEXT,
+            open_price REAL,
+            close_price REAL,
+            fee REAL,
+            tax REAL,
+            open_trade_time TEXT,
+            open_fill_id INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_trades_merged_open_fill_id ON trades_merged (open_fill_id)",
+        # Highest trades.rowid / TransactionData.id already merged.
+        "CREATE TABLE IF NOT EXISTS merge_watermarks (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)",
+    ]),
+    Migration(4, "Per-trade MAE/MFE table", [
+        """
+        CREATE TABLE IF NOT EXISTS trade_excursions (
+            trade_id TEXT PRIMARY KEY,
+            direction TEXT,
+            entry_price REAL,
+            mae REAL,
+            mfe REAL,
+            time_to_mfe_seconds INTEGER,
+            bars INTEGER
+        )
+        """,
+    ]),
+    Migration(5, "Key market_data and derived bar tables by (symbol, epoch) WITHOUT ROWID", [
+        # Existing rows are assigned to the default symbol (TXF).
+        upgrade_bar_tables,
+    ]),
+    Migration(6, "Materialized trade performance cube (hour x weekday x month x product x action)", [
+        # Filled from the existing trades; later imports add their new trades incrementally.
+        rebuild_trade_cube,
+    ]),
+    Migration(7, "Accounts table and account dimension on trades and the trade cube", [
+        # Existing trades belong to the default account.
+        add_account_columns,
+        "CREATE INDEX IF NOT EXISTS idx_trades_account_source_file ON trades (account_id, source_file)",
+        "CREATE INDEX IF NOT EXISTS idx_trades_account_trade_time ON trades (account_id, trade_time)",
+        # The cube gains the account in its key; it is derived data and rebuilt from trades.
+        f"DROP TABLE IF EXISTS {CUBE_TABLE}",
+        rebuild_trade_cube,
+    ]),
+    Migration(8, "Account dimension on TransactionData and trades_merged; fills match only their account's trades", [
+        add_fill_account_column,
+        "CREATE INDEX IF NOT EXISTS idx_transactiondata_transaction_time ON TransactionData (transaction_time)",
+        "CREATE INDEX IF NOT EXISTS idx_transactiondata_open_fill "
+        "ON TransactionData (position_type, product_name, price, transaction_time)",
+        # Earlier merges matched fills across accounts; the derived rows are dropped and rebuilt by the next merge.
+        "DROP TABLE IF EXISTS trades_merged",
+        """
+        CREATE TABLE trades_merged (
+            trade_id TEXT PRIMARY KEY,
+            trade_time DATETIME,
+            action TEXT,
+            net_pnl REAL,
+            contracts INTEGER,
+            product_name TEXT,
+            source_file TEXT,
+            open_price REAL,
+            close_price REAL,
+            fee REAL,
+            tax REAL,
+            open_trade_time TEXT,
+            open_fill_id INTEGER,
+            account_id TEXT NOT NULL DEFAULT 'default'
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_trades_merged_open_fill_id ON trades_merged (open_fill_id)",
+        "CREATE INDEX IF NOT EXISTS idx_trades_merged_account ON trades_merged (account_id)",
+        "DELETE FROM merge_watermarks",
+        "DELETE FROM trade_excursions",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[Migration] = MIGRATIONS) -> int:
+    """
+    Upgrades the database in place by applying, in order, every migration newer than its
+    `user_version`. Each migration runs in its own transaction together with the version bump,
+    so a failure leaves the database at the last fully applied version.
+    Returns the resulting schema version.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    current = get_schema_version(conn)
+    for migration in sorted(migrations, key=lambda m: m.version):
+        if migration.version <= current:
+            continue
+        logger.info(f"Applying database migration {migration.version}: {migration.description}")
+        try:
+            conn.execute("BEGIN")
+            for statement in migration.statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logger.error(f"Database migration {migration.version} failed; schema left at version {current}.")
+            raise
+        current = migration.version
+    return current
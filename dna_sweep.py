@@ -0,0 +1,70 @@
+import logging
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_thresholds(min_threshold: float, max_threshold: float, step: float) -> np.ndarray:
+    """Noise thresholds from `min_threshold` to `max_threshold` (inclusive when reached exactly) in `step` increments."""
+    if step <= 0 or min_threshold > max_threshold:
+        raise ValueError("Invalid sweep range: step must be positive and min_threshold <= max_threshold.")
+    return min_threshold + step * np.arange(int(np.floor((max_threshold - min_threshold) / step + 1e-9)) + 1)
+
+
+def dna_threshold_sweep(points: pd.Series, pnl: pd.Series, thresholds: np.ndarray,
+                        rules: Dict[str, float]) -> List[Dict[str, Any]]:
+    """
+    Noise/trend zone statistics and verdicts of the Trading DNA diagnosis for every threshold at once,
+    using the verdict thresholds in `rules` (TRADING_DNA_RULES).
+    |points| is sorted once; each threshold's noise zone is a prefix found with searchsorted,
+    so its count, PnL and wins come from cumulative sums (O(n log n) for the whole curve).
+    Trades without points fall in neither zone, as in the single-threshold diagnosis.
+    """
+    total_trades = len(points)
+    points = pd.to_numeric(points, errors='coerce').to_numpy(dtype=float)
+    valid = ~np.isnan(points)
+    order = np.argsort(np.abs(points[valid]), kind='stable')
+    sorted_points = np.abs(points[valid])[order]
+    pnl = pnl.to_numpy(dtype=float)[valid][order]
+    cum_pnl = np.concatenate(([0.0], np.cumsum(pnl)))
+    cum_wins = np.concatenate(([0], np.cumsum(pnl > 0)))
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    noise_count = np.searchsorted(sorted_points, thresholds, side='right')
+    noise_pnl, noise_wins = cum_pnl[noise_count], cum_wins[noise_count]
+    trend_count = len(sorted_points) - noise_count
+    trend_pnl, trend_wins = cum_pnl[-1] - noise_pnl, cum_wins[-1] - noise_wins
+    with np.errstate(divide='ignore', invalid='ignore'):
+        noise_win_rate = np.where(noise_count > 0, noise_wins / noise_count, 0.0)
+        trend_win_rate = np.where(trend_count > 0, trend_wins / trend_count, 0.0)
+
+    stuck = (noise_count / total_trades > rules['NOISE_ZONE_TRADE_PERCENT_THRESHOLD']) & (noise_pnl < 0)
+    noise_verdict = np.where(noise_count == 0, "N/A",
+                             np.where(stuck, "陷入泥淖 (Stuck in the Mud)", "防守得宜 (Good Defense)"))
+    trend_verdict = np.where(trend_count == 0, "N/A",
+                             np.where(trend_win_rate >= rules['TREND_ZONE_WIN_RATE_THRESHOLD'],
+                                      "獲利核心 (Profit Core)", "錯失行情 (Missed Trends)"))
+
+    curve = []
+    for i, threshold in enumerate(thresholds):
+        curve.append({
+            "threshold": float(threshold),
+            "noise_zone": {
+                "trade_count": int(noise_count[i]),
+                "trade_ratio": round(float(noise_count[i] / total_trades), 4),
+                "win_rate": f"{noise_win_rate[i]:.2%}",
+                "total_pnl": round(float(noise_pnl[i]), 2),
+                "verdict": str(noise_verdict[i]),
+            },
+            "trend_zone": {
+                "trade_count": int(trend_count[i]),
+                "trade_ratio": round(float(trend_count[i] / total_trades), 4),
+                "win_rate": f"{trend_win_rate[i]:.2%}",
+                "total_pnl": round(float(trend_pnl[i]), 2),
+                "verdict": str(trend_verdict[i]),
+            },
+        })
+    return curve
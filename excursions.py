@@ -0,0 +1,149 @@
+import logging
+import sqlite3
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from kline_data import load_bar_arrays, MARKET_TZ, TABLE_NAME
+from trade_matching import MERGED_TABLE, UNMATCHED_OPEN_TIME
+from market_context import trade_symbols
+
+# --- Configuration ---
+EXCURSIONS_TABLE = 'trade_excursions'
+# trades 的買賣別: 先買後賣為多單，先賣後買為空單
+LONG_ACTION = '買進->賣出'
+SHORT_ACTION = '賣出->買進'
+BAR_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def compute_excursions(round_trips: pd.DataFrame, bars: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Computes the maximum adverse and favorable excursion (in points, both >= 0) of each round trip
+    over the 1-minute bars it was held through, plus the seconds from entry to the MFE bar.
+
+    `round_trips` needs `open_epoch`, `close_epoch` (UNIX seconds), `direction` (+1 long, -1 short)
+    and `entry_price`; `bars` is the output of `load_bar_arrays` (ascending `time`, `high`, `low`).
+    Each holding window is located with `searchsorted` on the bar times; the windows are concatenated and
+    reduced with `np.maximum.reduceat` / `np.minimum.reduceat`, and the MFE bar is found in the same
+    vectorized pass, so the cost is proportional to the covered bars with no per-trade loop.
+    Trades without any covered bar get NaN excursions and `bars == 0`.
+    """
+    times, highs, lows = bars['time'], bars['high'], bars['low']
+    opens = round_trips['open_epoch'].to_numpy(dtype='int64')
+    closes = round_trips['close_epoch'].to_numpy(dtype='int64')
+    directions = round_trips['direction'].to_numpy(dtype=float)
+    entries = round_trips['entry_price'].to_numpy(dtype=float)
+
+    # Bars whose minute overlaps [open, close]: from the bar containing the entry to the one containing the exit.
+    starts = np.searchsorted(times, opens - opens % BAR_SECONDS, side='left')
+    ends = np.searchsorted(times, closes, side='right')
+    counts = np.maximum(ends - starts, 0)
+    covered = counts > 0
+
+    result = pd.DataFrame({
+        'mae': np.nan, 'mfe': np.nan, 'time_to_mfe_seconds': np.nan, 'bars': counts,
+    }, index=round_trips.index)
+    if not covered.any() or len(times) == 0:
+        return result
+
+    # The holding windows laid end to end (`segment` is each element's window), so every reduction is
+    # one pass over the covered bars only, whatever the order of the trades.
+    window_starts, lengths = starts[covered], counts[covered]
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    positions = window_starts[segment] + np.arange(len(segment)) - offsets[segment]
+    window_high = np.maximum.reduceat(highs[positions], offsets)
+    window_low = np.minimum.reduceat(lows[positions], offsets)
+
+    long_side = directions[covered] > 0
+    entry = entries[covered]
+    mfe = np.where(long_side, window_high - entry, entry - window_low)
+    mae = np.where(long_side, entry - window_low, window_high - entry)
+
+    # The first bar reaching the favorable extreme: flag the bars equal to their window's extreme,
+    # then take the first flag at or after each window's offset.
+    favorable = np.where(long_side[segment], highs[positions], lows[positions])
+    hits = np.flatnonzero(favorable == np.where(long_side, window_high, window_low)[segment])
+    # The sentinel past the last window keeps searchsorted in range.
+    first = np.append(hits, len(segment))[np.searchsorted(hits, offsets)]
+    # A window without a hit (NaN prices) falls back to its first bar.
+    first_hit = window_starts + np.where(first < offsets + lengths, first - offsets, 0)
+
+    time_to_mfe = np.maximum(times[first_hit] - opens[covered], 0)
+    result.loc[covered, 'mae'] = np.maximum(mae, 0)
+    result.loc[covered, 'mfe'] = np.maximum(mfe, 0)
+    result.loc[covered, 'time_to_mfe_seconds'] = time_to_mfe
+    return result
+
+
+def _merged_round_trips(conn: sqlite3.Connection, full: bool) -> pd.DataFrame:
+    """Loads matched trades from trades_merged (only those without stored excursions unless `full`)."""
+    query = f"""
+        SELECT m.trade_id, m.trade_time, m.open_trade_time, m.action, m.open_price, m.product_name
+        FROM {MERGED_TABLE} m
+        WHERE m.open_trade_time IS NOT NULL AND m.open_trade_time != ?
+    """
+    if not full:
+        query += f" AND NOT EXISTS (SELECT 1 FROM {EXCURSIONS_TABLE} e WHERE e.trade_id = m.trade_id)"
+    trades = pd.read_sql_query(query, conn, params=(UNMATCHED_OPEN_TIME,))
+    trades = trades[trades['action'].isin([LONG_ACTION, SHORT_ACTION])]
+
+    def epochs(column):
+        local = pd.to_datetime(trades[column], format='ISO8601').dt.tz_localize(MARKET_TZ)
+        return (local - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+
+    return pd.DataFrame({
+        'trade_id': trades['trade_id'],
+        'product_name': trades['product_name'],
+        'trade_time': trades['trade_time'],
+        'open_epoch': epochs('open_trade_time'),
+        'close_epoch': epochs('trade_time'),
+        'direction': np.where(trades['action'] == LONG_ACTION, 1, -1),
+        'entry_price': trades['open_price'],
+    })
+
+
+def update_trade_excursions(conn: sqlite3.Connection, full: bool = False, bar_store=None) -> int:
+    """
+    Computes MAE/MFE for merged trades that have an open time and stores them per `trade_id` in
+    `trade_excursions`. Only trades without stored results are processed unless `full` is set;
+    trades not yet covered by K-line data are skipped and picked up after a later import.
+    Each trade is measured on its own product's bars (see `market_context.trade_symbols`, here over
+    market_data), one symbol at a time. Bars are read from `bar_store` (a `bar_store.BarStore`) when it
+    holds the symbol, else from SQLite. Returns the number of trades stored.
+    """
+    round_trips = _merged_round_trips(conn, full)
+    if round_trips.empty:
+        return 0
+
+    symbols = trade_symbols(conn, round_trips['product_name'], round_trips['trade_time'], TABLE_NAME)
+    excursions = []
+    for symbol, trips in round_trips.groupby(symbols, sort=False):
+        lower = int(trips['open_epoch'].min()) // BAR_SECONDS * BAR_SECONDS
+        upper = int(trips['close_epoch'].max()) + 1
+        if bar_store is not None and bar_store.has_symbol(symbol):
+            bars = bar_store.load_bar_arrays(lower, upper, symbol=symbol)
+        else:
+            bars = load_bar_arrays(conn, pd.Timestamp(lower, unit='s', tz='UTC').tz_convert(MARKET_TZ),
+                                   pd.Timestamp(upper, unit='s', tz='UTC').tz_convert(MARKET_TZ), symbol=symbol)
+        excursions.append(compute_excursions(trips, bars))
+
+    stored = pd.concat([round_trips, pd.concat(excursions)], axis=1)
+    stored = stored[stored['bars'] > 0]
+    rows = [
+        (r.trade_id, 'long' if r.direction > 0 else 'short', float(r.entry_price), float(r.mae), float(r.mfe),
+         int(r.time_to_mfe_seconds), int(r.bars))
+        for r in stored.itertuples(index=False)
+    ]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {EXCURSIONS_TABLE} "
+        "(trade_id, direction, entry_price, mae, mfe, time_to_mfe_seconds, bars) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.commit()
+    logger.info(f"Stored excursions for {len(rows)} of {len(round_trips)} trades "
+                f"({len(round_trips) - len(rows)} not covered by K-line data).")
+    return len(rows)
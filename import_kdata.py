@@ -1,8 +1,26 @@
 import os
 import glob
+import queue
+import hashlib
+import argparse
 import pandas as pd
 import sqlite3
 import logging
+import configparser
+import multiprocessing
+from datetime import datetime
+
+from kline_data import (
+    DEFAULT_AGGREGATE_TIMEFRAMES, normalize_timeframe, epoch_to_market_time, create_bar_table, upgrade_bar_tables,
+    refresh_aggregate_tables,
+)
+from kdata_csv import (
+    COLUMN_MAPPING, REQUIRED_COLUMNS, CSV_CHUNK_SIZE, PARSE_QUEUE_CHUNKS, symbol_from_filename, read_csv_chunks,
+    parse_csv_to_queue,
+)
+from bar_store import load_bar_store
+from continuous_futures import contract_roots, store_continuous_series, load_continuous_settings, continuous_symbol
+from market_context import update_market_indicators
 
 # --- Configuration ---
 # 設定日誌記錄，方便追蹤執行狀況
@@ -14,7 +32,12 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # Build absolute paths to the database and KData directory
 DB_PATH = os.path.join(SCRIPT_DIR, 'trade_notes.db')
 KDATA_DIR = os.path.join(SCRIPT_DIR, 'KData')
+CONFIG_PATH = os.path.join(SCRIPT_DIR, 'config.ini')
 TABLE_NAME = 'market_data'
+# 記錄已匯入檔案 (大小、修改時間、內容雜湊與資料範圍) 的資料表，未變更的檔案不再重新匯入
+MANIFEST_TABLE = 'kdata_import_manifest'
+# 平行解析 CSV 的預設行程數 (可由 config.ini [KData] import_workers 覆寫)
+DEFAULT_IMPORT_WORKERS = 4
 # --- End Configuration ---
 
 def create_connection(db_file):
@@ -28,87 +51,210 @@ def create_connection(db_file):
     return conn
 
 def create_market_data_table(conn):
-    """如果 market_data 資料表不存在，則建立該表"""
-    # 使用 IF NOT EXISTS 避免重複建立
-    # 將 datetime 設為 PRIMARY KEY，以確保資料的唯一性
-    create_table_sql = f"""
-    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-        datetime TEXT PRIMARY KEY,
-        open REAL NOT NULL,
-        high REAL NOT NULL,
-        low REAL NOT NULL,
-        close REAL NOT NULL,
-        volume INTEGER NOT NULL
-    );
-    """
+    """如果 market_data 資料表不存在，則建立該表；舊版以 datetime 文字為主鍵的資料表會先轉換"""
+    # 以 (symbol, epoch) 為主鍵，確保資料的唯一性
     try:
-        c = conn.cursor()
-        c.execute(create_table_sql)
+        upgrade_bar_tables(conn)
+        create_bar_table(conn, TABLE_NAME)
+        conn.commit()
         logging.info(f"資料表 '{TABLE_NAME}' 已成功準備就緒。")
     except sqlite3.Error as e:
         logging.error(f"建立資料表失敗: {e}")
 
-def import_csv_to_db(conn, csv_file_path):
+def create_import_manifest_table(conn):
+    """如果匯入紀錄資料表不存在，則建立該表"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            symbols TEXT,
+            row_count INTEGER,
+            first_epoch INTEGER,
+            last_epoch INTEGER,
+            imported_at TEXT
+        )
+    """)
+    conn.commit()
+
+def load_import_workers(config_path=CONFIG_PATH):
+    """Returns the number of worker processes for parsing CSV files (`import_workers` in [KData])."""
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    try:
+        workers = config.getint('KData', 'import_workers', fallback=DEFAULT_IMPORT_WORKERS)
+    except ValueError:
+        logging.warning("忽略無效的 import_workers 設定")
+        workers = DEFAULT_IMPORT_WORKERS
+    return max(1, min(workers, os.cpu_count() or 1))
+
+def load_aggregate_timeframes(config_path=CONFIG_PATH):
     """
-    Reads a single CSV file and imports its content into the database.
-    Returns the number of new rows inserted and duplicate rows skipped.
+    Returns the timeframes to pre-aggregate at import: the defaults plus any listed under
+    `aggregate_timeframes` in the [KData] section of config.ini (e.g. `aggregate_timeframes = 30T, 4H`).
     """
-    try:
-        logging.info(f"Reading file: {os.path.basename(csv_file_path)}")
-        df = pd.read_csv(csv_file_path)
-
-        column_mapping = {
-            'Time': 'datetime', 'Datetime': 'datetime', '時間': 'datetime',
-            'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume',
-            '開盤價': 'open', '最高價': 'high', '最低價': 'low', '收盤價': 'close', '成交量': 'volume'
-        }
-        df.rename(columns=column_mapping, inplace=True)
-
-        required_cols = ['datetime', 'open', 'high', 'low', 'close', 'volume']
-        if not all(col in df.columns for col in required_cols):
-            logging.error(f"File {os.path.basename(csv_file_path)} is missing required columns. Skipping. "
-                          f"Required: {required_cols}, Found: {df.columns.tolist()}")
-            return 0, 0
-
-        rows_to_insert = df[required_cols].to_records(index=False).tolist()
-        
-        if not rows_to_insert:
-            logging.warning(f"File {os.path.basename(csv_file_path)} contains no data to import.")
-            return 0, 0
-            
-        cursor = conn.cursor()
-        
-        insert_sql = f"INSERT OR IGNORE INTO {TABLE_NAME} (datetime, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?)"
-        
-        cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
-        initial_row_count = cursor.fetchone()[0]
+    timeframes = list(DEFAULT_AGGREGATE_TIMEFRAMES)
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+    extra = config.get('KData', 'aggregate_timeframes', fallback='')
 
-        cursor.executemany(insert_sql, rows_to_insert)
-        conn.commit()
+    for item in filter(None, (part.strip() for part in extra.split(','))):
+        try:
+            freq = normalize_timeframe(item)
+        except ValueError:
+            logging.warning(f"忽略無效的聚合週期設定: {item}")
+            continue
+        if freq not in timeframes:
+            timeframes.append(freq)
+    return timeframes
 
-        cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
-        final_row_count = cursor.fetchone()[0]
-        
-        inserted_rows = final_row_count - initial_row_count
-        skipped_rows = len(rows_to_insert) - inserted_rows
+def write_chunks(conn, chunks, aggregate_timeframes=None, on_rows_added=None, bar_store=None):
+    """
+    Inserts prepared chunks, each in its own transaction, then refreshes the pre-aggregated tables,
+    the stored market indicators (and the optional `bar_store`) for each symbol's span that received new rows. New rows are
+    counted from SQLite's change counter.
+    Returns a summary: inserted, skipped (duplicates), dropped (unparseable), rows, symbols and the
+    first/last epoch of the file's valid rows.
+    """
+    insert_sql = f"INSERT OR IGNORE INTO {TABLE_NAME} (symbol, epoch, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    summary = {'inserted': 0, 'skipped': 0, 'dropped': 0, 'rows': 0, 'symbols': set(),
+               'first_epoch': None, 'last_epoch': None}
+    added_spans = {}  # symbol -> [first, last] epochs of groups that added rows
+    for rows, dropped in chunks:
+        summary['dropped'] += dropped
+        summary['rows'] += len(rows)
+        for chunk_symbol, group in rows.groupby('symbol', sort=False):
+            changes_before = conn.total_changes
+            conn.executemany(insert_sql, group.itertuples(index=False, name=None))
+            added = conn.total_changes - changes_before
+            summary['inserted'] += added
+            summary['skipped'] += len(group) - added
+            summary['symbols'].add(chunk_symbol)
+            first, last = int(group['epoch'].min()), int(group['epoch'].max())
+            summary['first_epoch'] = first if summary['first_epoch'] is None else min(summary['first_epoch'], first)
+            summary['last_epoch'] = last if summary['last_epoch'] is None else max(summary['last_epoch'], last)
+            if added:
+                span = added_spans.setdefault(chunk_symbol, [first, last])
+                span[0], span[1] = min(span[0], first), max(span[1], last)
+        conn.commit()
 
-        logging.info(f"Processed {os.path.basename(csv_file_path)}: "
-                     f"New rows: {inserted_rows}, "
-                     f"Skipped duplicates: {skipped_rows}.")
-        return inserted_rows, skipped_rows
+    for added_symbol, (first, last) in added_spans.items():
+        first_added, last_added = epoch_to_market_time(first), epoch_to_market_time(last)
+        refresh_aggregate_tables(conn, first_added, last_added, aggregate_timeframes, added_symbol)
+        conn.commit()
+        if bar_store is not None:
+            bar_store.sync(conn, added_symbol, first)
+        update_market_indicators(conn, added_symbol, first)
+        if on_rows_added is not None:
+            on_rows_added(first_added, last_added, added_symbol)
+    return summary
 
+def import_csv_to_db(conn, csv_file_path, aggregate_timeframes=None, on_rows_added=None, chunk_size=CSV_CHUNK_SIZE,
+                     symbol=None, bar_store=None):
+    """
+    Streams a single CSV file into the database in chunks of `chunk_size` rows (see `write_chunks`),
+    keeping `bar_store` (when given) in sync.
+    The symbol comes from a `symbol` column, else `symbol`, else the file name prefix.
+    `on_rows_added(first, last, symbol)` is called with each symbol's span so callers can invalidate caches.
+    Returns the number of new rows inserted and duplicate rows skipped.
+    """
+    basename = os.path.basename(csv_file_path)
+    try:
+        logging.info(f"Reading file: {basename}")
+        summary = write_chunks(conn, read_csv_chunks(csv_file_path, chunk_size, symbol), aggregate_timeframes, on_rows_added,
+                               bar_store)
     except pd.errors.EmptyDataError:
         logging.warning(f"File {csv_file_path} is empty. Skipping.")
         return 0, 0
     except Exception as e:
         logging.error(f"An error occurred while importing file {csv_file_path}: {e}")
         return 0, 0
+    _log_file_summary(basename, summary)
+    return summary['inserted'], summary['skipped']
+
+def _log_file_summary(basename, summary):
+    if summary['rows'] == 0:
+        logging.warning(f"File {basename} contains no data to import.")
+    if summary['dropped']:
+        logging.warning(f"File {basename}: dropped {summary['dropped']} rows with unparseable values.")
+    logging.info(f"Processed {basename} ({', '.join(sorted(summary['symbols']))}): "
+                 f"New rows: {summary['inserted']}, "
+                 f"Skipped duplicates: {summary['skipped']}.")
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _queued_chunks(chunk_queue, process):
+    """Yields the chunks a `parse_csv_to_queue` worker puts on `chunk_queue`, re-raising its parse error."""
+    while True:
+        try:
+            item = chunk_queue.get(timeout=1)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            # The worker has exited: whatever it put is already in the pipe.
+            try:
+                item = chunk_queue.get(timeout=1)
+            except queue.Empty:
+                raise RuntimeError(f"parse worker exited with code {process.exitcode} before finishing the file")
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def _record_manifest(conn, name, stat, sha256, summary):
+    conn.execute(f"""
+        INSERT INTO {MANIFEST_TABLE} (path, size, mtime_ns, sha256, symbols, row_count, first_epoch, last_epoch, imported_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            size = excluded.size, mtime_ns = excluded.mtime_ns, sha256 = excluded.sha256, symbols = excluded.symbols,
+            row_count = excluded.row_count, first_epoch = excluded.first_epoch, last_epoch = excluded.last_epoch,
+            imported_at = excluded.imported_at
+    """, (name, stat.st_size, stat.st_mtime_ns, sha256, ','.join(sorted(summary['symbols'])), summary['rows'],
+          summary['first_epoch'], summary['last_epoch'], datetime.now().isoformat(timespec='seconds')))
+    conn.commit()
+
+def plan_kdata_import(conn, csv_files, force=False):
+    """
+    Compares files with the import manifest. Files whose size and mtime are unchanged are skipped
+    without being read; files that were only touched (same content hash) just get their mtime updated.
+    Returns the files to import as (path, manifest name, stat, sha256) and the number skipped.
+    """
+    to_import, unchanged = [], 0
+    for path in csv_files:
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = conn.execute(f"SELECT size, mtime_ns, sha256 FROM {MANIFEST_TABLE} WHERE path = ?", (name,)).fetchone()
+        if not force and entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            unchanged += 1
+            continue
+        sha256 = file_sha256(path)
+        if not force and entry and entry[2] == sha256:
+            conn.execute(f"UPDATE {MANIFEST_TABLE} SET size = ?, mtime_ns = ? WHERE path = ?",
+                         (stat.st_size, stat.st_mtime_ns, name))
+            conn.commit()
+            unchanged += 1
+            continue
+        to_import.append((path, name, stat, sha256))
+    return to_import, unchanged
 
-def run_kdata_import(filename: str = None):
+def run_kdata_import(filename: str = None, on_rows_added=None, force: bool = False, workers: int = None):
     """
     Orchestrates the K-line data import process.
     If a filename is provided, it imports only that file. Otherwise, it imports all CSV files
-    from the KData directory.
+    from the KData directory. Files recorded in the import manifest as unchanged are skipped unless
+    `force` is set. When several files need importing, up to `workers` (default from config.ini) worker
+    processes parse them ahead while this process stays the single writer. Each worker streams its
+    chunks through a bounded queue (PARSE_QUEUE_CHUNKS), so memory stays bounded regardless of file
+    size, and files are committed in order as their chunks arrive. `on_rows_added(first, last, symbol)` is called for every symbol's span that added rows.
+    When the bar store is enabled in config.ini, its files are updated for every symbol that added rows.
+    Roots whose contract-month symbols (e.g. MTX202509) added rows get their continuous series rebuilt.
     Returns a summary message of the operation.
     """
     logging.info(f"===== Starting K-line data import task (File: {filename or 'All'}) =====")
@@ -122,9 +268,13 @@ def run_kdata_import(filename: str = None):
     total_files = 0
     total_new_rows = 0
     total_skipped_rows = 0
+    aggregate_timeframes = load_aggregate_timeframes()
+    workers = workers or load_import_workers()
+    bar_store = load_bar_store(CONFIG_PATH)
 
     with conn:
         create_market_data_table(conn)
+        create_import_manifest_table(conn)
         
         files_to_process = []
         if filename:
@@ -162,14 +312,78 @@ def run_kdata_import(filename: str = None):
             logging.warning(warning_msg)
             return warning_msg
 
-        logging.info(f"Found {total_files} CSV file(s) to import: {[os.path.basename(f) for f in files_to_process]}")
-        
-        for csv_file in sorted(files_to_process):
-            new, skipped = import_csv_to_db(conn, csv_file)
-            total_new_rows += new
-            total_skipped_rows += skipped
+        to_import, unchanged_files = plan_kdata_import(conn, sorted(files_to_process), force)
+        logging.info(f"Found {total_files} CSV file(s); {unchanged_files} unchanged since the last import, "
+                     f"importing {[name for _, name, _, _ in to_import]}")
+
+        changed_symbols = set()
+
+        def write_file(path, name, stat, sha256, chunks):
+            nonlocal total_new_rows, total_skipped_rows
+            summary = write_chunks(conn, chunks, aggregate_timeframes, on_rows_added, bar_store)
+            _record_manifest(conn, name, stat, sha256, summary)
+            _log_file_summary(name, summary)
+            total_new_rows += summary['inserted']
+            total_skipped_rows += summary['skipped']
+            if summary['inserted']:
+                changed_symbols.update(summary['symbols'])
+
+        if len(to_import) > 1 and workers > 1:
+            # spawn: the server process that triggers imports is multi-threaded.
+            context = multiprocessing.get_context('spawn')
+            parsers = []  # (item, queue, process) of files being parsed, in write order
+
+            def start_parser(item):
+                chunk_queue = context.Queue(maxsize=PARSE_QUEUE_CHUNKS)
+                process = context.Process(target=parse_csv_to_queue, args=(item[0], chunk_queue), daemon=True)
+                process.start()
+                parsers.append((item, chunk_queue, process))
+
+            pending = iter(to_import)
+            for item in pending:
+                start_parser(item)
+                if len(parsers) == workers:
+                    break
+            while parsers:
+                (path, name, stat, sha256), chunk_queue, process = parsers.pop(0)
+                try:
+                    write_file(path, name, stat, sha256, _queued_chunks(chunk_queue, process))
+                except Exception as e:
+                    logging.error(f"An error occurred while importing file {path}: {e}")
+                finally:
+                    if process.is_alive():
+                        # The write failed before the file was drained.
+                        process.terminate()
+                    process.join()
+                next_item = next(pending, None)
+                if next_item is not None:
+                    start_parser(next_item)
+        else:
+            for path, name, stat, sha256 in to_import:
+                try:
+                    logging.info(f"Reading file: {name}")
+                    write_file(path, name, stat, sha256, read_csv_chunks(path))
+                except Exception as e:
+                    logging.error(f"An error occurred while importing file {path}: {e}")
+
+        # Contract-month files (e.g. MTX202509) feed the stored continuous series of their root.
+        roll_rule, adjustment = load_continuous_settings(CONFIG_PATH)
+        for root in contract_roots(changed_symbols):
+            try:
+                store_continuous_series(conn, root, roll_rule, adjustment, aggregate_timeframes)
+                if bar_store is not None:
+                    bar_store.build(conn, continuous_symbol(root))
+                update_market_indicators(conn, continuous_symbol(root))
+                if on_rows_added is not None:
+                    first, last = conn.execute(f"SELECT MIN(epoch), MAX(epoch) FROM {TABLE_NAME} WHERE symbol = ?",
+                                               (continuous_symbol(root),)).fetchone()
+                    if first is not None:
+                        on_rows_added(epoch_to_market_time(first), epoch_to_market_time(last), continuous_symbol(root))
+            except Exception as e:
+                logging.error(f"An error occurred while building the continuous {root} series: {e}")
 
-    summary_message = (f"K-line data import finished. Processed {total_files} file(s). "
+    summary_message = (f"K-line data import finished. Processed {total_files} file(s), "
+                       f"{unchanged_files} unchanged and skipped. "
                        f"New records: {total_new_rows}, Skipped duplicates: {total_skipped_rows}.")
     logging.info(summary_message)
     return summary_message
@@ -177,7 +391,11 @@ def run_kdata_import(filename: str = None):
 
 def main():
     """Main execution function for standalone script usage."""
-    result_message = run_kdata_import()
+    parser = argparse.ArgumentParser(description="Import K-line CSV files from the KData directory.")
+    parser.add_argument('--force', action='store_true', help='Re-import files even if the manifest says they are unchanged.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes used to parse CSV files.')
+    args = parser.parse_args()
+    result_message = run_kdata_import(force=args.force, workers=args.workers)
     print(result_message)
 
 if __name__ == '__main__':
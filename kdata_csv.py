@@ -0,0 +1,94 @@
+import os
+import re
+import logging
+
+import pandas as pd
+
+from kline_data import DEFAULT_SYMBOL, SYMBOL_PATTERN, parse_market_datetimes, to_epoch_seconds
+
+# --- Configuration ---
+# K 線 CSV 的解析。平行匯入的工作行程 (spawn) 只載入本模組與 kline_data，不會載入審計程式 (trade_check)
+COLUMN_MAPPING = {
+    'Time': 'datetime', 'Datetime': 'datetime', '時間': 'datetime',
+    'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume',
+    '開盤價': 'open', '最高價': 'high', '最低價': 'low', '收盤價': 'close', '成交量': 'volume',
+    'Symbol': 'symbol', '商品': 'symbol', '商品代號': 'symbol',
+}
+REQUIRED_COLUMNS = ['datetime', 'open', 'high', 'low', 'close', 'volume']
+COLUMN_DTYPES = {
+    'datetime': 'str', 'symbol': 'str',
+    'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64', 'volume': 'float64',
+}
+# 每次讀取並寫入的列數；每個區塊各自一個交易，記憶體用量與檔案大小無關
+CSV_CHUNK_SIZE = 50_000
+# 每個工作行程最多領先寫入端的區塊數 (佇列長度)，平行匯入的記憶體用量 = 行程數 x 此值 x 區塊大小
+PARSE_QUEUE_CHUNKS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def symbol_from_filename(csv_file_path):
+    """Takes the symbol from a K-line file name such as 'TXF_1m_data_....csv' ('MTX_...' -> 'MTX'), else the default."""
+    name = os.path.basename(csv_file_path)
+    prefix = name.split('_', 1)[0].upper()
+    if '_' in name and re.fullmatch(SYMBOL_PATTERN, prefix):
+        return prefix
+    return DEFAULT_SYMBOL
+
+
+def _prepare_chunk(chunk, symbol=DEFAULT_SYMBOL):
+    """
+    Parses one CSV chunk into insert rows keyed by (symbol, epoch seconds). A `symbol` column, when
+    present, overrides the file's symbol per row; rows with unparseable values are dropped.
+    Returns the rows and the number of dropped rows.
+    """
+    times = parse_market_datetimes(pd.to_datetime(chunk['datetime'], format='ISO8601', errors='coerce'))
+    if 'symbol' in chunk:
+        symbols = chunk['symbol'].fillna(symbol).str.strip().str.upper()
+    else:
+        symbols = pd.Series(symbol, index=chunk.index)
+    valid = (times.notna() & chunk[REQUIRED_COLUMNS[1:]].notna().all(axis=1)
+             & symbols.str.fullmatch(SYMBOL_PATTERN).fillna(False).astype(bool))
+    rows = pd.DataFrame({
+        'symbol': symbols[valid], 'epoch': to_epoch_seconds(times[valid]),
+        'open': chunk.loc[valid, 'open'], 'high': chunk.loc[valid, 'high'], 'low': chunk.loc[valid, 'low'],
+        'close': chunk.loc[valid, 'close'], 'volume': chunk.loc[valid, 'volume'].astype('int64'),
+    })
+    return rows, int((~valid).sum())
+
+
+def read_csv_chunks(csv_file_path, chunk_size=CSV_CHUNK_SIZE, symbol=None):
+    """
+    Yields the prepared (rows, dropped) chunks of a K-line CSV file, reading `chunk_size` rows at a time
+    with explicit dtypes. Raises ValueError if required columns are missing.
+    """
+    file_symbol = symbol or symbol_from_filename(csv_file_path)
+    header = pd.read_csv(csv_file_path, nrows=0).columns
+    source_columns = {column: COLUMN_MAPPING.get(column, column) for column in header}
+    found = set(source_columns.values())
+    if not all(col in found for col in REQUIRED_COLUMNS):
+        raise ValueError(f"missing required columns. Required: {REQUIRED_COLUMNS}, "
+                         f"Found: {[source_columns[c] for c in header]}")
+
+    usecols = [column for column, target in source_columns.items() if target in REQUIRED_COLUMNS + ['symbol']]
+    reader = pd.read_csv(
+        csv_file_path, usecols=usecols, chunksize=chunk_size,
+        dtype={column: COLUMN_DTYPES[source_columns[column]] for column in usecols},
+    )
+    for chunk in reader:
+        yield _prepare_chunk(chunk.rename(columns=source_columns), file_symbol)
+
+
+def parse_csv_to_queue(csv_file_path, queue, chunk_size=CSV_CHUNK_SIZE):
+    """
+    Worker-process entry point: puts each prepared chunk of the file on `queue` (bounded, so the worker
+    waits for the writer instead of holding the file in memory), then None. A parse error is put on the
+    queue in place of the remaining chunks.
+    """
+    try:
+        for chunk in read_csv_chunks(csv_file_path, chunk_size):
+            queue.put(chunk)
+    except Exception as e:
+        queue.put(e)
+        return
+    queue.put(None)
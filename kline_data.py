@@ -0,0 +1,584 @@
+import re
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from trading_session import build_session_bars, session_bucket_bounds
+
+# --- Configuration ---
+TABLE_NAME = 'market_data'
+# 未指定商品時使用的代號 (台指期)
+DEFAULT_SYMBOL = 'TXF'
+# 商品代號格式 (例如 TXF, MTX, TMF)
+SYMBOL_PATTERN = r'[A-Z][A-Z0-9]{0,15}'
+# K 線原始資料的時區 (台灣期交所)
+MARKET_TZ = 'Asia/Taipei'
+# 資料庫中最小的 K 棒週期
+BASE_TIMEFRAME = '1min'
+# 未指定完整區間時，單次回傳的預設 K 棒數量
+DEFAULT_BAR_LIMIT = 2000
+# 單次請求可回傳的最大 K 棒數量
+MAX_BAR_LIMIT = 20000
+# 匯入時預先聚合並存入衍生資料表的週期
+DEFAULT_AGGREGATE_TIMEFRAMES = ['5min', '15min', '1h', '1D']
+# 重建整個衍生資料表時，每次處理的原始資料天數
+AGGREGATE_REBUILD_WINDOW_DAYS = 30
+# K 線回應快取的記憶體上限 (bytes) 與最大筆數
+KLINE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+KLINE_CACHE_MAX_ENTRIES = 256
+# K 棒對齊方式: 'clock' 依時鐘整點切分；'session' 依期交所交易時段切分 (日線為交易日)
+BAR_ALIGNMENTS = ('clock', 'session')
+
+# 圖表回應欄位名稱 (成交量以 lightweight-charts 的 `value` 欄位回傳)
+CHART_COLUMNS = {'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'value'}
+
+# Legacy pandas aliases still sent by the frontend ('1T', '1H', ...)
+TIMEFRAME_UNIT_ALIASES = {
+    'T': 'min', 'min': 'min',
+    'H': 'h', 'h': 'h',
+    'D': 'D', 'd': 'D',
+}
+
+OHLCV_AGGREGATION = {
+    'open': 'first',
+    'high': 'max',
+    'low': 'min',
+    'close': 'last',
+    'volume': 'sum',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_timeframe(timeframe: Optional[str]) -> str:
+    """
+    Converts a timeframe such as '5T' or '1H' into a fixed-width pandas frequency ('5min', '1h').
+    Raises ValueError for unsupported timeframes.
+    """
+    if not timeframe:
+        return BASE_TIMEFRAME
+
+    match = re.fullmatch(r'(\d*)([A-Za-z]+)', timeframe.strip())
+    if not match or match.group(2) not in TIMEFRAME_UNIT_ALIASES:
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+
+    count = int(match.group(1) or 1)
+    freq = f"{count}{TIMEFRAME_UNIT_ALIASES[match.group(2)]}"
+    # Buckets must tile a trading day exactly so that range padding and resampling agree.
+    if count <= 0 or pd.Timedelta('1D') % pd.Timedelta(freq) != pd.Timedelta(0):
+        raise ValueError(f"Unsupported timeframe: {timeframe}")
+    return freq
+
+
+def normalize_symbol(symbol: Optional[str]) -> str:
+    """Upper-cases a symbol such as 'mtx' ('TXF' when empty). Raises ValueError for malformed symbols."""
+    if not symbol:
+        return DEFAULT_SYMBOL
+    normalized = symbol.strip().upper()
+    if not re.fullmatch(SYMBOL_PATTERN, normalized):
+        raise ValueError(f"Unsupported symbol: {symbol}")
+    return normalized
+
+
+def epoch_to_market_time(epoch: int) -> pd.Timestamp:
+    """Converts a UNIX timestamp (seconds) to a timezone-aware market timestamp."""
+    return pd.Timestamp(int(epoch), unit='s', tz='UTC').tz_convert(MARKET_TZ)
+
+
+def to_epoch_seconds(values: pd.Series) -> pd.Series:
+    """Converts timezone-aware timestamps to UNIX seconds, independent of the datetime64 resolution."""
+    return (values - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+
+
+def parse_market_datetimes(values: pd.Series) -> pd.Series:
+    """Parses datetime strings (naive ones are taken as market time) into timezone-aware market timestamps."""
+    parsed = pd.to_datetime(values)
+    if parsed.dt.tz is None:
+        return parsed.dt.tz_localize(MARKET_TZ)
+    return parsed.dt.tz_convert(MARKET_TZ)
+
+
+def epochs_to_market_index(epochs) -> pd.DatetimeIndex:
+    """Converts UNIX seconds into a timezone-aware market-time index named 'datetime'."""
+    return pd.DatetimeIndex(pd.to_datetime(np.asarray(epochs, dtype='int64'), unit='s', utc=True),
+                            name='datetime').tz_convert(MARKET_TZ)
+
+
+def _epoch(ts: pd.Timestamp) -> int:
+    return int(ts.timestamp())
+
+
+def aggregate_table_name(timeframe: str, align: str = 'clock') -> str:
+    """Returns the name of the derived bar table, e.g. 'market_data_5min' or 'market_data_session_1D'."""
+    prefix = TABLE_NAME if align == 'clock' else f"{TABLE_NAME}_{align}"
+    return f"{prefix}_{normalize_timeframe(timeframe)}"
+
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+
+def create_bar_table(conn: sqlite3.Connection, table: str = TABLE_NAME):
+    """
+    Creates a bar table keyed by (symbol, epoch) if missing. `epoch` is the bar's start time in
+    UNIX seconds; WITHOUT ROWID stores the rows in key order, so a symbol's time range is one
+    contiguous b-tree scan with integer comparisons.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            symbol TEXT NOT NULL,
+            epoch INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume INTEGER NOT NULL,
+            PRIMARY KEY (symbol, epoch)
+        ) WITHOUT ROWID
+    """)
+
+
+def list_symbols(conn: sqlite3.Connection) -> List[str]:
+    """Returns the symbols that have 1-minute bars, using the primary key (one seek per symbol)."""
+    if not _table_exists(conn, TABLE_NAME):
+        return []
+    symbols = []
+    row = conn.execute(f"SELECT MIN(symbol) FROM {TABLE_NAME}").fetchone()
+    while row and row[0] is not None:
+        symbols.append(row[0])
+        row = conn.execute(f"SELECT MIN(symbol) FROM {TABLE_NAME} WHERE symbol > ?", (row[0],)).fetchone()
+    return symbols
+
+
+def _legacy_bar_tables(conn: sqlite3.Connection) -> List[str]:
+    """Returns the bar tables still in the old layout keyed by `datetime` text."""
+    names = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND (name = ? OR name LIKE ? ESCAPE '\\')",
+        (TABLE_NAME, TABLE_NAME.replace('_', '\\_') + '\\_%'),
+    )]
+    return [name for name in names
+            if 'datetime' in [column[1] for column in conn.execute(f"PRAGMA table_info({name})")]]
+
+
+def _legacy_datetimes_to_epoch(values: pd.Series) -> pd.Series:
+    """Converts old `datetime` text to UNIX seconds; text with an offset may be mixed with naive market time."""
+    values = values.astype(str).str.strip()
+    aware = values.str.contains(r'(?:[+-]\d{2}:?\d{2}|Z)$')
+    epochs = pd.Series(0, index=values.index, dtype='int64')
+    if aware.any():
+        epochs[aware] = to_epoch_seconds(pd.to_datetime(values[aware], format='ISO8601', utc=True))
+    if (~aware).any():
+        naive = pd.to_datetime(values[~aware], format='ISO8601').dt.tz_localize(MARKET_TZ)
+        epochs[~aware] = to_epoch_seconds(naive)
+    return epochs
+
+
+def upgrade_bar_tables(conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL, batch_size: int = 100_000) -> int:
+    """
+    Converts `market_data` and its derived tables from the old layout (`datetime` TEXT primary key)
+    to the (symbol, epoch) layout, assigning existing rows to `symbol`. Runs inside the caller's
+    transaction and does not commit. Returns the number of tables converted.
+    """
+    tables = _legacy_bar_tables(conn)
+    for table in tables:
+        legacy = f"{table}_legacy"
+        conn.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+        create_bar_table(conn, table)
+        cursor = conn.execute(f"SELECT datetime, open, high, low, close, volume FROM {legacy}")
+        converted = 0
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            epochs = _legacy_datetimes_to_epoch(pd.Series([row[0] for row in batch]))
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {table} (symbol, epoch, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((symbol, epoch) + tuple(row[1:]) for epoch, row in zip(epochs.tolist(), batch)),
+            )
+            converted += len(batch)
+        conn.execute(f"DROP TABLE {legacy}")
+        logger.info(f"Converted {converted} rows of '{table}' to (symbol, epoch) keys.")
+    return len(tables)
+
+
+def _query_raw_bars(conn: sqlite3.Connection, lower: Optional[pd.Timestamp], upper: Optional[pd.Timestamp],
+                    row_limit: Optional[int] = None, newest_first: bool = False, table: str = TABLE_NAME,
+                    symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """Reads bars in [lower, upper) straight from SQLite, optionally capped to `row_limit` rows."""
+    clauses, params = ["symbol = ?"], [symbol]
+    if lower is not None:
+        clauses.append("epoch >= ?")
+        params.append(_epoch(lower))
+    if upper is not None:
+        clauses.append("epoch < ?")
+        params.append(_epoch(upper))
+
+    query = f"SELECT epoch, open, high, low, close, volume FROM {table} WHERE {' AND '.join(clauses)}"
+    query += f" ORDER BY epoch {'DESC' if newest_first else 'ASC'}"
+    if row_limit is not None:
+        query += " LIMIT ?"
+        params.append(int(row_limit))
+
+    df = pd.read_sql_query(query, conn, params=params)
+    if newest_first:
+        df = df.iloc[::-1]
+
+    df.index = epochs_to_market_index(df.pop('epoch'))
+    return df
+
+
+def load_bar_arrays(conn: sqlite3.Connection, lower: Optional[pd.Timestamp] = None,
+                    upper: Optional[pd.Timestamp] = None, columns=('high', 'low'),
+                    symbol: str = DEFAULT_SYMBOL) -> Dict[str, np.ndarray]:
+    """
+    Reads 1-minute bars in [lower, upper) into plain numpy arrays: 'time' (UNIX seconds, ascending)
+    plus the requested price columns, without building a DataFrame.
+    """
+    clauses, params = ["symbol = ?"], [symbol]
+    if lower is not None:
+        clauses.append("epoch >= ?")
+        params.append(_epoch(lower))
+    if upper is not None:
+        clauses.append("epoch < ?")
+        params.append(_epoch(upper))
+    query = f"SELECT epoch, {', '.join(columns)} FROM {TABLE_NAME} WHERE {' AND '.join(clauses)}"
+    rows = conn.execute(query + " ORDER BY epoch", params).fetchall()
+
+    arrays = {'time': np.array([row[0] for row in rows], dtype='int64')}
+    for position, column in enumerate(columns, start=1):
+        arrays[column] = np.array([row[position] for row in rows], dtype=float)
+    return arrays
+
+
+def asof_close_prices(conn: sqlite3.Connection, times: pd.Series, symbol: str = DEFAULT_SYMBOL) -> np.ndarray:
+    """
+    Returns the close of the latest 1-minute bar at or before each of the timezone-aware `times`
+    (NaN where no bar precedes it). The bars spanning `times` are read once and matched with a
+    sorted search on their integer epochs, so no per-row subquery is needed.
+    """
+    prices = np.full(len(times), np.nan)
+    if len(times) == 0 or not _table_exists(conn, TABLE_NAME):
+        return prices
+
+    keys = to_epoch_seconds(pd.Series(times)).to_numpy(dtype='int64')
+    lower, upper = int(keys.min()), int(keys.max())
+    # The bar preceding the earliest time, plus every bar up to the latest one.
+    rows = conn.execute(
+        f"SELECT epoch, close FROM {TABLE_NAME} WHERE symbol = ? AND epoch < ? ORDER BY epoch DESC LIMIT 1",
+        (symbol, lower),
+    ).fetchall()
+    rows += conn.execute(
+        f"SELECT epoch, close FROM {TABLE_NAME} WHERE symbol = ? AND epoch >= ? AND epoch <= ? ORDER BY epoch",
+        (symbol, lower, upper),
+    ).fetchall()
+    if not rows:
+        return prices
+
+    bar_times = np.array([row[0] for row in rows], dtype='int64')
+    closes = np.array([row[1] for row in rows], dtype=float)
+    positions = np.searchsorted(bar_times, keys, side='right') - 1
+    matched = positions >= 0
+    prices[matched] = closes[positions[matched]]
+    return prices
+
+
+def resample_bars(df: pd.DataFrame, timeframe: str, align: str = 'clock', symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Aggregates 1-minute OHLCV bars into `timeframe` buckets, dropping buckets without any trades.
+    Session-aligned buckets follow `symbol`'s session calendar.
+    """
+    freq = normalize_timeframe(timeframe)
+    if df.empty or freq == BASE_TIMEFRAME:
+        return df
+    if align == 'session':
+        return build_session_bars(df, freq, symbol)
+
+    resampled = df.resample(freq).agg(OHLCV_AGGREGATION)
+    return resampled.dropna(subset=['open', 'high', 'low', 'close'], how='all')
+
+
+def _bucket_bounds(ts: pd.Timestamp, freq: str, align: str,
+                   symbol: str = DEFAULT_SYMBOL) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """Returns the [lower, upper) span of 1-minute bars forming the bucket that contains `ts` (sessions of `symbol`)."""
+    if align == 'session':
+        return session_bucket_bounds(ts, freq, symbol)
+    lower = ts.floor(freq)
+    return lower, lower + pd.Timedelta(freq)
+
+
+def _max_rows_per_bar(freq: str, align: str) -> int:
+    rows = max(1, pd.Timedelta(freq) // pd.Timedelta(BASE_TIMEFRAME))
+    if align == 'session' and pd.Timedelta(freq) >= pd.Timedelta('1D'):
+        # A Monday trading day spans from Friday's night session open.
+        rows *= 3
+    return rows
+
+
+def load_bars(conn: sqlite3.Connection, timeframe: str = BASE_TIMEFRAME, start: Optional[int] = None,
+              end: Optional[int] = None, before: Optional[int] = None, limit: Optional[int] = None,
+              align: str = 'clock', symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Loads bars for a bounded window and resamples them to `timeframe`.
+
+    - `start` / `end` (UNIX seconds) select bars whose bucket contains a time within [start, end].
+    - `before` selects bars in buckets that start before the bucket containing that time
+      (scroll-back paging: pass the `time` of the oldest bar already on screen).
+    - `limit` caps the number of returned bars: the oldest ones after `start` when `start`
+      is given, otherwise the newest ones before `end` / `before`.
+    - `align='session'` buckets by TAIFEX trading session instead of the wall clock.
+    - `symbol` selects the instrument; every read is a range of the (symbol, epoch) primary key,
+      so other symbols in the table do not add to its cost.
+
+    The returned frame carries `attrs['span']`, the window of 1-minute times it depends on,
+    so callers caching the result know which imports invalidate it.
+
+    Higher timeframes are served from their pre-aggregated table when one exists. Otherwise only
+    the 1-minute rows covering the requested buckets are read, padded to whole buckets so that
+    the first and last higher-timeframe bars are complete.
+    """
+    freq = normalize_timeframe(timeframe)
+    if align not in BAR_ALIGNMENTS:
+        raise ValueError(f"Unsupported bar alignment: {align}")
+    if freq == BASE_TIMEFRAME:
+        align = 'clock'
+
+    table = TABLE_NAME
+    rows_per_bar = _max_rows_per_bar(freq, align)
+    if freq != BASE_TIMEFRAME and _table_exists(conn, aggregate_table_name(freq, align)):
+        table = aggregate_table_name(freq, align)
+        rows_per_bar = 1
+
+    lower = _bucket_bounds(epoch_to_market_time(start), freq, align, symbol)[0] if start is not None else None
+    upper = _bucket_bounds(epoch_to_market_time(end), freq, align, symbol)[1] if end is not None else None
+    if before is not None:
+        before_bound = _bucket_bounds(epoch_to_market_time(before), freq, align, symbol)[0]
+        upper = before_bound if upper is None else min(upper, before_bound)
+
+    if lower is not None and upper is not None and lower >= upper:
+        return pd.DataFrame(columns=list(OHLCV_AGGREGATION), index=pd.DatetimeIndex([], tz=MARKET_TZ, name='datetime'))
+
+    newest_first = lower is None
+    row_limit = None
+    if limit is not None:
+        # Each bucket holds at most `rows_per_bar` rows, so this many rows always spans `limit`
+        # complete buckets plus one possibly truncated bucket at the far edge.
+        row_limit = (limit + 1) * rows_per_bar if rows_per_bar > 1 else limit
+
+    raw = _query_raw_bars(conn, lower, upper, row_limit=row_limit, newest_first=newest_first, table=table, symbol=symbol)
+    logger.info(f"K-line trace: Read {len(raw)} {symbol} rows from '{table}' for window [{lower}, {upper}).")
+
+    bars = raw if table != TABLE_NAME else resample_bars(raw, freq, align, symbol)
+    if limit is not None:
+        bars = bars.iloc[-limit:] if newest_first else bars.iloc[:limit]
+    bars.attrs['span'] = _result_span(bars, freq, align, lower, upper, limit, newest_first, symbol)
+    return bars
+
+
+def _result_span(bars: pd.DataFrame, freq: str, align: str, lower: Optional[pd.Timestamp],
+                 upper: Optional[pd.Timestamp], limit: Optional[int], newest_first: bool,
+                 symbol: str = DEFAULT_SYMBOL):
+    """
+    Returns the [lower, upper) span of 1-minute times whose insertion could change this result
+    (None for an open side). A full page only depends on the buckets it actually returned.
+    """
+    if limit is not None and len(bars) >= limit:
+        if newest_first:
+            lower = _bucket_bounds(bars.index[0], freq, align, symbol)[0]
+        else:
+            upper = _bucket_bounds(bars.index[-1], freq, align, symbol)[1]
+    return lower, upper
+
+
+def bars_to_columns(bars: pd.DataFrame) -> Dict[str, list]:
+    """
+    Converts a bar frame into parallel arrays (`time`, `open`, `high`, `low`, `close`, `value`)
+    for the columnar wire format. `time` is in UNIX seconds and missing values become None.
+    """
+    columns = {'time': to_epoch_seconds(bars.index).tolist()}
+    for source, target in CHART_COLUMNS.items():
+        series = bars[source]
+        if series.isna().any():
+            series = series.astype(object).where(series.notna(), None)
+        columns[target] = series.tolist()
+    return columns
+
+
+def create_aggregate_table(conn: sqlite3.Connection, timeframe: str, align: str = 'clock') -> bool:
+    """Creates the derived bar table for `timeframe` if missing. Returns True if it was created."""
+    table = aggregate_table_name(timeframe, align)
+    if _table_exists(conn, table):
+        return False
+    create_bar_table(conn, table)
+    return True
+
+
+def _write_aggregate_window(conn: sqlite3.Connection, freq: str, align: str,
+                            lower: pd.Timestamp, upper: pd.Timestamp, symbol: str = DEFAULT_SYMBOL) -> int:
+    """Recomputes the buckets built from 1-minute bars in [lower, upper) and replaces them in the derived table."""
+    table = aggregate_table_name(freq, align)
+    bars = resample_bars(_query_raw_bars(conn, lower, upper, symbol=symbol), freq, align, symbol)
+
+    # Bucket labels always fall inside the span of their own 1-minute bars.
+    conn.execute(f"DELETE FROM {table} WHERE symbol = ? AND epoch >= ? AND epoch < ?",
+                 (symbol, _epoch(lower), _epoch(upper)))
+    if bars.empty:
+        return 0
+
+    rows = zip(
+        [symbol] * len(bars), to_epoch_seconds(bars.index).tolist(),
+        bars['open'].tolist(), bars['high'].tolist(), bars['low'].tolist(),
+        bars['close'].tolist(), bars['volume'].astype('int64').tolist(),
+    )
+    conn.executemany(
+        f"INSERT INTO {table} (symbol, epoch, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    return len(bars)
+
+
+def _market_data_bounds(conn: sqlite3.Connection,
+                        symbol: str = DEFAULT_SYMBOL) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+    first, last = conn.execute(f"SELECT MIN(epoch), MAX(epoch) FROM {TABLE_NAME} WHERE symbol = ?", (symbol,)).fetchone()
+    if first is None:
+        return None, None
+    return epoch_to_market_time(first), epoch_to_market_time(last)
+
+
+def rebuild_aggregate_table(conn: sqlite3.Connection, timeframe: str, align: str = 'clock',
+                            symbols: Optional[List[str]] = None) -> int:
+    """
+    Rebuilds a derived bar table from `market_data` for `symbols` (default: every symbol),
+    a few weeks of 1-minute bars at a time.
+    """
+    freq = normalize_timeframe(timeframe)
+    table = aggregate_table_name(freq, align)
+    create_aggregate_table(conn, freq, align)
+
+    written = 0
+    for symbol in list_symbols(conn) if symbols is None else symbols:
+        conn.execute(f"DELETE FROM {table} WHERE symbol = ?", (symbol,))
+        first, last = _market_data_bounds(conn, symbol)
+        if first is None:
+            continue
+
+        # Window edges sit on daily bucket boundaries, which are also boundaries of every intraday bucket.
+        window = pd.Timedelta(days=AGGREGATE_REBUILD_WINDOW_DAYS)
+        lower = _bucket_bounds(first, '1D', align, symbol)[0]
+        while lower <= last:
+            upper = _bucket_bounds(lower + window, '1D', align, symbol)[0]
+            written += _write_aggregate_window(conn, freq, align, lower, upper, symbol)
+            lower = upper
+    logger.info(f"Rebuilt '{table}' with {written} bars.")
+    return written
+
+
+def refresh_aggregate_tables(conn: sqlite3.Connection, first: pd.Timestamp, last: pd.Timestamp,
+                             timeframes: Optional[List[str]] = None, symbol: str = DEFAULT_SYMBOL) -> Dict[str, int]:
+    """
+    Brings the derived bar tables (clock- and session-aligned) up to date after 1-minute bars of
+    `symbol` between `first` and `last` were added. Only that symbol's buckets overlapping the span
+    are recomputed; a table that does not exist yet is created and backfilled from the whole of `market_data`.
+    Returns the number of bars written per table.
+    """
+    first, last = first.tz_convert(MARKET_TZ), last.tz_convert(MARKET_TZ)
+    written = {}
+    for timeframe in timeframes or DEFAULT_AGGREGATE_TIMEFRAMES:
+        freq = normalize_timeframe(timeframe)
+        if freq == BASE_TIMEFRAME:
+            continue
+        for align in BAR_ALIGNMENTS:
+            table = aggregate_table_name(freq, align)
+            if create_aggregate_table(conn, freq, align):
+                written[table] = rebuild_aggregate_table(conn, freq, align)
+                continue
+            lower = _bucket_bounds(first, freq, align, symbol)[0]
+            upper = _bucket_bounds(last, freq, align, symbol)[1]
+            written[table] = _write_aggregate_window(conn, freq, align, lower, upper, symbol)
+    logger.info(f"Refreshed {symbol} aggregate bar tables for [{first}, {last}]: {written}")
+    return written
+
+
+class KlineCache:
+    """
+    Bounded LRU cache of rendered K-line responses, evicting by total byte size.
+    Each entry remembers the symbol and span of 1-minute bar times it was computed from, so an import
+    only drops the entries of that symbol whose span overlaps the newly added rows.
+    """
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (body, span_start, span_end, symbol)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, body: bytes, span_start: Optional[int], span_end: Optional[int], symbol: Optional[str] = None):
+        """
+        Stores a response body; `span_start`/`span_end` are UNIX seconds, None for an open side.
+        `symbol` is the symbol whose bars the body was computed from, None when it depends on any symbol's bars.
+        """
+        size = len(body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, span_start, span_end, symbol)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, (evicted, *_) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate_range(self, first: int, last: int, symbol: Optional[str] = None) -> int:
+        """
+        Drops every entry whose span overlaps [first, last] (UNIX seconds) and that depends on `symbol`'s bars
+        (every symbol when None). Returns the number dropped.
+        """
+        with self._lock:
+            stale = [
+                key for key, (_, span_start, span_end, entry_symbol) in self._entries.items()
+                if (span_start is None or span_start <= last) and (span_end is None or first < span_end)
+                and (symbol is None or entry_symbol is None or entry_symbol == symbol)
+            ]
+            for key in stale:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,325 @@
+import os
+import sqlite3
+import argparse
+import logging
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from kline_data import (
+    TABLE_NAME, DEFAULT_SYMBOL, list_symbols, normalize_symbol, to_epoch_seconds, parse_market_datetimes,
+    epochs_to_market_index, _table_exists,
+)
+from trading_session import assign_sessions, get_session_calendar, _minutes
+from continuous_futures import PRODUCT_ROOTS, contract_symbols, continuous_symbol
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, 'trade_notes.db')
+INDICATORS_TABLE = 'market_indicators'
+# 指標視窗 (1 分鐘 K 棒數)
+ATR_WINDOW = 14
+REALIZED_VOL_WINDOW = 30
+MA_WINDOW = 60
+# 成交量百分位以最近一個完整交易日 (日盤 300 + 夜盤 840 分鐘) 為比較基準
+VOLUME_PERCENTILE_WINDOW = 1140
+# 增量更新時，往前多讀的 K 棒數，讓新資料的滾動視窗與全量計算結果一致
+WARMUP_BARS = max(ATR_WINDOW, REALIZED_VOL_WINDOW, MA_WINDOW, VOLUME_PERCENTILE_WINDOW)
+# 開盤後 / 收盤前多少分鐘視為 open / close 階段
+SESSION_PHASE_MINUTES = 30
+# 交易與最近一根已完成 K 棒相距超過此秒數 (涵蓋週末與連假) 時視為沒有市場資料
+CONTEXT_MAX_LAG_SECONDS = 4 * 86400
+BAR_SECONDS = 60
+INDICATOR_COLUMNS = ('atr', 'realized_vol', 'ma_distance', 'volume_percentile', 'session_phase')
+# 報告中依成交量百分位分組的界線
+VOLUME_REGIME_BINS = [0.0, 1 / 3, 2 / 3, 1.0]
+
+logger = logging.getLogger(__name__)
+
+
+def create_indicators_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {INDICATORS_TABLE} (
+            symbol TEXT NOT NULL,
+            epoch INTEGER NOT NULL,
+            atr REAL,
+            realized_vol REAL,
+            ma_distance REAL,
+            volume_percentile REAL,
+            session_phase TEXT,
+            PRIMARY KEY (symbol, epoch)
+        ) WITHOUT ROWID
+    """)
+
+
+def session_phases(index, symbol: str = DEFAULT_SYMBOL) -> np.ndarray:
+    """
+    '{session}_{open|mid|close}' for each timestamp: within SESSION_PHASE_MINUTES of the session
+    open or close, else mid. Times after the close (e.g. late trades) count as close.
+    """
+    sessions = assign_sessions(index, symbol)
+    elapsed = ((sessions.index - pd.DatetimeIndex(sessions['session_open'])) // pd.Timedelta(minutes=1)).to_numpy()
+    lengths = {s['name']: (_minutes(s['close']) - _minutes(s['open'])) % 1440
+               for s in get_session_calendar(symbol)['sessions']}
+    length = sessions['session'].map(lengths).to_numpy()
+    phase = np.where(elapsed < SESSION_PHASE_MINUTES, 'open',
+                     np.where(elapsed >= length - SESSION_PHASE_MINUTES, 'close', 'mid'))
+    return np.char.add(np.char.add(sessions['session'].to_numpy().astype(str), '_'), phase)
+
+
+def compute_indicators(bars: pd.DataFrame, symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Market context of every 1-minute bar in `bars` (`epoch`, `high`, `low`, `close`, `volume`,
+    ascending), from backward-looking rolling windows so each value only uses bars up to its own:
+
+    - `atr`: mean true range over ATR_WINDOW bars (points);
+    - `realized_vol`: square root of the summed squared log returns over REALIZED_VOL_WINDOW bars;
+    - `ma_distance`: close minus its MA_WINDOW-bar moving average (points);
+    - `volume_percentile`: percentile rank (0-1] of the bar's volume within the last VOLUME_PERCENTILE_WINDOW bars;
+    - `session_phase`: see `session_phases`.
+
+    Values without a full window are NaN.
+    """
+    close = bars['close'].astype(float)
+    previous_close = close.shift(1)
+    true_range = pd.concat([
+        bars['high'] - bars['low'], (bars['high'] - previous_close).abs(), (bars['low'] - previous_close).abs(),
+    ], axis=1).max(axis=1)
+    log_returns = np.log(close / previous_close)
+
+    index = epochs_to_market_index(bars['epoch'].to_numpy())
+    return pd.DataFrame({
+        'epoch': bars['epoch'].to_numpy(dtype='int64'),
+        'atr': true_range.rolling(ATR_WINDOW).mean().to_numpy(),
+        'realized_vol': np.sqrt((log_returns ** 2).rolling(REALIZED_VOL_WINDOW).sum()).to_numpy(),
+        'ma_distance': (close - close.rolling(MA_WINDOW).mean()).to_numpy(),
+        'volume_percentile': bars['volume'].astype(float).rolling(VOLUME_PERCENTILE_WINDOW).rank(pct=True).to_numpy(),
+        'session_phase': session_phases(index, symbol),
+    })
+
+
+def _warmup_epoch(conn: sqlite3.Connection, symbol: str, first_epoch: int) -> Optional[int]:
+    """Epoch of the bar WARMUP_BARS bars before `first_epoch` (None when fewer bars precede it)."""
+    row = conn.execute(
+        f"SELECT epoch FROM {TABLE_NAME} WHERE symbol = ? AND epoch < ? ORDER BY epoch DESC LIMIT 1 OFFSET ?",
+        (symbol, int(first_epoch), WARMUP_BARS),
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def update_market_indicators(conn: sqlite3.Connection, symbol: str = DEFAULT_SYMBOL,
+                             first_epoch: Optional[int] = None) -> int:
+    """
+    Recomputes the stored indicators of `symbol` for bars from `first_epoch` on (all bars when None)
+    after market_data changed there. Windows only look back, so earlier rows stay valid; the
+    preceding WARMUP_BARS bars are read to fill the windows. Returns the number of rows written.
+    """
+    create_indicators_table(conn)
+    query = f"SELECT epoch, high, low, close, volume FROM {TABLE_NAME} WHERE symbol = ?"
+    params = [symbol]
+    if first_epoch is not None:
+        warmup = _warmup_epoch(conn, symbol, first_epoch)
+        if warmup is not None:
+            query += " AND epoch >= ?"
+            params.append(warmup)
+    bars = pd.read_sql_query(query + " ORDER BY epoch", conn, params=params)
+
+    indicators = compute_indicators(bars, symbol)
+    if first_epoch is not None:
+        indicators = indicators[indicators['epoch'] >= first_epoch]
+        conn.execute(f"DELETE FROM {INDICATORS_TABLE} WHERE symbol = ? AND epoch >= ?", (symbol, int(first_epoch)))
+    else:
+        conn.execute(f"DELETE FROM {INDICATORS_TABLE} WHERE symbol = ?", (symbol,))
+
+    # NaN (incomplete windows) is stored as NULL by SQLite.
+    conn.executemany(
+        f"INSERT INTO {INDICATORS_TABLE} (symbol, epoch, {', '.join(INDICATOR_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((symbol, *row) for row in indicators[['epoch', *INDICATOR_COLUMNS]].itertuples(index=False, name=None)),
+    )
+    conn.commit()
+    logger.info(f"Market indicators: wrote {len(indicators)} {symbol} rows.")
+    return len(indicators)
+
+
+def _symbol_or_none(name: str) -> Optional[str]:
+    try:
+        return normalize_symbol(name) if name else None
+    except ValueError:
+        return None
+
+
+def trade_symbols(conn: sqlite3.Connection, product_names: pd.Series, times: pd.Series,
+                  table: str = INDICATORS_TABLE) -> pd.Series:
+    """
+    Symbol whose stored indicators (or the rows of another (symbol, epoch) keyed `table`, such as
+    market_data) describe each trade's product, aligned with `product_names`: the traded
+    contract month ('小型期09' in 2025 -> 'MTX202509'), else the product's root ('MTX', via PRODUCT_ROOTS,
+    or normalize_symbol for names that already are symbols), else the root's continuous series ('MTXCONT'),
+    whichever first has rows in `table` before the last of those trades (so bars imported after
+    the trades never change the choice). Only products with none of these (or unknown products) fall back
+    to DEFAULT_SYMBOL (TXF). `times` are naive market time or timezone-aware.
+    """
+    names = product_names.fillna('').astype(str).str.strip()
+    local_times = parse_market_datetimes(pd.Series(times, index=product_names.index))
+    contracts = contract_symbols(names, local_times.dt.tz_localize(None))
+    roots = names.str.replace(r'\d{2}$', '', regex=True).map(PRODUCT_ROOTS)
+    roots = roots.fillna(names.map(_symbol_or_none))
+    if not _table_exists(conn, table):
+        return pd.Series(DEFAULT_SYMBOL, index=product_names.index)
+
+    def has_rows(symbol: str, before: int) -> bool:
+        return conn.execute(f"SELECT 1 FROM {table} WHERE symbol = ? AND epoch < ? LIMIT 1",
+                            (symbol, before)).fetchone() is not None
+
+    resolved = {}
+    keys = list(zip(contracts.where(contracts.notna(), None), roots.where(roots.notna(), None)))
+    # The last trade time of each (contract, root) group.
+    epochs = to_epoch_seconds(local_times).to_numpy(dtype=float)
+    codes, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    last_epochs = np.full(len(uniques), np.nan)
+    np.fmax.at(last_epochs, codes, epochs)
+    for (contract, root), last in zip(uniques, last_epochs):
+        before = 0 if np.isnan(last) else int(last)
+        candidates = [symbol for symbol in (contract, root, continuous_symbol(root) if root else None) if symbol]
+        symbol = next((symbol for symbol in candidates if has_rows(symbol, before)), None)
+        if symbol is None:
+            logger.info(f"No {table} rows for {candidates or 'an unknown product'}; using {DEFAULT_SYMBOL}.")
+            symbol = DEFAULT_SYMBOL
+        resolved[(contract, root)] = symbol
+    return pd.Series([resolved[key] for key in keys], index=product_names.index)
+
+
+def trade_market_context(conn: sqlite3.Connection, times: pd.Series, symbols=DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Market context of each trade at `times` (naive market time or timezone-aware), aligned with `times`.
+    `symbols` is one symbol for every trade or a per-trade series (see trade_symbols); each symbol's
+    trades are joined to that symbol's indicators.
+
+    Trade times are normalized to the start of their minute and joined as-of to the last completed
+    bar before it, so no indicator uses prices after the trade; bars more than CONTEXT_MAX_LAG_SECONDS
+    old give NaN. `session_phase` is the phase of the trade time itself.
+    """
+    times = parse_market_datetimes(pd.Series(times))
+    if isinstance(symbols, str):
+        symbols = pd.Series(symbols, index=times.index)
+    symbols = pd.Series(np.asarray(symbols, dtype=object), index=times.index)
+    context = pd.DataFrame({column: np.nan for column in INDICATOR_COLUMNS[:-1]}, index=times.index)
+    context['session_phase'] = pd.Series(dtype=object, index=times.index)
+    groups = {symbol: np.flatnonzero((symbols == symbol).to_numpy()) for symbol in symbols.unique()}
+    for symbol, positions in groups.items():
+        context.iloc[positions, context.columns.get_loc('session_phase')] = session_phases(
+            pd.DatetimeIndex(times.iloc[positions]), symbol)
+    if times.empty or not _table_exists(conn, INDICATORS_TABLE):
+        return context
+
+    minutes = to_epoch_seconds(times).to_numpy(dtype='int64')
+    minutes = minutes - minutes % BAR_SECONDS
+    for symbol, positions in groups.items():
+        values = _asof_indicators(conn, symbol, minutes[positions])
+        for column in INDICATOR_COLUMNS[:-1]:
+            context.iloc[positions, context.columns.get_loc(column)] = values[column]
+    return context
+
+
+def _asof_indicators(conn: sqlite3.Connection, symbol: str, minutes: np.ndarray) -> Dict[str, np.ndarray]:
+    """Indicators of the last completed `symbol` bar before each of `minutes` (epoch seconds), NaN beyond the lag limit."""
+    values = {column: np.full(len(minutes), np.nan) for column in INDICATOR_COLUMNS[:-1]}
+    lower, upper = int(minutes.min()) - CONTEXT_MAX_LAG_SECONDS, int(minutes.max())
+    stored = pd.read_sql_query(
+        f"SELECT epoch, {', '.join(INDICATOR_COLUMNS[:-1])} FROM {INDICATORS_TABLE} "
+        "WHERE symbol = ? AND epoch >= ? AND epoch < ? ORDER BY epoch",
+        conn, params=(symbol, lower, upper),
+    )
+    if stored.empty:
+        return values
+
+    epochs = stored['epoch'].to_numpy(dtype='int64')
+    positions = np.searchsorted(epochs, minutes, side='left') - 1
+    matched = positions >= 0
+    matched[matched] = minutes[matched] - epochs[positions[matched]] <= CONTEXT_MAX_LAG_SECONDS
+    for column in values:
+        values[column][matched] = stored[column].to_numpy(dtype=float)[positions[matched]]
+    return values
+
+
+def _regime_kpis(labels: pd.Series, pnl: pd.Series) -> Dict[str, Dict[str, Any]]:
+    """Trade count, PnL, win rate and RR (average win / average loss) of the trades in each regime."""
+    kpis = {}
+    for label, group in pnl.groupby(labels, observed=True, sort=True):
+        wins, losses = group[group > 0], group[group < 0]
+        if losses.empty:
+            rr = "Infinity"
+        else:
+            rr = str(round(float((wins.mean() if not wins.empty else 0) / abs(losses.mean())), 2))
+        kpis[str(label)] = {
+            "trade_count": int(len(group)),
+            "total_pnl": float(group.sum()),
+            "win_rate": f"{len(wins) / len(group):.2%}",
+            "risk_reward_ratio": rr,
+        }
+    return kpis
+
+
+def _terciles(values: pd.Series) -> pd.Series:
+    """low / mid / high thirds of `values` (NaN stays unlabelled); a single bucket when values barely vary."""
+    valid = values.dropna()
+    if valid.nunique() < 3:
+        return pd.Series(np.where(values.notna(), 'all', None), index=values.index)
+    return pd.qcut(values, 3, labels=['low', 'mid', 'high'], duplicates='drop')
+
+
+def regime_summary(trades: pd.DataFrame, context: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Slices `trades` (`net_pnl`) by market regime using their stored context: ATR and realized
+    volatility terciles (over the audited trades), price above/below the moving average, volume
+    percentile thirds and session phase.
+    """
+    pnl = trades['net_pnl'].astype(float)
+    volume = pd.cut(context['volume_percentile'], VOLUME_REGIME_BINS, labels=['low', 'normal', 'high'],
+                    include_lowest=True)
+    trend = pd.Series(np.select([context['ma_distance'] > 0, context['ma_distance'] < 0], ['above_ma', 'below_ma'],
+                                default=None), index=context.index)
+    return {
+        "trades_with_context": int(context['atr'].notna().sum()),
+        "trade_count": int(len(trades)),
+        "windows": {"atr": ATR_WINDOW, "realized_vol": REALIZED_VOL_WINDOW, "moving_average": MA_WINDOW,
+                    "volume_percentile": VOLUME_PERCENTILE_WINDOW},
+        "regimes": {
+            "atr": _regime_kpis(_terciles(context['atr']), pnl),
+            "realized_vol": _regime_kpis(_terciles(context['realized_vol']), pnl),
+            "trend": _regime_kpis(trend, pnl),
+            "volume": _regime_kpis(volume, pnl),
+            "session_phase": _regime_kpis(context['session_phase'], pnl),
+        },
+    }
+
+
+def main():
+    """Computes the stored market indicators (incrementally unless --full)."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Compute per-bar market context indicators from market_data.")
+    parser.add_argument('--symbol', action='append', help='Symbol to compute (repeatable; default: all symbols).')
+    parser.add_argument('--full', action='store_true', help='Recompute every bar instead of only bars after the stored ones.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if not _table_exists(conn, TABLE_NAME):
+            print("資料庫中沒有K線資料。")
+            return
+        create_indicators_table(conn)
+        symbols = [normalize_symbol(s) for s in args.symbol] if args.symbol else list_symbols(conn)
+        for symbol in symbols:
+            first_epoch = None
+            if not args.full:
+                last = conn.execute(f"SELECT MAX(epoch) FROM {INDICATORS_TABLE} WHERE symbol = ?", (symbol,)).fetchone()[0]
+                first_epoch = None if last is None else last + 1
+            rows = update_market_indicators(conn, symbol, first_epoch)
+            print(f"{symbol}: {rows} indicator rows")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
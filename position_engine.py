@@ -0,0 +1,145 @@
+import logging
+from collections import defaultdict, deque
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from trade_matching import normalize_product_key, OPENING_POSITION_TYPE
+
+# --- Configuration ---
+CLOSING_POSITION_TYPE = '平倉'
+BUY_ACTION = '買進'
+SELL_ACTION = '賣出'
+
+ROUND_TRIP_COLUMNS = [
+    'product_name', 'direction', 'quantity', 'open_time', 'close_time', 'holding_seconds',
+    'open_price', 'close_price', 'points', 'fee', 'tax',
+    'open_fill_id', 'close_fill_id', 'open_order_id', 'close_order_id',
+]
+OPEN_LOT_COLUMNS = ['product_name', 'direction', 'quantity', 'open_time', 'open_price', 'open_fill_id', 'open_order_id']
+
+logger = logging.getLogger(__name__)
+
+
+def contract_keys(product_keys: pd.Series, times: pd.Series) -> pd.Series:
+    """
+    Qualifies product names that end in a delivery month (e.g. '小型期09') with the delivery year
+    ('小型期09@2025'), since the broker reuses the same name every year. A fill trades the first
+    contract of that month whose final settlement day (the third Wednesday) is on or after the fill date.
+    Names without a trailing month are returned unchanged.
+    """
+    months = pd.to_numeric(product_keys.str.extract(r'(\d{2})$', expand=False), errors='coerce')
+    dated = months.between(1, 12)
+    if not dated.any():
+        return product_keys
+
+    years = times.dt.year.where(times.dt.month <= months, times.dt.year + 1)
+    first_days = pd.to_datetime(pd.DataFrame({'year': years[dated], 'month': months[dated], 'day': 1}))
+    settlement = first_days + pd.to_timedelta((2 - first_days.dt.weekday) % 7 + 14, unit='D')
+    years[dated] = years[dated].where(times[dated].dt.normalize() <= settlement, years[dated] + 1)
+
+    keys = product_keys.copy()
+    keys[dated] = product_keys[dated] + '@' + years[dated].astype('int64').astype(str)
+    return keys
+
+
+def reconstruct_round_trips(fills_df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Replays `TransactionData` fills per product in time order with FIFO lot accounting.
+
+    Every opening fill ('新倉') adds a lot (long for '買進', short for '賣出'); every closing fill
+    ('平倉') consumes the oldest open lots of the same contract (product and delivery year), splitting a lot when the fill is
+    smaller and spanning several lots when it is larger, so partial fills and multi-contract orders
+    produce one round trip per (open lot, close fill) pair. Fees and tax of each fill are allocated
+    per contract to the round trips it takes part in.
+
+    `fills_df` needs `id`, `transaction_time`, `trade_type`, `product_name`, `quantity`, `price` and
+    `position_type` (`commission_fee`, `transaction_tax` and `order_id` are optional).
+    Returns the round trips and the lots without a closing fill (still open, or held into final settlement).
+    """
+    if fills_df.empty:
+        return pd.DataFrame(columns=ROUND_TRIP_COLUMNS), pd.DataFrame(columns=OPEN_LOT_COLUMNS)
+
+    fills = fills_df.assign(transaction_time=pd.to_datetime(fills_df['transaction_time'], format='ISO8601'))
+    fills['product_key'] = contract_keys(fills['product_name'].map(normalize_product_key), fills['transaction_time'])
+    fills = fills.sort_values(['transaction_time', 'id'], kind='stable')
+
+    quantities = fills['quantity'].fillna(0).to_numpy(dtype='int64')
+    safe_quantities = np.where(quantities > 0, quantities, 1)
+    fee_per_contract = fills.get('commission_fee', pd.Series(0, index=fills.index)).fillna(0).to_numpy(dtype=float) / safe_quantities
+    tax_per_contract = fills.get('transaction_tax', pd.Series(0, index=fills.index)).fillna(0).to_numpy(dtype=float) / safe_quantities
+    order_ids = fills['order_id'].to_numpy() if 'order_id' in fills else np.full(len(fills), None)
+
+    # Open lots per product: [remaining quantity, fill row, direction]
+    lots = defaultdict(deque)
+    trips = []
+    unmatched_close = 0
+
+    rows = zip(
+        range(len(fills)), fills['product_key'].to_numpy(), fills['position_type'].to_numpy(),
+        fills['trade_type'].to_numpy(), quantities,
+    )
+    for row, product, position_type, trade_type, quantity in rows:
+        if quantity <= 0:
+            continue
+        if position_type == OPENING_POSITION_TYPE:
+            direction = 1 if trade_type == BUY_ACTION else -1
+            lots[product].append([quantity, row, direction])
+        elif position_type == CLOSING_POSITION_TYPE:
+            queue = lots[product]
+            remaining = quantity
+            while remaining > 0 and queue:
+                lot = queue[0]
+                size = min(lot[0], remaining)
+                trips.append((lot[1], row, lot[2], size))
+                lot[0] -= size
+                remaining -= size
+                if lot[0] <= 0:
+                    queue.popleft()
+            if remaining > 0:
+                unmatched_close += remaining
+
+    if unmatched_close:
+        logger.warning(f"{unmatched_close} closed contracts had no open lot (history starts mid-position).")
+
+    times = fills['transaction_time'].to_numpy()
+    prices = fills['price'].to_numpy(dtype=float)
+    fill_ids = fills['id'].to_numpy()
+    products = fills['product_name'].to_numpy()
+
+    trip_array = np.array(trips, dtype=float).reshape(-1, 4)
+    open_rows, close_rows = trip_array[:, 0].astype(int), trip_array[:, 1].astype(int)
+    directions, sizes = trip_array[:, 2], trip_array[:, 3]
+    round_trips = pd.DataFrame({
+        'product_name': products[open_rows],
+        'direction': np.where(directions > 0, 'long', 'short'),
+        'quantity': sizes.astype('int64'),
+        'open_time': times[open_rows],
+        'close_time': times[close_rows],
+        'holding_seconds': (times[close_rows] - times[open_rows]) // np.timedelta64(1, 's'),
+        'open_price': prices[open_rows],
+        'close_price': prices[close_rows],
+        'points': (prices[close_rows] - prices[open_rows]) * directions + 0.0,  # avoid -0.0
+        'fee': (fee_per_contract[open_rows] + fee_per_contract[close_rows]) * sizes,
+        'tax': (tax_per_contract[open_rows] + tax_per_contract[close_rows]) * sizes,
+        'open_fill_id': fill_ids[open_rows],
+        'close_fill_id': fill_ids[close_rows],
+        'open_order_id': order_ids[open_rows],
+        'close_order_id': order_ids[close_rows],
+    }, columns=ROUND_TRIP_COLUMNS)
+
+    remaining_lots = [lot for queue in lots.values() for lot in queue]
+    lot_rows = np.array([lot[1] for lot in remaining_lots], dtype=int)
+    open_lots = pd.DataFrame({
+        'product_name': products[lot_rows],
+        'direction': np.where(np.array([lot[2] for lot in remaining_lots]) > 0, 'long', 'short'),
+        'quantity': np.array([lot[0] for lot in remaining_lots], dtype='int64'),
+        'open_time': times[lot_rows],
+        'open_price': prices[lot_rows],
+        'open_fill_id': fill_ids[lot_rows],
+        'open_order_id': order_ids[lot_rows],
+    }, columns=OPEN_LOT_COLUMNS)
+
+    logger.info(f"Reconstructed {len(round_trips)} round trips from {len(fills)} fills; {len(open_lots)} lots remain open.")
+    return round_trips, open_lots
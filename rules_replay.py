@@ -0,0 +1,218 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+# D-Pro 每日停損：當日第 3 筆虧損後停止交易
+DAILY_STOP_MAX_LOSSES = 3
+# 月資金熔斷：當月累計損益低於月初資金的 15% 時停止當月交易
+CAPITAL_CIRCUIT_BREAKER_RATIO = 0.15
+# 依規則被略過的原因 (依優先順序)
+SKIP_NIGHT_WINDOW = 'night_window'
+SKIP_DAILY_STOP = 'daily_stop'
+SKIP_CAPITAL_HALT = 'capital_halt'
+SKIP_REASONS = (SKIP_NIGHT_WINDOW, SKIP_DAILY_STOP, SKIP_CAPITAL_HALT)
+
+logger = logging.getLogger(__name__)
+
+
+def _seconds_of_day(text: str) -> int:
+    hours, minutes, seconds = (int(part) for part in text.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def night_window_mask(times: pd.Series, windows: List[Dict[str, str]]) -> np.ndarray:
+    """True for times inside any of the restricted `windows` ({'start': 'HH:MM:SS', 'end': ...}, inclusive)."""
+    times = pd.to_datetime(times)
+    seconds = (times.dt.hour * 3600 + times.dt.minute * 60 + times.dt.second).to_numpy()
+    mask = np.zeros(len(seconds), dtype=bool)
+    for window in windows:
+        start, end = _seconds_of_day(window['start']), _seconds_of_day(window['end'])
+        mask |= (seconds >= start) & (seconds <= end)
+    return mask
+
+
+def losses_before(days: pd.Series, pnl: pd.Series, eligible: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    For trades in time order, the number of losing `eligible` trades earlier on the same day.
+    A cumulative count per day minus the trade's own loss, so no per-trade loop is needed.
+    """
+    eligible = np.ones(len(pnl), dtype=bool) if eligible is None else eligible
+    losses = pd.Series((pnl.to_numpy() < 0) & eligible, index=pnl.index).astype('int64')
+    return (losses.groupby(days.to_numpy()).cumsum() - losses).to_numpy()
+
+
+def daily_stop_tags(trades: pd.DataFrame, max_daily_losses: int = DAILY_STOP_MAX_LOSSES) -> pd.DataFrame:
+    """
+    Sequence-accurate daily stop over `trades` (`trade_time`, `net_pnl`): counts each trade's earlier
+    losses that day in trade order (losses_before) and tags every trade after the day's
+    `max_daily_losses`-th loss. Returns a frame aligned with `trades` with `daily_loss_rank`
+    (1-based rank among the day's losses, 0 for other trades) and `after_daily_stop`.
+    """
+    if trades.empty:
+        return pd.DataFrame({'daily_loss_rank': pd.Series(dtype='int64'),
+                             'after_daily_stop': pd.Series(dtype=bool)}, index=trades.index)
+
+    times = pd.DatetimeIndex(pd.to_datetime(trades['trade_time']))
+    order = np.argsort(times.asi8, kind='stable')
+    days = pd.Series(times.normalize()[order])
+    pnl = pd.Series(trades['net_pnl'].astype(float).to_numpy()[order])
+
+    prior_losses = losses_before(days, pnl)
+    rank = np.where(pnl.to_numpy() < 0, prior_losses + 1, 0)
+    # The day's stop is hit once `max_daily_losses` losses precede a trade.
+    after = prior_losses >= max_daily_losses
+
+    tags = pd.DataFrame({'daily_loss_rank': rank, 'after_daily_stop': after}, index=trades.index[order])
+    return tags.reindex(trades.index)
+
+
+def daily_stop_impact(trades: pd.DataFrame, tags: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Trade count and PnL of the trades taken after the daily stop, in total and per day, plus the
+    tagged trades themselves (`trade_id` when present, `trade_time`, `net_pnl`).
+    """
+    after = tags['after_daily_stop'].to_numpy(dtype=bool)
+    tagged = trades[after]
+    times = pd.to_datetime(tagged['trade_time'])
+    pnl = tagged['net_pnl'].astype(float)
+    per_day = pnl.groupby(times.dt.strftime('%Y-%m-%d').to_numpy()).agg(['size', 'sum'])
+
+    columns = [column for column in ('trade_id', 'trade_time', 'net_pnl') if column in tagged.columns]
+    records = tagged[columns].assign(trade_time=times.dt.strftime('%Y-%m-%d %H:%M:%S'), net_pnl=pnl)
+    return {
+        "post_stop_trade_count": int(after.sum()),
+        "post_stop_pnl": float(pnl.sum()),
+        "days": [{"date": day, "trade_count": int(row['size']), "pnl": float(row['sum'])} for day, row in per_day.iterrows()],
+        "trades": records.sort_values('trade_time', kind='stable').to_dict('records'),
+    }
+
+
+def capital_halt_mask(months: pd.Series, pnl: pd.Series, eligible: np.ndarray, start_capital: float,
+                      ratio: float = CAPITAL_CIRCUIT_BREAKER_RATIO) -> np.ndarray:
+    """
+    True for trades after the month's cumulative PnL of `eligible` trades first falls to the
+    breaker threshold (-ratio x start_capital). The breaching trade itself is still counted.
+    """
+    threshold = -start_capital * ratio
+    taken = pd.Series(np.where(eligible, pnl.to_numpy(), 0.0), index=pnl.index)
+    keys = months.to_numpy()
+    breached = (taken.groupby(keys).cumsum() <= threshold).astype('int64')
+    # Breaches strictly before each trade within its month.
+    return (breached.groupby(keys).cumsum() - breached).to_numpy() > 0
+
+
+def replay_rules(trades: pd.DataFrame, monthly_start_capital: float, night_windows: List[Dict[str, str]],
+                 max_daily_losses: int = DAILY_STOP_MAX_LOSSES,
+                 breaker_ratio: float = CAPITAL_CIRCUIT_BREAKER_RATIO) -> pd.DataFrame:
+    """
+    Replays the D-Pro rules over `trades` (`trade_time`, `net_pnl`) in trade order and marks the
+    trades the rules would have prevented, in three vectorized passes over the whole history:
+
+    1. trades inside a night-session window are skipped;
+    2. of the remaining trades, those after the day's `max_daily_losses`-th loss are skipped (daily stop);
+    3. of the rest, those after the month's cumulative PnL breaches -breaker_ratio x capital are skipped.
+
+    Each pass only removes trades later than the ones it depends on, so the passes compose exactly
+    like a sequential replay. Returns a frame aligned with `trades` with `skip_reason` ('' when
+    followed), `followed` and `losses_before` (earlier same-day losses counted by the daily stop).
+    """
+    if trades.empty:
+        return pd.DataFrame({'skip_reason': pd.Series(dtype=object), 'followed': pd.Series(dtype=bool),
+                             'losses_before': pd.Series(dtype='int64')}, index=trades.index)
+
+    times = pd.to_datetime(trades['trade_time'])
+    order = np.argsort(times.to_numpy(), kind='stable')
+    ordered_times = times.iloc[order]
+    pnl = trades['net_pnl'].astype(float).iloc[order]
+    days = ordered_times.dt.normalize()
+    months = ordered_times.dt.to_period('M')
+
+    night = night_window_mask(ordered_times, night_windows)
+    prior_losses = losses_before(days, pnl, ~night)
+    stopped = ~night & (prior_losses >= max_daily_losses)
+    halted = ~night & ~stopped & capital_halt_mask(months, pnl, ~night & ~stopped, monthly_start_capital, breaker_ratio)
+
+    reasons = np.select([night, stopped, halted], list(SKIP_REASONS), default='')
+    replay = pd.DataFrame({'skip_reason': reasons, 'followed': reasons == '', 'losses_before': prior_losses},
+                          index=trades.index[order])
+    return replay.reindex(trades.index)
+
+
+def _kpi_frame(months: pd.Series, pnl: pd.Series) -> pd.DataFrame:
+    """Per-month trade count, PnL, win rate and RR (average win / average loss), computed with one groupby."""
+    frame = pd.DataFrame({
+        'month': months.to_numpy(),
+        'pnl': pnl.to_numpy(),
+        'win': np.where(pnl > 0, pnl, 0.0), 'is_win': (pnl > 0).to_numpy(),
+        'loss': np.where(pnl < 0, -pnl, 0.0), 'is_loss': (pnl < 0).to_numpy(),
+    })
+    kpis = frame.groupby('month').agg(
+        trades=('pnl', 'size'), pnl=('pnl', 'sum'), wins=('is_win', 'sum'), win_sum=('win', 'sum'),
+        losses=('is_loss', 'sum'), loss_sum=('loss', 'sum'),
+    )
+    kpis['win_rate'] = kpis['wins'] / kpis['trades']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_win = np.where(kpis['wins'] > 0, kpis['win_sum'] / kpis['wins'], 0.0)
+        average_loss = kpis['loss_sum'] / kpis['losses']
+        kpis['risk_reward_ratio'] = np.where(kpis['losses'] > 0, average_win / average_loss, np.inf)
+    return kpis
+
+
+def _format_kpis(row: Optional[pd.Series]) -> Dict[str, Any]:
+    """Report layout of one month's KPIs, matching TradeAuditor._calculate_kpis (RR 'Infinity' without losses)."""
+    if row is None:
+        return {"total_pnl": 0.0, "win_rate": f"{0:.2%}", "risk_reward_ratio": "0.0", "trade_count": 0}
+    rr = row['risk_reward_ratio']
+    return {
+        "total_pnl": float(row['pnl']),
+        "win_rate": f"{row['win_rate']:.2%}",
+        "risk_reward_ratio": "Infinity" if np.isinf(rr) else str(round(float(rr), 2)),
+        "trade_count": int(row['trades']),
+    }
+
+
+def _replay_summary(keys: pd.Series, pnl: pd.Series, replay: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    followed = replay['followed'].to_numpy(dtype=bool)
+    actual = _kpi_frame(keys, pnl)
+    counterfactual = _kpi_frame(keys[followed], pnl[followed])
+
+    skipped = pd.DataFrame({'month': keys.to_numpy(), 'reason': replay['skip_reason'].to_numpy(), 'pnl': pnl.to_numpy()})
+    skipped = skipped[skipped['reason'] != ''].groupby(['month', 'reason'])['pnl'].agg(['size', 'sum'])
+
+    summary = {}
+    for key in actual.index:
+        followed_row = counterfactual.loc[key] if key in counterfactual.index else None
+        removed = {}
+        for reason in SKIP_REASONS:
+            count, total = skipped.loc[(key, reason)] if (key, reason) in skipped.index else (0, 0.0)
+            removed[reason] = {"trade_count": int(count), "pnl": float(total)}
+        actual_kpis, followed_kpis = _format_kpis(actual.loc[key]), _format_kpis(followed_row)
+        summary[key] = {
+            "actual": actual_kpis,
+            "rules_followed": followed_kpis,
+            "pnl_difference": followed_kpis['total_pnl'] - actual_kpis['total_pnl'],
+            "skipped": removed,
+        }
+    return summary
+
+
+def monthly_replay_summary(trades: pd.DataFrame, replay: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """
+    Actual vs. rules-followed PnL, win rate and RR per month ('YYYY-MM'), with the number of trades
+    and the PnL each rule removed.
+    """
+    if trades.empty:
+        return {}
+    months = pd.to_datetime(trades['trade_time']).dt.strftime('%Y-%m')
+    return _replay_summary(months, trades['net_pnl'].astype(float), replay)
+
+
+def total_replay_summary(trades: pd.DataFrame, replay: pd.DataFrame) -> Dict[str, Any]:
+    """Same comparison as `monthly_replay_summary` over the whole history."""
+    if trades.empty:
+        return {}
+    keys = pd.Series('all', index=trades.index)
+    return _replay_summary(keys, trades['net_pnl'].astype(float), replay)['all']
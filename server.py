@@ -5,11 +5,15 @@ import logging
 import configparser
 import subprocess
 import json
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body
-from fastapi.responses import JSONResponse
+import hashlib
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body, Query, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict
 from datetime import datetime
 from fastapi.encoders import jsonable_encoder
 import numpy as np
@@ -17,8 +21,23 @@ import sqlite3
 import pandas as pd
 
 # Import the existing auditor class and the logger
-from trade_check import TradeAuditor, logger, UPGRADE_CRITERIA, list_trade_files
+from trade_check import TradeAuditor, logger, UPGRADE_CRITERIA, DNA_SWEEP_RANGE, list_trade_files
 from import_kdata import run_kdata_import
+from db_migrations import apply_migrations
+from trade_matching import update_merged_trades, reset_merged_trades, drop_merged_trades, MERGED_TABLE
+from position_engine import reconstruct_round_trips
+from excursions import update_trade_excursions, EXCURSIONS_TABLE
+from bar_store import load_bar_store
+from continuous_futures import ROLLS_TABLE
+from rules_replay import daily_stop_tags
+from market_context import trade_symbols
+from trade_cube import add_trades_to_cube, rollup_cube, CUBE_TABLE
+from accounts import DEFAULT_ACCOUNT, ACCOUNT_ID_PATTERN, read_config, load_account_config, sync_accounts, list_accounts
+from kline_data import (
+    load_bars, normalize_timeframe, normalize_symbol, list_symbols, bars_to_columns, asof_close_prices, epoch_to_market_time, to_epoch_seconds,
+    KlineCache, MARKET_TZ, DEFAULT_SYMBOL, SYMBOL_PATTERN, TABLE_NAME,
+    DEFAULT_BAR_LIMIT, MAX_BAR_LIMIT, KLINE_CACHE_MAX_BYTES, KLINE_CACHE_MAX_ENTRIES,
+)
 
 app = FastAPI()
 
@@ -30,6 +49,79 @@ TRADEDATA_DIRECTORY = os.path.join(SCRIPT_DIR, "tradedata")
 TRANSACTION_DATA_DIRECTORY = os.path.join(SCRIPT_DIR, "TransactionData")
 CONFIG_FILE = os.path.join(SCRIPT_DIR, 'config.ini')
 
+# --- K-line Response Cache ---
+kline_cache = KlineCache(KLINE_CACHE_MAX_BYTES, KLINE_CACHE_MAX_ENTRIES)
+# 選用的 memmap K 棒檔 (config.ini [KData] bar_store = true)，供分析路徑直接讀取 1 分鐘 K 棒區間
+bar_store = load_bar_store(CONFIG_FILE)
+
+# --- Per-account Audit Workers and Report Caches ---
+# 同時執行的帳戶審計數 (執行緒共用已載入的模組與設定)
+AUDIT_MAX_WORKERS = 4
+# 每個帳戶各自的審計報告快取上限，一個帳戶的大型報告不會擠掉其他帳戶的結果
+AUDIT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+AUDIT_CACHE_MAX_ENTRIES = 16
+# 報告產生時間不存入快取，每次回應時重新標上
+REPORT_TIME_KEYS = ('report_date', 'generatedAt')
+audit_pool = ThreadPoolExecutor(max_workers=AUDIT_MAX_WORKERS, thread_name_prefix='audit')
+audit_caches: Dict[str, KlineCache] = {}
+
+def _audit_cache(account_id: str) -> KlineCache:
+    """The account's own report cache (audits are keyed by source file and account parameters)."""
+    cache = audit_caches.get(account_id)
+    if cache is None:
+        cache = audit_caches.setdefault(account_id, KlineCache(AUDIT_CACHE_MAX_BYTES, AUDIT_CACHE_MAX_ENTRIES))
+    return cache
+
+def _invalidate_audit_caches(account_id: Optional[str] = None):
+    """Drops the cached reports of `account_id` after its trades change, or of every account when None."""
+    for cached_account, cache in list(audit_caches.items()):
+        if account_id is None or cached_account == account_id:
+            cache.clear()
+
+def _invalidate_kline_cache(first: pd.Timestamp, last: pd.Timestamp, symbol: str):
+    """
+    Import callback: drops cached `symbol` K-line responses overlapping newly imported bars, and the
+    audit reports whose trades' market context may read them (see `_run_account_audit`).
+    """
+    dropped = kline_cache.invalidate_range(int(first.timestamp()), int(last.timestamp()), symbol)
+    reports = sum(cache.invalidate_range(int(first.timestamp()), int(last.timestamp()))
+                  for cache in list(audit_caches.values()))
+    logger.info(f"K-line cache: invalidated {dropped} {symbol} entries and {reports} audit reports "
+                f"overlapping [{first}, {last}].")
+
+# --- Chart Data Responses ---
+# `records`: 每根 K 棒 / 每筆交易一個物件；`columns`: 各欄位一個平行陣列 (較小、較快)
+CHART_DATA_FORMATS = '^(records|columns)$'
+# 回應大於此大小 (bytes) 時以 gzip 壓縮
+GZIP_MINIMUM_SIZE = 1024
+
+def _json_body(content) -> bytes:
+    return JSONResponse(content=content).body
+
+def _frame_to_columns(df: pd.DataFrame) -> dict:
+    """Converts a frame to parallel per-column arrays, with NaN replaced by None."""
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if series.isna().any():
+            series = series.astype(object).where(series.notna(), None)
+        columns[name] = series.tolist()
+    return columns
+
+def _conditional_json_response(request: Request, body: bytes) -> Response:
+    """
+    Serves a JSON body with a weak ETag derived from its content, answering 304 Not Modified
+    when the client's If-None-Match already names it. The ETag is weak because gzip may re-encode the body.
+    """
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates or etag[2:] in candidates:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 def init_database():
     """Initializes the database and creates tables if they don't exist."""
     try:
@@ -48,7 +140,7 @@ def init_database():
         ''')
 
         # Create table for trades
-        cursor.execute('''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS trades (
                 trade_id TEXT PRIMARY KEY,
                 trade_time DATETIME,
@@ -60,24 +152,28 @@ def init_database():
                 open_price REAL,
                 close_price REAL,
                 fee REAL,
-                tax REAL
+                tax REAL,
+                account_id TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}'
             )
         ''')
 
         # Create table for market data (K-line)
+        # Existing datetime-keyed tables are converted by migration 5.
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS market_data (
-                datetime TEXT PRIMARY KEY,
+                symbol TEXT NOT NULL,
+                epoch INTEGER NOT NULL,
                 open REAL NOT NULL,
                 high REAL NOT NULL,
                 low REAL NOT NULL,
                 close REAL NOT NULL,
-                volume INTEGER NOT NULL
-            )
+                volume INTEGER NOT NULL,
+                PRIMARY KEY (symbol, epoch)
+            ) WITHOUT ROWID
         ''')
         
         # Create table for TransactionData
-        cursor.execute('''
+        cursor.execute(f'''
             CREATE TABLE IF NOT EXISTS TransactionData (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 transaction_time DATETIME NOT NULL,
@@ -88,14 +184,24 @@ def init_database():
                 commission_fee INT,
                 transaction_tax INT,
                 net_amount DECIMAL(12, 2),
-                order_id VARCHAR(10) UNIQUE,
-                position_type VARCHAR(4)
+                order_id VARCHAR(10),
+                position_type VARCHAR(4),
+                account_id TEXT NOT NULL DEFAULT '{DEFAULT_ACCOUNT}',
+                UNIQUE (account_id, order_id)
             )
         ''')
 
         conn.commit()
+
+        # Bring indexes and schema changes of existing databases up to date in place.
+        schema_version = apply_migrations(conn)
+        # Register the accounts configured in config.ini.
+        if os.path.exists(CONFIG_FILE):
+            accounts = sync_accounts(conn, read_config(CONFIG_FILE))
+            conn.commit()
+            logger.info(f"Configured accounts: {accounts}")
         conn.close()
-        logger.info("Database initialized successfully with all tables.")
+        logger.info(f"Database initialized successfully with all tables (schema version {schema_version}).")
     except Exception as e:
         logger.critical(f"Failed to initialize database: {e}", exc_info=True)
         # We might want to prevent the app from starting if the DB fails
@@ -124,60 +230,67 @@ async def get_kdata_files():
         raise HTTPException(status_code=500, detail="Failed to retrieve KData files from server.")
 
 @app.get("/api/kline_data")
-async def get_kline_data(timeframe: Optional[str] = '1T'): # Default to 1-minute
+async def get_kline_data(
+    request: Request,
+    timeframe: Optional[str] = '1T', # Default to 1-minute
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    before: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_BAR_LIMIT),
+    align: str = Query('clock', pattern='^(clock|session)$'),
+    format: str = Query('records', pattern=CHART_DATA_FORMATS),
+    symbol: str = Query(DEFAULT_SYMBOL, pattern=f'^(?i:{SYMBOL_PATTERN})$')
+):
     """
     API endpoint to retrieve K-line data from the database, formatted for charting.
-    Supports resampling to different timeframes.
+    Supports resampling to different timeframes over a bounded window:
+    - `start` / `end`: UNIX timestamps (seconds) of the first and last bar to return.
+    - `before` + `limit`: the `limit` bars preceding `before`, for scroll-back paging.
+    - `align`: 'clock' (wall-clock buckets) or 'session' (TAIFEX trading-session buckets and trading-day daily bars).
+    - `format`: 'records' (a list of bar objects) or 'columns' (parallel arrays `time`, `open`, ..., `value`).
+    - `symbol`: the instrument to chart (e.g. TXF, MTX, TMF; case-insensitive, default TXF).
+    Without a complete [start, end] window, at most DEFAULT_BAR_LIMIT bars are returned.
+    Responses carry an ETag and honour If-None-Match with 304 Not Modified.
     """
-    logger.info(f"Request received for K-line data with timeframe: {timeframe}")
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        query = "SELECT datetime, open, high, low, close, volume FROM market_data ORDER BY datetime ASC"
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        logger.info(f"K-line trace: Read {len(df)} rows from database.")
+    logger.info(f"Request received for K-line data with symbol: {symbol}, timeframe: {timeframe}, align: {align}, start: {start}, end: {end}, before: {before}, limit: {limit}, format: {format}")
+    if limit is None and (start is None or end is None):
+        limit = DEFAULT_BAR_LIMIT
 
-        if df.empty:
-            logger.warning("No K-line data found in 'market_data' table.")
-            return JSONResponse(content=[])
-
-        df['datetime'] = pd.to_datetime(df['datetime'])
-        df = df.set_index('datetime')
-
-        if timeframe and timeframe != '1T':
-            try:
-                df_resampled = df.resample(timeframe).agg({
-                    'open': 'first',
-                    'high': 'max',
-                    'low': 'min',
-                    'close': 'last',
-                    'volume': 'sum'
-                })
-                logger.info(f"K-line trace: Resampled to {len(df_resampled)} rows before dropping NA.")
+    try:
+        freq = normalize_timeframe(timeframe)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timeframe or resampling error: {timeframe}")
+    symbol = normalize_symbol(symbol)
 
-                df_resampled.dropna(subset=['open', 'high', 'low', 'close'], how='all', inplace=True)
-                logger.info(f"K-line trace: {len(df_resampled)} rows remain after dropping rows with no OHLC.")
+    cache_key = (symbol, freq, align, start, end, before, limit, format)
+    cached_body = kline_cache.get(cache_key)
+    if cached_body is not None:
+        logger.info(f"K-line trace: Served {cache_key} from cache.")
+        return _conditional_json_response(request, cached_body)
 
-                if df_resampled.empty:
-                    logger.warning(f"No K-line data found after resampling to {timeframe}.")
-                    return JSONResponse(content=[])
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            df = load_bars(conn, timeframe=timeframe, start=start, end=end, before=before, limit=limit, align=align,
+                           symbol=symbol)
+        finally:
+            conn.close()
+        span_start, span_end = (None if ts is None else int(ts.timestamp()) for ts in df.attrs['span'])
 
-                df = df_resampled
-            except Exception as e:
-                logger.error(f"Error during resampling with timeframe '{timeframe}': {e}", exc_info=True)
-                raise HTTPException(status_code=400, detail=f"Invalid timeframe or resampling error: {timeframe}")
+        if df.empty:
+            logger.warning(f"No {symbol} K-line data found in 'market_data' table for timeframe {timeframe} in the requested range.")
 
-        df = df.reset_index()
+        columns = bars_to_columns(df)
+        if format == 'columns':
+            chart_data = columns
+        else:
+            # Zipping the parallel arrays is much cheaper than DataFrame.to_dict(orient='records').
+            chart_data = [dict(zip(columns, row)) for row in zip(*columns.values())]
 
-        df.replace({np.nan: None}, inplace=True)
-        
-        df['time'] = df['datetime'].astype('int64') // 10**9
-        df.rename(columns={'volume': 'value'}, inplace=True)
-        
-        chart_data = df[['time', 'open', 'high', 'low', 'close', 'value']].to_dict(orient='records')
-        
-        logger.info(f"K-line trace: Final chart_data has {len(chart_data)} records.")
-        return JSONResponse(content=chart_data)
+        logger.info(f"K-line trace: Final chart_data has {len(df)} bars ({format}).")
+        body = _json_body(chart_data)
+        kline_cache.put(cache_key, body, span_start, span_end, symbol)
+        return _conditional_json_response(request, body)
         
     except sqlite3.OperationalError as e:
         logger.warning(f"Could not retrieve K-line data, table might not exist yet: {e}")
@@ -186,8 +299,46 @@ async def get_kline_data(timeframe: Optional[str] = '1T'): # Default to 1-minute
         logger.error(f"Failed to get K-line data: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to retrieve K-line data.")
 
+@app.get("/api/kline_symbols")
+def get_kline_symbols():
+    """API endpoint to list the symbols that have K-line data."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            symbols = list_symbols(conn)
+        finally:
+            conn.close()
+        return JSONResponse(content={"symbols": symbols, "default": DEFAULT_SYMBOL})
+    except Exception as e:
+        logger.error(f"Failed to list K-line symbols: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to list K-line symbols.")
+
+@app.get("/api/continuous_rolls")
+def get_continuous_rolls(symbol: str = Query(..., pattern=f'^(?i:{SYMBOL_PATTERN})$')):
+    """API endpoint to list the contract rolls of a stored continuous series (e.g. MTXCONT)."""
+    symbol = normalize_symbol(symbol)
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            df = pd.read_sql_query(f"SELECT * FROM {ROLLS_TABLE} WHERE symbol = ? ORDER BY roll_date", conn, params=(symbol,))
+        finally:
+            conn.close()
+        return JSONResponse(content=df.replace({np.nan: None}).to_dict(orient='records'))
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Could not fetch continuous rolls, table might not exist yet: {e}")
+        return JSONResponse(content=[])
+    except Exception as e:
+        logger.error(f"Failed to fetch continuous rolls: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch continuous rolls.")
+
+@app.get("/api/kline_cache/stats")
+def get_kline_cache_stats():
+    """API endpoint to inspect the K-line response cache (hit/miss counts and memory usage)."""
+    return JSONResponse(content=kline_cache.stats())
+
 class KDataImportRequest(BaseModel):
     filename: str
+    force: bool = False
 
 @app.post("/api/import-kdata")
 async def import_kdata_endpoint(request: KDataImportRequest):
@@ -195,7 +346,7 @@ async def import_kdata_endpoint(request: KDataImportRequest):
     filename = request.filename
     logger.info(f"Received request to import K-line data from file: {filename}")
     try:
-        summary_message = run_kdata_import(filename)
+        summary_message = run_kdata_import(filename, on_rows_added=_invalidate_kline_cache, force=request.force)
         logger.info(f"K-line data import process finished for {filename}. {summary_message}")
         return {"status": "success", "message": summary_message}
     except Exception as e:
@@ -203,46 +354,65 @@ async def import_kdata_endpoint(request: KDataImportRequest):
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
 
 @app.get("/api/trade_data")
-async def get_trade_data(start_time: int, end_time: int):
+async def get_trade_data(
+    request: Request,
+    start_time: int,
+    end_time: int,
+    format: str = Query('records', pattern=CHART_DATA_FORMATS),
+    account_id: str = Query(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$'),
+    symbol: Optional[str] = Query(None, pattern=f'^(?i:{SYMBOL_PATTERN})$')
+):
     """
-    API endpoint to retrieve trade data from the database within a specified time range.
-    Returns full trade objects for charting markers and tooltips.
+    API endpoint to retrieve an account's trade data from the database within a specified time range.
+    Returns full trade objects for charting markers and tooltips, or parallel per-column
+    arrays when `format=columns`. Responses carry an ETag and honour If-None-Match.
+    Marker prices come from the bars of `symbol` (the charted symbol) when given, else from each
+    trade's own product (see `market_context.trade_symbols`).
     """
     logger.info(f"TradeData Trace: Request received for trades between {start_time} and {end_time}.")
     try:
+        lower = epoch_to_market_time(start_time)
+        upper = epoch_to_market_time(end_time)
+        # `trades.trade_time` is naive market time stored with either a 'T' or ' ' separator, so the
+        # query is bounded by whole dates (which sort before both) and trimmed exactly after parsing.
+        query = "SELECT * FROM trades WHERE account_id = ? AND trade_time >= ? AND trade_time < ?"
+        params = (account_id, lower.strftime('%Y-%m-%d'), (upper + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
         conn = sqlite3.connect(DB_FILE)
-        
-        start_datetime_iso = datetime.fromtimestamp(start_time).isoformat(sep=' ', timespec='seconds')
-        end_datetime_iso = datetime.fromtimestamp(end_time).isoformat(sep=' ', timespec='seconds')
-        logger.info(f"TradeData Trace: Querying trades between ISO times {start_datetime_iso} and {end_datetime_iso}.")
-
-        # Modified query to select all columns from the trades table
-        query = f"""
-            SELECT
-                t.*,
-                COALESCE(md.close, (SELECT close FROM market_data WHERE datetime <= t.trade_time ORDER BY datetime DESC LIMIT 1)) as marker_price
-            FROM
-                trades t
-            LEFT JOIN
-                market_data md ON t.trade_time = md.datetime
-            WHERE
-                t.trade_time BETWEEN '{start_datetime_iso}' AND '{end_datetime_iso}'
-            ORDER BY
-                t.trade_time ASC
-        """
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        logger.info(f"TradeData Trace: Read {len(df)} trade rows from the database.")
+        try:
+            df = pd.read_sql_query(query, conn, params=params)
+            trade_times = pd.to_datetime(df['trade_time'], format='ISO8601').dt.tz_localize(MARKET_TZ)
+            # The query covers whole days, so the daily stop is evaluated on each day's full trade sequence.
+            stop_tags = daily_stop_tags(pd.DataFrame({'trade_time': trade_times, 'net_pnl': df['net_pnl']}))
+            df['daily_loss_rank'] = stop_tags['daily_loss_rank']
+            df['after_daily_stop'] = stop_tags['after_daily_stop']
+            in_window = ((trade_times >= lower) & (trade_times <= upper)).to_numpy()
+            df, trade_times = df[in_window].copy(), trade_times[in_window]
+            # As-of join: each marker sits on the close of the latest bar at or before the trade.
+            if symbol is not None:
+                marker_symbols = pd.Series(normalize_symbol(symbol), index=df.index)
+            else:
+                marker_symbols = trade_symbols(conn, df['product_name'], trade_times, TABLE_NAME)
+            marker_prices = np.full(len(df), np.nan)
+            for marker_symbol in marker_symbols.unique():
+                positions = np.flatnonzero((marker_symbols == marker_symbol).to_numpy())
+                marker_prices[positions] = asof_close_prices(conn, trade_times.iloc[positions], marker_symbol)
+            df['marker_price'] = marker_prices
+        finally:
+            conn.close()
+        logger.info(f"TradeData Trace: Read {len(df)} trade rows between {lower} and {upper}.")
 
         if df.empty:
             logger.warning("TradeData Trace: No trades found for this time range, returning empty list.")
-            return JSONResponse(content=[])
+            return _conditional_json_response(request, _json_body({} if format == 'columns' else []))
 
-        df['trade_time'] = pd.to_datetime(df['trade_time'])
-        df['time'] = df['trade_time'].astype('int64') // 10**9
-        
+        df['time'] = to_epoch_seconds(trade_times).to_numpy()
         # Convert Timestamp objects to strings before JSON serialization
-        df['trade_time'] = df['trade_time'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        df['trade_time'] = trade_times.dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+        df = df.iloc[np.argsort(df['time'].to_numpy(), kind='stable')]
+
+        if format == 'columns':
+            logger.info(f"TradeData Trace: Prepared {len(df)} trades as columns to return.")
+            return _conditional_json_response(request, _json_body(_frame_to_columns(df)))
 
         # Replace numpy NaN with None for JSON compatibility
         df.replace({np.nan: None}, inplace=True)
@@ -251,7 +421,7 @@ async def get_trade_data(start_time: int, end_time: int):
         trade_records = df.to_dict(orient='records')
         
         logger.info(f"TradeData Trace: Prepared {len(trade_records)} full trade records to return.")
-        return JSONResponse(content=trade_records)
+        return _conditional_json_response(request, _json_body(trade_records))
         
     except sqlite3.OperationalError as e:
         logger.warning(f"Could not retrieve trade data, table might not exist yet: {e}")
@@ -269,9 +439,14 @@ class LogMessage(BaseModel):
 
 class RunCheckRequest(BaseModel):
     filename: str
+    account_id: str = Field(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$')
+
+class BatchCheckRequest(BaseModel):
+    audits: List[RunCheckRequest]
 
 class ImportRequest(BaseModel):
     filename: str
+    account_id: str = Field(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$')
 
 class TradeNote(BaseModel):
     trade_id: str
@@ -290,6 +465,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
 
 @app.post("/api/trade_note")
 async def save_trade_note(note: TradeNote):
@@ -344,9 +520,11 @@ async def get_trade_notes(request: TradeNoteList):
 
 @app.post("/api/import_trades")
 async def import_trades_from_file(request: ImportRequest):
-    """Imports trades from a specified CSV file into the database."""
+    """Imports trades from a specified CSV file into the database, under the request's account."""
     filename = request.filename
-    logger.info(f"Received request to import trades from file: {filename}")
+    account_id = request.account_id
+    logger.info(f"Received request to import trades from file: {filename} into account '{account_id}'")
+    _load_account(account_id)
     
     trade_file_path = os.path.join(TRADEDATA_DIRECTORY, filename)
     
@@ -357,23 +535,25 @@ async def import_trades_from_file(request: ImportRequest):
     try:
         # Use a dummy auditor instance to process the file
         # We need to provide some dummy config values, although they are not used for loading
-        temp_auditor = TradeAuditor(monthly_start_capital=0, current_scale="S1", operation_contracts=1)
+        temp_auditor = TradeAuditor(monthly_start_capital=0, current_scale="S1", operation_contracts=1, account_id=account_id)
         trades_df = temp_auditor.load_transactions_from_csv(trade_file_path)
         trades_df = temp_auditor._generate_trade_ids(trades_df)
         
-        # Add source file information
+        # Add source file and account information
         trades_df['source_file'] = filename
+        trades_df['account_id'] = account_id
         
         # --- Insert into database ---
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         
         inserted_count = 0
-        for _, row in trades_df.iterrows():
+        inserted = np.zeros(len(trades_df), dtype=bool)
+        for position, (_, row) in enumerate(trades_df.iterrows()):
             try:
                 cursor.execute("""
-                    INSERT OR IGNORE INTO trades (trade_id, trade_time, action, net_pnl, contracts, product_name, source_file, open_price, close_price, fee, tax)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT OR IGNORE INTO trades (trade_id, trade_time, action, net_pnl, contracts, product_name, source_file, open_price, close_price, fee, tax, account_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     row['trade_id'],
                     row['trade_time'].isoformat(),
@@ -385,16 +565,22 @@ async def import_trades_from_file(request: ImportRequest):
                     row['open_price'],
                     row['close_price'],
                     row['fee'],
-                    row['tax']
+                    row['tax'],
+                    row['account_id']
                 ))
                 if cursor.rowcount > 0:
                     inserted_count += 1
+                    inserted[position] = True
             except sqlite3.IntegrityError:
                 # This can happen in rare race conditions, INSERT OR IGNORE is preferred
                 logger.warning(f"Trade with ID {row['trade_id']} already exists. Skipping.")
 
+        # Only the newly inserted trades are added to the performance cube, in the same transaction.
+        add_trades_to_cube(conn, trades_df[inserted])
         conn.commit()
         conn.close()
+        if inserted_count:
+            _invalidate_audit_caches(account_id)
         
         total_rows = len(trades_df)
         skipped_count = total_rows - inserted_count
@@ -408,25 +594,43 @@ async def import_trades_from_file(request: ImportRequest):
         raise HTTPException(status_code=500, detail=f"Failed to import trades: {str(e)}")
 
 @app.post("/api/clear_trades")
-async def clear_trades_table():
-    """Clears all data from the 'trades' table. Intended to be used with a frontend confirmation."""
-    logger.warning("Received request to clear ALL trades from the database.")
+async def clear_trades_table(account_id: Optional[str] = Query(None, pattern=f'^{ACCOUNT_ID_PATTERN}$')):
+    """
+    Clears all data from the 'trades' table, or only the trades of `account_id` when given.
+    Excursions and `trades_merged` rows derived from the cleared trades go with them: a full clear
+    resets the merge, a scoped clear only drops that account's merged rows (lowering the merge
+    watermark so re-imported trades are merged again) and leaves the other accounts' matches in place.
+    Intended to be used with a frontend confirmation.
+    """
+    logger.warning(f"Received request to clear {'ALL' if account_id is None else f'account {account_id!r}'} trades from the database.")
+    scope, params = ("", ()) if account_id is None else (" WHERE account_id = ?", (account_id,))
     try:
         conn = sqlite3.connect(DB_FILE)
         cursor = conn.cursor()
         
-        cursor.execute("SELECT COUNT(*) FROM trades")
+        cursor.execute(f"SELECT COUNT(*) FROM trades{scope}", params)
         count_before = cursor.fetchone()[0]
 
         if count_before == 0:
             logger.info("Trades table is already empty. No action taken.")
             return {"status": "success", "message": "Trades table is already empty.", "deleted_rows": 0}
 
-        cursor.execute("DELETE FROM trades")
+        if account_id is None:
+            # trades_merged is derived from trades; start the next merge from scratch.
+            reset_merged_trades(conn)
+            conn.execute(f"DELETE FROM {EXCURSIONS_TABLE}")
+        else:
+            # Also lowers the merge watermark, since later imports may reuse the freed trades rowids.
+            drop_merged_trades(conn, "account_id = ?", params)
+            conn.execute(f"DELETE FROM {EXCURSIONS_TABLE} WHERE trade_id IN "
+                         "(SELECT trade_id FROM trades WHERE account_id = ?)", params)
+        cursor.execute(f"DELETE FROM trades{scope}", params)
+        conn.execute(f"DELETE FROM {CUBE_TABLE}{scope}", params)
         conn.commit()
+        _invalidate_audit_caches(account_id)
         
         # Verify deletion
-        cursor.execute("SELECT COUNT(*) FROM trades")
+        cursor.execute(f"SELECT COUNT(*) FROM trades{scope}", params)
         count_after = cursor.fetchone()[0]
         conn.close()
         
@@ -439,6 +643,44 @@ async def clear_trades_table():
         logger.critical(f"Failed to clear trades table: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to clear trades table: {str(e)}")
 
+@app.get("/api/trade_cube")
+async def get_trade_cube(
+    request: Request,
+    dimensions: str = Query('', description="Comma-separated subset of hour, weekday, month, product, action."),
+    hour: Optional[int] = None,
+    weekday: Optional[int] = None,
+    month: Optional[str] = None,
+    product: Optional[str] = None,
+    action: Optional[str] = None,
+    format: str = Query('records', pattern=CHART_DATA_FORMATS),
+    account_id: str = Query(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$'),
+):
+    """
+    Rolls the account's slice of the materialized trade cube up to the requested dimensions (e.g.
+    `hour,weekday` for a heatmap), optionally filtered on dimension values. Reads only the cube, never the raw trades.
+    """
+    selected = [d.strip() for d in dimensions.split(',') if d.strip()]
+    filters = {name: value for name, value in
+               (('account_id', account_id), ('hour', hour), ('weekday', weekday), ('month', month),
+                ('product', product), ('action', action))
+               if value is not None}
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            cube = rollup_cube(conn, selected, filters)
+        finally:
+            conn.close()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to roll up the trade cube: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to roll up the trade cube.")
+
+    if format == 'columns':
+        return _conditional_json_response(request, _json_body(_frame_to_columns(cube)))
+    cube = cube.replace({np.nan: None})
+    return _conditional_json_response(request, _json_body(cube.to_dict(orient='records')))
+
 @app.get("/api/upgrade-criteria")
 def get_upgrade_criteria():
     """
@@ -474,14 +716,77 @@ def convert_numpy_types(obj):
         return obj.tolist()
     return obj
 
+def _load_account(account_id: str):
+    """Reads the account's parameters from config.ini: 400 for an unknown account, 500 for a broken config."""
+    try:
+        return load_account_config(read_config(CONFIG_FILE), account_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (FileNotFoundError, configparser.Error, KeyError) as e:
+        logger.error(f"Error parsing config file 'config.ini': {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Server configuration error: Could not read 'config.ini'.")
+
+def _stamp_report(body: bytes) -> bytes:
+    """Puts the time of this response in front of a report body cached without its REPORT_TIME_KEYS."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stamp = _json_body({key: now for key in REPORT_TIME_KEYS})
+    # Both are JSON objects: splice the stamp's members before the report's.
+    return stamp[:-1] + b',' + body[1:]
+
+def _last_trade_epoch(account_id: str, filename: str) -> Optional[int]:
+    """UNIX seconds of the last trade imported from `filename` into the account (None without trades)."""
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        last = conn.execute("SELECT MAX(trade_time) FROM trades WHERE account_id = ? AND source_file = ?",
+                            (account_id, filename)).fetchone()[0]
+    finally:
+        conn.close()
+    if last is None:
+        return None
+    return int(pd.Timestamp(last).tz_localize(MARKET_TZ).timestamp())
+
+def _run_account_audit(account, filename: str) -> bytes:
+    """
+    Runs (in an audit worker) the audit of `filename` for `account` and returns the JSON report body.
+    Reports are cached per account, keyed by the file and the account's parameters; the report time
+    is left out of the cached body and stamped on every response.
+    The market context of the trades only reads bars before each trade, so a cached report records
+    its last trade time and is only dropped by K-line imports adding bars before it (of any symbol,
+    since a newly imported symbol can change which symbol describes a product).
+    """
+    cache = _audit_cache(account.account_id)
+    cache_key = (filename, account.monthly_start_capital, account.current_scale, account.start_scale,
+                 account.operation_contracts)
+    body = cache.get(cache_key)
+    if body is not None:
+        logger.info(f"Audit trace: Served account '{account.account_id}' report for '{filename}' from cache.")
+        return _stamp_report(body)
+
+    logger.info(f"Initializing auditor for account '{account.account_id}', scale {account.current_scale} with start capital {account.monthly_start_capital}")
+    auditor = TradeAuditor(
+        monthly_start_capital=account.monthly_start_capital,
+        current_scale=account.current_scale,
+        operation_contracts=account.operation_contracts,
+        account_id=account.account_id,
+        start_scale=account.start_scale
+    )
+    # --- Convert numpy types for JSON serialization ---
+    report = convert_numpy_types(auditor.run_audit(filename))
+    if 'error' in report:
+        return _json_body(report)
+    body = _json_body({key: value for key, value in report.items() if key not in REPORT_TIME_KEYS})
+    cache.put(cache_key, body, None, _last_trade_epoch(account.account_id, filename))
+    return _stamp_report(body)
+
 @app.post("/api/run_check")
 async def run_check_for_file(request: RunCheckRequest):
     """
-    Triggers a new audit based on a specific file from the 'tradedata' directory.
+    Triggers a new audit based on a specific file from the 'tradedata' directory, for the request's account.
     This is the primary endpoint for the frontend.
     """
     filename = request.filename
-    logger.info(f"Received request to run audit for file: {filename}")
+    logger.info(f"Received request to run audit for file: {filename} (account '{request.account_id}')")
+    account = _load_account(request.account_id)
     
     trade_file_path = os.path.join(TRADEDATA_DIRECTORY, filename)
     
@@ -490,41 +795,100 @@ async def run_check_for_file(request: RunCheckRequest):
         raise HTTPException(status_code=404, detail=f"File '{filename}' not found in 'tradedata' directory.")
         
     try:
-        # --- Read configuration from config.ini ---
-        config = configparser.ConfigParser()
-        if not os.path.exists(CONFIG_FILE):
-            raise FileNotFoundError(f"Configuration file '{CONFIG_FILE}' not found on server.")
-        config.read(CONFIG_FILE)
-        
-        monthly_start_capital = config.getfloat('Account', 'monthly_start_capital')
-        current_scale = config.get('Account', 'current_scale')
-        operation_contracts = config.getint('Account', 'operation_contracts')
-
-        # --- Initialize and run the auditor ---
-        logger.info(f"Initializing auditor for scale {current_scale} with start capital {monthly_start_capital}")
-        auditor = TradeAuditor(
-            monthly_start_capital=monthly_start_capital,
-            current_scale=current_scale,
-            operation_contracts=operation_contracts
-        )
-        report = auditor.run_audit(filename)
-
-        # --- Convert numpy types for JSON serialization ---
-        json_compatible_report = convert_numpy_types(report)
-        
+        # The audit runs in the worker pool so the event loop keeps serving other requests.
+        body = await asyncio.get_running_loop().run_in_executor(audit_pool, _run_account_audit, account, filename)
         logger.info(f"Successfully ran audit and generated report for '{filename}'.")
-        return JSONResponse(content=json_compatible_report)
+        return Response(content=body, media_type="application/json")
 
     except (ValueError, FileNotFoundError) as e:
         logger.error(f"Validation or file error during audit for {filename}: {e}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
-    except (configparser.Error, KeyError) as e:
-        logger.error(f"Error parsing config file 'config.ini': {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Server configuration error: Could not read 'config.ini'.")
     except Exception as e:
         logger.critical(f"An unexpected server error occurred during check run for {filename}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
 
+@app.post("/api/run_checks")
+async def run_checks_for_accounts(request: BatchCheckRequest):
+    """
+    Audits several (account, file) pairs concurrently in the audit worker pool, sharing the loaded
+    auditor code. Each result carries its own status, so one failing audit does not fail the others.
+    """
+    logger.info(f"Received request to run {len(request.audits)} audits: {[(a.account_id, a.filename) for a in request.audits]}")
+    accounts = {audit.account_id: _load_account(audit.account_id) for audit in request.audits}
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(audit_pool, _run_account_audit, accounts[audit.account_id], audit.filename)
+          for audit in request.audits),
+        return_exceptions=True,
+    )
+
+    results = []
+    for audit, outcome in zip(request.audits, outcomes):
+        result = {"account_id": audit.account_id, "filename": audit.filename}
+        if isinstance(outcome, Exception):
+            logger.error(f"Audit of '{audit.filename}' for account '{audit.account_id}' failed: {outcome}", exc_info=outcome)
+            result.update(status="error", detail=str(outcome))
+        else:
+            report = json.loads(outcome)
+            result.update(status="error" if "error" in report else "success", report=report)
+        results.append(result)
+    return JSONResponse(content={"results": results})
+
+@app.get("/api/accounts")
+def get_accounts():
+    """Registered accounts with their trade counts and first/last trade times."""
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            accounts = list_accounts(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.error(f"Failed to list accounts: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to list accounts.")
+    return JSONResponse(content=accounts.replace({np.nan: None}).to_dict(orient='records'))
+
+@app.get("/api/audit_cache/stats")
+def get_audit_cache_stats():
+    """API endpoint to inspect each account's audit report cache."""
+    return JSONResponse(content={account_id: cache.stats() for account_id, cache in audit_caches.items()})
+
+
+@app.get("/api/dna_sweep")
+def get_dna_sweep(
+    filename: str,
+    min_threshold: float = Query(DNA_SWEEP_RANGE['MIN'], gt=0),
+    max_threshold: float = Query(DNA_SWEEP_RANGE['MAX'], gt=0),
+    step: float = Query(DNA_SWEEP_RANGE['STEP'], gt=0),
+    account_id: str = Query(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$'),
+):
+    """
+    Trading DNA noise/trend zone statistics and verdicts for every noise threshold in
+    [min_threshold, max_threshold] for the trades imported from `filename` into `account_id`.
+    """
+    logger.info(f"Received request for DNA threshold sweep of '{filename}' ({min_threshold}-{max_threshold}, step {step}).")
+    if min_threshold > max_threshold:
+        raise HTTPException(status_code=400, detail="min_threshold must not exceed max_threshold.")
+    account = _load_account(account_id)
+    try:
+        auditor = TradeAuditor(
+            monthly_start_capital=account.monthly_start_capital,
+            current_scale=account.current_scale,
+            operation_contracts=account.operation_contracts,
+            account_id=account.account_id
+        )
+        sweep = auditor.run_dna_sweep(filename, min_threshold, max_threshold, step)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(f"Validation or file error during DNA sweep for {filename}: {e}", exc_info=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.critical(f"An unexpected server error occurred during DNA sweep for {filename}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
+
+    if 'error' in sweep:
+        raise HTTPException(status_code=404, detail=sweep['error'])
+    return JSONResponse(content=convert_numpy_types(sweep))
+
 
 # Custom encoder for numpy types
 custom_encoder = {
@@ -656,12 +1020,18 @@ async def get_transaction_csv_files():
 
 class TransactionImportRequest(BaseModel):
     filename: str
+    account_id: str = Field(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$')
 
 @app.post("/api/import_transaction_csv")
 async def import_transaction_csv(request: TransactionImportRequest):
-    """Imports transaction data from a specified CSV file into the TransactionData table."""
+    """
+    Imports transaction data from a specified CSV file into the TransactionData table, under the request's account.
+    Opening fills are only matched to trades of the same account.
+    """
     filename = request.filename
-    logger.info(f"Received request to import transaction data from file: {filename}")
+    account_id = request.account_id
+    logger.info(f"Received request to import transaction data from file: {filename} into account '{account_id}'")
+    _load_account(account_id)
     
     file_path = os.path.join(TRANSACTION_DATA_DIRECTORY, filename)
     
@@ -702,8 +1072,8 @@ async def import_transaction_csv(request: TransactionImportRequest):
         for _, row in df.iterrows():
             try:
                 cursor.execute("""
-                    INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, commission_fee, transaction_tax, net_amount, order_id, position_type)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, commission_fee, transaction_tax, net_amount, order_id, position_type, account_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     row['transaction_time'].isoformat(),
                     row['trade_type'],
@@ -714,12 +1084,13 @@ async def import_transaction_csv(request: TransactionImportRequest):
                     row['transaction_tax'],
                     row['net_amount'],
                     row['order_id'],
-                    row['position_type']
+                    row['position_type'],
+                    account_id
                 ))
                 if cursor.rowcount > 0:
                     inserted_count += 1
             except sqlite3.IntegrityError:
-                # This happens if order_id is not unique
+                # This happens if order_id is not unique within the account
                 skipped_count += 1
                 logger.warning(f"Order ID {row['order_id']} already exists. Skipping.")
 
@@ -736,101 +1107,143 @@ async def import_transaction_csv(request: TransactionImportRequest):
         logger.error(f"Failed to import transaction data from {filename}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to import transaction data: {str(e)}")
 
-def merge_trade_data():
+def merge_trade_data(full: bool = False):
     """
     Merges trade data with transaction data to backfill the open trade time.
+    `trades_merged` is updated incrementally from the trades and fills added since the last merge;
+    `full=True` rebuilds it from scratch.
     """
     logger.info(f"Connecting to database: {DB_FILE}")
+    conn = sqlite3.connect(DB_FILE)
     try:
-        conn = sqlite3.connect(DB_FILE)
-        
-        TRADES_TABLE = 'trades'
-        TRANSACTION_DATA_TABLE = 'TransactionData'
-        
-        logger.info(f"Loading data from '{TRADES_TABLE}' and '{TRANSACTION_DATA_TABLE}' tables...")
-        trades_df = pd.read_sql_query(f"SELECT * FROM {TRADES_TABLE}", conn)
-        transactions_df = pd.read_sql_query(f"SELECT * FROM {TRANSACTION_DATA_TABLE}", conn)
-        logger.info(f"Loaded {len(trades_df)} records from '{TRADES_TABLE}'.")
-        logger.info(f"Loaded {len(transactions_df)} records from '{TRANSACTION_DATA_TABLE}'.")
-
-    except Exception as e:
-        logger.error(f"Failed to read data from database: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to read data from database: {str(e)}")
-
-    if trades_df.empty:
-        logger.warning(f"The '{TRADES_TABLE}' table is empty. No data to process.")
-        return "The 'trades' table is empty. No data to process."
-        
-    if transactions_df.empty:
-        logger.warning(f"The '{TRANSACTION_DATA_TABLE}' table is empty. Cannot find open times.")
-        return "The 'TransactionData' table is empty. Cannot find open times."
-
-    trades_df['trade_time'] = pd.to_datetime(trades_df['trade_time'])
-    transactions_df['transaction_time'] = pd.to_datetime(transactions_df['transaction_time'])
-
-    opening_transactions = transactions_df[transactions_df['position_type'] == '新倉'].copy()
-    
-    if opening_transactions.empty:
-        logger.warning("No opening trades ('新倉') found in 'TransactionData'. Cannot proceed.")
-        return "No opening trades ('新倉') found in 'TransactionData'. Cannot proceed."
-        
-    open_times = []
-    match_count = 0
-
-    logger.info("Starting to match open times for each PnL record...")
-    for _, pnl_record in trades_df.iterrows():
-        close_time = pnl_record['trade_time']
-        open_price = pnl_record['open_price']
-        product = pnl_record['product_name']
-
-        candidates = opening_transactions[
-            (opening_transactions['product_name'].str.contains(product, na=False)) &
-            (opening_transactions['price'] == open_price) &
-            (opening_transactions['transaction_time'] < close_time)
-        ]
-
-        if not candidates.empty:
-            candidates['time_diff'] = close_time - candidates['transaction_time']
-            best_match = candidates.loc[candidates['time_diff'].idxmin()]
-            open_times.append(best_match['transaction_time'])
-            match_count += 1
-        else:
-            open_times.append(None)
-
-    trades_df['open_trade_time'] = open_times
-    
-    trades_df['open_trade_time'] = trades_df['open_trade_time'].dt.strftime('%Y-%m-%d %H:%M:%S').fillna('N/A')
-    trades_df['trade_time'] = trades_df['trade_time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-
-    summary = (f"Matching process complete. Found open times for {match_count} out of {len(trades_df)} records.")
-    logger.info(summary)
-
-    try:
-        MERGED_TABLE = 'trades_merged'
-        logger.info(f"Writing merged data to new table: '{MERGED_TABLE}'...")
-        trades_df.to_sql(MERGED_TABLE, conn, if_exists='replace', index=False)
-        logger.info(f"Successfully saved {len(trades_df)} records to '{MERGED_TABLE}' table.")
-        return f"Successfully saved {len(trades_df)} records to '{MERGED_TABLE}' table. {summary}"
+        summary = update_merged_trades(conn, full=full)
+        excursions_stored = update_trade_excursions(conn, full=full, bar_store=bar_store)
     except Exception as e:
-        logger.error(f"Failed to write merged data to database: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to write merged data to database: {str(e)}")
+        logger.error(f"Failed to merge trade data: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to merge trade data: {str(e)}")
     finally:
         conn.close()
         logger.info("Database connection closed.")
 
+    message = (f"{'Rebuilt' if summary['full'] else 'Updated'} '{MERGED_TABLE}': matched {summary['matched']} of "
+               f"{summary['new_trades']} new and {summary['retried']} previously unmatched records. "
+               f"The table now holds {summary['total']} records, {summary['unmatched_total']} without an open time. "
+               f"Stored MAE/MFE for {excursions_stored} trades.")
+    logger.info(message)
+    return message
+
 @app.post("/api/merge_trades")
-async def merge_trades_endpoint():
+async def merge_trades_endpoint(full: bool = False):
     """
     Triggers the process to merge trade data with transaction data to backfill open times.
+    Only data added since the last merge is processed unless `full=true`.
     """
-    logger.info("Received request to merge trades.")
+    logger.info(f"Received request to merge trades (full: {full}).")
     try:
-        result_message = merge_trade_data()
+        result_message = merge_trade_data(full=full)
         return {"status": "success", "message": result_message}
     except Exception as e:
         logger.critical(f"An unexpected error occurred during trade merge: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
 
+@app.get("/api/round_trips")
+async def get_round_trips(
+    request: Request,
+    product: Optional[str] = None,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    format: str = Query('records', pattern=CHART_DATA_FORMATS),
+    account_id: str = Query(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$')
+):
+    """
+    API endpoint to reconstruct round trips from an account's fills in TransactionData with FIFO lot accounting.
+    Optional filters: `product` (exact product name) and a [start_time, end_time] window (UNIX seconds)
+    on the close time. Also returns the lots still open at the end of the fill history.
+    """
+    logger.info(f"Request received for round trips (product: {product}, start: {start_time}, end: {end_time}).")
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            fills_df = pd.read_sql_query("SELECT * FROM TransactionData WHERE account_id = ?", conn, params=(account_id,))
+        finally:
+            conn.close()
+        round_trips, open_lots = reconstruct_round_trips(fills_df)
+
+        if product:
+            round_trips = round_trips[round_trips['product_name'] == product]
+            open_lots = open_lots[open_lots['product_name'] == product]
+        if start_time is not None:
+            round_trips = round_trips[round_trips['close_time'] >= epoch_to_market_time(start_time).tz_localize(None)]
+        if end_time is not None:
+            round_trips = round_trips[round_trips['close_time'] <= epoch_to_market_time(end_time).tz_localize(None)]
+
+        summary = {
+            "round_trips": len(round_trips),
+            "contracts": int(round_trips['quantity'].sum()),
+            "points": float((round_trips['points'] * round_trips['quantity']).sum()),
+            "fee": float(round_trips['fee'].sum()),
+            "tax": float(round_trips['tax'].sum()),
+            "open_contracts": int(open_lots['quantity'].sum()),
+        }
+        frames = {}
+        for name, frame in (("round_trips", round_trips), ("open_lots", open_lots)):
+            frame = frame.copy()
+            for column in ('open_time', 'close_time'):
+                if column in frame:
+                    frame[column] = pd.to_datetime(frame[column]).dt.strftime('%Y-%m-%d %H:%M:%S')
+            frames[name] = _frame_to_columns(frame) if format == 'columns' else frame.replace({np.nan: None}).to_dict(orient='records')
+
+        logger.info(f"Round trips: {summary}")
+        return _conditional_json_response(request, _json_body({"summary": summary, **frames}))
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Could not reconstruct round trips, table might not exist yet: {e}")
+        return JSONResponse(content={"summary": {}, "round_trips": [], "open_lots": []})
+    except Exception as e:
+        logger.error(f"Failed to reconstruct round trips: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to reconstruct round trips.")
+
+@app.get("/api/trade_excursions")
+async def get_trade_excursions(
+    request: Request,
+    start_time: Optional[int] = None,
+    end_time: Optional[int] = None,
+    format: str = Query('records', pattern=CHART_DATA_FORMATS),
+    account_id: str = Query(DEFAULT_ACCOUNT, pattern=f'^{ACCOUNT_ID_PATTERN}$')
+):
+    """
+    API endpoint to fetch the stored MAE/MFE (points) and time-to-MFE of an account's merged trades,
+    optionally limited to trades closed within [start_time, end_time] (UNIX seconds).
+    """
+    logger.info(f"Request received for trade excursions (start: {start_time}, end: {end_time}).")
+    try:
+        conn = sqlite3.connect(DB_FILE)
+        try:
+            df = pd.read_sql_query(f"""
+                SELECT e.trade_id, m.trade_time, m.open_trade_time, m.product_name, m.net_pnl,
+                       e.direction, e.entry_price, e.mae, e.mfe, e.time_to_mfe_seconds, e.bars
+                FROM {EXCURSIONS_TABLE} e JOIN {MERGED_TABLE} m ON m.trade_id = e.trade_id
+                WHERE m.account_id = ?
+                ORDER BY m.trade_time
+            """, conn, params=(account_id,))
+        finally:
+            conn.close()
+
+        close_times = pd.to_datetime(df['trade_time'], format='ISO8601')
+        if start_time is not None:
+            df = df[close_times >= epoch_to_market_time(start_time).tz_localize(None)]
+        if end_time is not None:
+            df = df[close_times <= epoch_to_market_time(end_time).tz_localize(None)]
+
+        data = _frame_to_columns(df) if format == 'columns' else df.replace({np.nan: None}).to_dict(orient='records')
+        logger.info(f"Returning excursions for {len(df)} trades.")
+        return _conditional_json_response(request, _json_body(data))
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Could not fetch trade excursions, table might not exist yet: {e}")
+        return JSONResponse(content=[])
+    except Exception as e:
+        logger.error(f"Failed to fetch trade excursions: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch trade excursions.")
+
 if __name__ == '__main__':
     logger.info("Starting TradeCheck backend server with uvicorn.")
     # This allows running the server directly for testing
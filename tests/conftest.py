@@ -0,0 +1,54 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# --- Test Setup ---
+
+SERVER_CONFIG = """
+[Account]
+monthly_start_capital = 100000
+operation_contracts = 10
+current_scale = S1
+
+[Account:b]
+name = Second account
+monthly_start_capital = 250000
+"""
+
+@pytest.fixture
+def trade_check_module(tmp_path, monkeypatch):
+    """trade_check, first imported from `tmp_path` so its log archiving stays out of the repository."""
+    monkeypatch.chdir(tmp_path)
+    import trade_check
+    return trade_check
+
+@pytest.fixture
+def server_env(tmp_path, monkeypatch):
+    """
+    The FastAPI app with its database, config.ini and data directories redirected to `tmp_path`.
+    Importing trade_check archives log files relative to the working directory, so the first
+    import happens from `tmp_path`.
+    """
+    monkeypatch.chdir(tmp_path)
+    from fastapi.testclient import TestClient
+    import server
+    import trade_check
+
+    db_file = str(tmp_path / 'trade_notes.db')
+    config_file = tmp_path / 'config.ini'
+    config_file.write_text(SERVER_CONFIG, encoding='utf-8')
+    for name in ('tradedata', 'TransactionData'):
+        (tmp_path / name).mkdir()
+    monkeypatch.setattr(server, 'DB_FILE', db_file)
+    monkeypatch.setattr(trade_check, 'DB_FILE', db_file)
+    monkeypatch.setattr(server, 'CONFIG_FILE', str(config_file))
+    monkeypatch.setattr(server, 'TRADEDATA_DIRECTORY', str(tmp_path / 'tradedata'))
+    monkeypatch.setattr(server, 'TRANSACTION_DATA_DIRECTORY', str(tmp_path / 'TransactionData'))
+    monkeypatch.setattr(server, 'audit_caches', {})
+
+    with TestClient(server.app) as client:
+        yield SimpleNamespace(server=server, client=client, path=tmp_path, db_file=db_file)
@@ -0,0 +1,187 @@
+import json
+import sqlite3
+
+import pandas as pd
+
+from trade_matching import update_merged_trades
+
+# --- Test Setup ---
+
+TRADES_CSV = """成交時間,買賣別,商品名稱,口數,新倉價,平倉價,手續費,期交稅,平倉損益淨額
+2025/07/28 12:07:01,買進->賣出,小型期08,1,"23,845","24,248",42,48,"20,060"
+2025/07/29 20:12:00,買進->賣出,小型期08,1,"23,777","23,780",42,48,60
+2025/08/21 21:13:47,賣出->買進,小型期09,1,"23,800","23,821",42,48,"-1,140"
+2025/08/22 09:01:05,買進->賣出,小型期09,1,"23,900","23,960",42,48,"2,910"
+"""
+
+def import_for(env, account_id, filename='trades.csv'):
+    response = env.client.post('/api/import_trades', json={'filename': filename, 'account_id': account_id})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def trade_ids(env, account_id):
+    conn = sqlite3.connect(env.db_file)
+    try:
+        return {row[0] for row in conn.execute("SELECT trade_id FROM trades WHERE account_id = ?", (account_id,))}
+    finally:
+        conn.close()
+
+def setup_two_accounts(env):
+    (env.path / 'tradedata' / 'trades.csv').write_text(TRADES_CSV, encoding='utf-8')
+    import_for(env, 'default')
+    import_for(env, 'b')
+
+# --- Test Cases ---
+
+def test_same_fill_in_two_accounts_gets_two_trade_ids(server_env):
+    setup_two_accounts(server_env)
+
+    default_ids, b_ids = trade_ids(server_env, 'default'), trade_ids(server_env, 'b')
+    assert len(default_ids) == len(b_ids) == 4
+    assert not default_ids & b_ids
+    # Re-importing into an account is still deduplicated within that account.
+    assert (import_for(server_env, 'b')['new'], len(trade_ids(server_env, 'b'))) == (0, 4)
+
+def test_run_checks_returns_a_result_per_account(server_env):
+    setup_two_accounts(server_env)
+
+    response = server_env.client.post('/api/run_checks', json={'audits': [
+        {'account_id': 'default', 'filename': 'trades.csv'},
+        {'account_id': 'b', 'filename': 'trades.csv'},
+        {'account_id': 'b', 'filename': 'missing.csv'},
+    ]})
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert [(r['account_id'], r['filename'], r['status']) for r in results] == [
+        ('default', 'trades.csv', 'success'), ('b', 'trades.csv', 'success'), ('b', 'missing.csv', 'error')]
+
+    default_report, b_report = results[0]['report'], results[1]['report']
+    assert default_report['account_summary']['account_id'] == 'default'
+    assert default_report['account_summary']['monthly_start_capital'] == 100000
+    assert b_report['account_summary']['account_id'] == 'b'
+    assert b_report['account_summary']['monthly_start_capital'] == 250000
+    assert 'error' in results[2]['report']
+
+def test_audit_caches_are_per_account(server_env):
+    server = server_env.server
+    setup_two_accounts(server_env)
+    for account_id in ('default', 'b'):
+        response = server_env.client.post('/api/run_check', json={'filename': 'trades.csv', 'account_id': account_id})
+        assert response.status_code == 200
+
+    assert {account: cache.stats()['entries'] for account, cache in server.audit_caches.items()} == {'default': 1, 'b': 1}
+    # Cached bodies leave out the report time, which each response stamps afresh.
+    cached_body = next(iter(server.audit_caches['b']._entries.values()))[0]
+    assert 'report_date' not in json.loads(cached_body)
+    repeat = server_env.client.post('/api/run_check', json={'filename': 'trades.csv', 'account_id': 'b'}).json()
+    assert server.audit_caches['b'].hits == 1
+    assert repeat['report_date'] == repeat['generatedAt']
+    assert repeat['account_summary']['account_id'] == 'b'
+
+    # Importing new trades into one account only invalidates that account's reports.
+    (server_env.path / 'tradedata' / 'more.csv').write_text(TRADES_CSV.replace('2025/08/22', '2025/08/25'), encoding='utf-8')
+    assert import_for(server_env, 'b', 'more.csv')['new'] == 1
+    assert server.audit_caches['b'].stats()['entries'] == 0
+    assert server.audit_caches['default'].stats()['entries'] == 1
+    server._invalidate_audit_caches()
+    assert server.audit_caches['default'].stats()['entries'] == 0
+
+def test_scoped_clear_keeps_other_accounts_derived_rows(server_env):
+    setup_two_accounts(server_env)
+    conn = sqlite3.connect(server_env.db_file)
+    try:
+        update_merged_trades(conn)
+        conn.executemany("INSERT INTO trade_excursions (trade_id, mae, mfe) VALUES (?, 0, 0)",
+                         [(trade_id,) for trade_id in trade_ids(server_env, 'default') | trade_ids(server_env, 'b')])
+        conn.commit()
+    finally:
+        conn.close()
+
+    response = server_env.client.post('/api/clear_trades', params={'account_id': 'b'})
+    assert response.json()['deleted_rows'] == 4
+
+    default_ids = trade_ids(server_env, 'default')
+    assert len(default_ids) == 4 and not trade_ids(server_env, 'b')
+    conn = sqlite3.connect(server_env.db_file)
+    try:
+        for table in ('trade_excursions', 'trades_merged'):
+            assert {row[0] for row in conn.execute(f"SELECT trade_id FROM {table}")} == default_ids, table
+        cube_accounts = {row[0] for row in conn.execute("SELECT DISTINCT account_id FROM trade_cube")}
+    finally:
+        conn.close()
+    assert cube_accounts == {'default'}
+
+def test_audit_computes_daily_stop_tags_once(server_env, monkeypatch):
+    import trade_check
+    # Three losses on 08-21 stop the day; the fourth trade that day comes after the stop.
+    stopped_day = "\n".join(f"2025/08/21 {hour}:00:00,買進->賣出,小型期09,1,23900,23880,42,48,-1090" for hour in (9, 10, 11, 12))
+    (server_env.path / 'tradedata' / 'stops.csv').write_text(TRADES_CSV + stopped_day + "\n", encoding='utf-8')
+    import_for(server_env, 'default', 'stops.csv')
+    calls = []
+    original = trade_check.daily_stop_tags
+    monkeypatch.setattr(trade_check, 'daily_stop_tags', lambda trades, *args: calls.append(len(trades)) or original(trades, *args))
+
+    response = server_env.client.post('/api/run_check', json={'filename': 'stops.csv'})
+    assert response.status_code == 200
+    # The safety valves, the monthly summary and detailed_trades share one tagging of the whole history.
+    assert calls == [8]
+    report = response.json()
+    assert report['risk_audit']['post_stop_trade_count'] == 2
+    assert {month['month']: month['risk_audit']['post_stop_trade_count'] for month in report['historical_summary']} == {
+        '2025-07': 0, '2025-08': 2}
+
+def test_trades_reimported_after_a_scoped_clear_are_merged(server_env):
+    setup_two_accounts(server_env)
+    assert server_env.client.post('/api/merge_trades').status_code == 200
+    server_env.client.post('/api/clear_trades', params={'account_id': 'b'})
+
+    # The re-imported trades reuse the rowids freed by the clear, below the previous merge watermark.
+    (server_env.path / 'tradedata' / 'again.csv').write_text(TRADES_CSV.replace('2025/07/28 12:07:01', '2025/07/30 09:00:00'), encoding='utf-8')
+    assert import_for(server_env, 'b', 'again.csv')['new'] == 4
+    assert server_env.client.post('/api/merge_trades').status_code == 200
+
+    conn = sqlite3.connect(server_env.db_file)
+    try:
+        merged = {row[0] for row in conn.execute("SELECT trade_id FROM trades_merged")}
+    finally:
+        conn.close()
+    assert merged == trade_ids(server_env, 'default') | trade_ids(server_env, 'b')
+    assert len(merged) == 8
+
+def test_opening_fills_only_match_their_own_accounts_trades(server_env):
+    setup_two_accounts(server_env)
+    # Both accounts opened the 08-22 trade at the same price; the default account's fill is the later one
+    # and the only one a shared pool would hand to both trades first. Order ids are unique per account.
+    fills = "成交時間,買賣別,商品名稱,成交口數,成交價,手續費,交易稅,成交收付,委託書號,倉別\n"
+    (server_env.path / 'TransactionData' / 'default.csv').write_text(
+        fills + '2025/08/22 8:50:00,買進,小型期09,1,"23,900",21,16,0,o1,新倉\n', encoding='utf-8')
+    (server_env.path / 'TransactionData' / 'b.csv').write_text(
+        fills + '2025/08/22 8:46:00,買進,小型期09,1,"23,900",21,16,0,o1,新倉\n', encoding='utf-8')
+    for account_id in ('default', 'b'):
+        response = server_env.client.post('/api/import_transaction_csv', json={'filename': f'{account_id}.csv', 'account_id': account_id})
+        assert response.json()['new'] == 1
+    assert server_env.client.post('/api/merge_trades').status_code == 200
+
+    conn = sqlite3.connect(server_env.db_file)
+    try:
+        matched = conn.execute("""
+            SELECT m.account_id, m.open_trade_time, f.account_id FROM trades_merged m
+            JOIN TransactionData f ON f.id = m.open_fill_id ORDER BY m.account_id
+        """).fetchall()
+    finally:
+        conn.close()
+    assert matched == [('b', '2025-08-22 08:46:00', 'b'), ('default', '2025-08-22 08:50:00', 'default')]
+    round_trips = server_env.client.get('/api/round_trips', params={'account_id': 'b'}).json()
+    assert [lot['open_time'] for lot in round_trips['open_lots']] == ['2025-08-22 08:46:00']
+
+def test_bar_imports_only_drop_reports_reading_those_bars(server_env):
+    server = server_env.server
+    setup_two_accounts(server_env)
+    server_env.client.post('/api/run_check', json={'filename': 'trades.csv'})
+    assert server.audit_caches['default'].stats()['entries'] == 1
+
+    # Bars after the last trade (2025-08-22 09:01:05) are not read by its market context.
+    server._invalidate_kline_cache(pd.Timestamp('2025-08-22 09:02', tz='Asia/Taipei'), pd.Timestamp('2025-08-25 13:45', tz='Asia/Taipei'), 'MTX')
+    assert server.audit_caches['default'].stats()['entries'] == 1
+    server._invalidate_kline_cache(pd.Timestamp('2025-08-01 08:45', tz='Asia/Taipei'), pd.Timestamp('2025-08-01 13:45', tz='Asia/Taipei'), 'TMF')
+    assert server.audit_caches['default'].stats()['entries'] == 0
@@ -0,0 +1,84 @@
+import os
+import sys
+import sqlite3
+import configparser
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from accounts import load_account_config, configured_account_ids, sync_accounts, list_accounts, DEFAULT_ACCOUNT
+from db_migrations import apply_migrations
+from trade_cube import rollup_cube
+
+# --- Test Setup ---
+
+CONFIG = """
+[Account]
+monthly_start_capital = 100000
+operation_contracts = 10
+current_scale = S1
+
+[Account:swing]
+name = Swing account
+monthly_start_capital = 400000
+current_scale = S2
+
+[Account:grown]
+current_scale = S3
+start_scale = S1
+"""
+
+@pytest.fixture
+def config():
+    parser = configparser.ConfigParser()
+    parser.read_string(CONFIG)
+    return parser
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """Tables from before accounts, with one existing trade."""
+    conn = sqlite3.connect(tmp_path / 'trade_notes.db')
+    conn.executescript('''
+        CREATE TABLE trades (
+            trade_id TEXT PRIMARY KEY, trade_time DATETIME, action TEXT, net_pnl REAL, contracts INTEGER,
+            product_name TEXT, source_file TEXT, open_price REAL, close_price REAL, fee REAL, tax REAL
+        );
+        INSERT INTO trades VALUES ('t1', '2025-08-01T09:30:00', '買進->賣出', 100, 1, '小型期08', 'a.csv', 1, 2, 0, 0);
+        CREATE TABLE TransactionData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_time DATETIME NOT NULL, trade_type VARCHAR(4) NOT NULL,
+            product_name VARCHAR(20) NOT NULL, quantity INT NOT NULL, price DECIMAL(10, 2) NOT NULL,
+            commission_fee INT, transaction_tax INT, net_amount DECIMAL(12, 2), order_id VARCHAR(10) UNIQUE,
+            position_type VARCHAR(4)
+        );
+    ''')
+    yield conn
+    conn.close()
+
+# --- Test Cases ---
+
+def test_account_config_falls_back_to_default_section(config):
+    assert configured_account_ids(config) == [DEFAULT_ACCOUNT, 'swing', 'grown']
+    swing = load_account_config(config, 'swing')
+    assert (swing.name, swing.monthly_start_capital, swing.current_scale) == ('Swing account', 400000.0, 'S2')
+    # Not set in [Account:swing]: inherited from [Account].
+    assert swing.operation_contracts == 10
+    assert load_account_config(config).monthly_start_capital == 100000.0
+    # The capital path starts at `start_scale`, else at the account's current scale.
+    assert swing.start_scale == 'S2'
+    assert (load_account_config(config, 'grown').current_scale, load_account_config(config, 'grown').start_scale) == ('S3', 'S1')
+    with pytest.raises(ValueError):
+        load_account_config(config, 'missing')
+
+def test_existing_trades_move_to_default_account(legacy_db, config):
+    apply_migrations(legacy_db)
+    sync_accounts(legacy_db, config)
+    legacy_db.execute("INSERT INTO trades (trade_id, trade_time, action, net_pnl, contracts, product_name, source_file, "
+                      "account_id) VALUES ('t2', '2025-08-01T10:30:00', '買進->賣出', -50, 1, '小型期08', 'a.csv', 'swing')")
+
+    accounts = list_accounts(legacy_db)
+    assert accounts['account_id'].tolist() == [DEFAULT_ACCOUNT, 'swing', 'grown']
+    assert accounts['trade_count'].tolist() == [1, 1, 0]
+    # The migration rebuilt the cube with the existing trade under the default account.
+    cube = rollup_cube(legacy_db, ['account_id'])
+    assert cube[['account_id', 'trade_count']].values.tolist() == [[DEFAULT_ACCOUNT, 1]]
@@ -0,0 +1,81 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bar_store import BarStore
+from kline_data import load_bar_arrays
+from import_kdata import create_market_data_table, import_csv_to_db
+
+# --- Test Setup ---
+
+def _insert_days(conn, days, symbol='TXF'):
+    """Inserts a full day session (08:45-13:44) and the following night session (15:00-04:59) per day."""
+    rows = []
+    for day in days:
+        index = pd.date_range(f'{day} 08:45', periods=300, freq='1min', tz='Asia/Taipei').append(
+            pd.date_range(f'{day} 15:00', periods=840, freq='1min', tz='Asia/Taipei'))
+        rows += [(symbol, int(ts.timestamp()), i, i + 2.0, i - 1.0, i + 1.0, 5) for i, ts in enumerate(index)]
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+
+def _epoch(text):
+    return int(pd.Timestamp(text, tz='Asia/Taipei').timestamp())
+
+# --- Test Cases ---
+
+def test_range_reads_match_sqlite(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    _insert_days(conn, ['2025-08-01', '2025-08-04', '2025-08-05'])
+    store = BarStore(str(tmp_path / 'store'))
+    assert store.build(conn, 'TXF') == 3 * 1140
+    # One index entry per Taipei date with bars (night sessions run past midnight).
+    assert len(np.load(tmp_path / 'store' / 'TXF.days.npy')) == 5
+
+    rng = np.random.default_rng(3)
+    first, last = _epoch('2025-08-01 08:00'), _epoch('2025-08-06 06:00')
+    for lower, upper in np.sort(rng.integers(first, last, (50, 2)), axis=1):
+        expected = load_bar_arrays(conn, pd.Timestamp(int(lower), unit='s', tz='UTC'),
+                                   pd.Timestamp(int(upper), unit='s', tz='UTC'), columns=('high', 'close'))
+        arrays = store.load_bar_arrays(int(lower), int(upper), columns=('high', 'close'))
+        for column in ('time', 'high', 'close'):
+            np.testing.assert_array_equal(arrays[column], expected[column])
+
+    # Reads are views of the memory-mapped file.
+    view = store.read_range('TXF', _epoch('2025-08-04 09:00'), _epoch('2025-08-04 10:00'))
+    assert len(view) == 60 and isinstance(view.base, np.memmap)
+    assert len(store.read_range('MTX')) == 0
+    conn.close()
+
+def test_import_appends_and_backfills_store(tmp_path, monkeypatch):
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    _insert_days(conn, ['2025-08-04'])
+    store = BarStore(str(tmp_path / 'store'))
+    store.build(conn, 'TXF')
+    reader = BarStore(str(tmp_path / 'store'))
+    assert len(reader.bars('TXF')) == 1140
+
+    def import_day(day):
+        index = pd.date_range(f'{day} 08:45', periods=300, freq='1min', tz='Asia/Taipei')
+        path = tmp_path / f'TXF_{day}.csv'
+        pd.DataFrame({'datetime': [ts.isoformat(sep=' ') for ts in index],
+                      'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 1}).to_csv(path, index=False)
+        return import_csv_to_db(conn, str(path), [], bar_store=store)
+
+    assert import_day('2025-08-06') == (300, 0)  # appended in place
+    assert import_day('2025-08-01') == (300, 0)  # backfill rewrites the file
+    assert import_day('2025-08-01') == (0, 300)
+
+    # A separate reader re-maps the changed files and matches the database row for row.
+    bars = reader.bars('TXF')
+    stored = conn.execute("SELECT epoch, open, high, low, close, volume FROM market_data ORDER BY epoch").fetchall()
+    assert len(bars) == len(stored) == 1140 + 600
+    assert bars.tolist() == stored
+    assert len(reader.read_range('TXF', _epoch('2025-08-01 00:00'), _epoch('2025-08-02 00:00'))) == 300
+    conn.close()
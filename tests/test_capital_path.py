@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from capital_path import monthly_path_inputs, capital_path, capital_path_summary, kpi_criteria
+
+# --- Test Setup ---
+
+CRITERIA = {
+    "S1": {"next_scale": "S2", "capital_key": 200000, "rr_key": 1.5, "wr_key": 0.25},
+    "S2": {"next_scale": "S3", "capital_key": 400000, "rr_key": 2.0, "wr_key": 0.30},
+}
+
+def _trades(rows):
+    trades = pd.DataFrame(rows, columns=['trade_time', 'net_pnl'])
+    trades['trade_time'] = pd.to_datetime(trades['trade_time'])
+    return trades
+
+# --- Test Cases ---
+
+def test_capital_and_scale_carry_forward():
+    trades = _trades([
+        ('2025-01-10 09:00:00', 30000),
+        ('2025-01-12 09:00:00', -10000),
+        # February has no trades.
+        ('2025-03-05 09:00:00', -5000),
+    ])
+    inputs = monthly_path_inputs(trades)
+    assert inputs.index.tolist() == ['2025-01', '2025-02', '2025-03']
+
+    path = capital_path(inputs, 190000, 'S1', CRITERIA, 25000, [3, 6, 9, 12])
+    # January: profitable with KPIs met -> 10% incentive paid out; 210,000 reaches S1's capital key.
+    assert path.loc['2025-01', 'happiness_incentive'] == 2000
+    assert path.loc['2025-01', 'upgraded'] and path.loc['2025-01', 'next_scale'] == 'S2'
+    # The upgrade applies from February, which starts from January's closing capital.
+    assert path['scale'].tolist() == ['S1', 'S2', 'S2']
+    assert path['capital_start'].tolist() == [190000, 208000, 208000]
+    # March is a quarter end: the loss and the quarterly cost are both deducted.
+    assert path.loc['2025-03', 'quarterly_cost'] == 25000
+    assert path.loc['2025-03', 'capital_end'] == 178000
+
+    summary = capital_path_summary(path)
+    assert summary['final_capital'] == 178000 and summary['final_scale'] == 'S2'
+    assert summary['upgrades'] == [{"month": '2025-01', "from": 'S1', "to": 'S2'}]
+    assert summary['total_happiness_incentive'] == 2000
+
+def test_unmet_kpis_block_upgrade_and_incentive():
+    # Win rate 100% but no losses gives an infinite RR, which meets the KPIs; the capital does not.
+    trades = _trades([('2025-05-02 09:00:00', 5000)])
+    path = capital_path(monthly_path_inputs(trades), 100000, 'S1', CRITERIA, 25000, [3, 6, 9, 12])
+    assert path.loc['2025-05', 'happiness_incentive'] == 500
+    assert not path.loc['2025-05', 'upgraded']
+
+    # Low RR: no incentive even though the month is profitable.
+    trades = _trades([('2025-05-02 09:00:00', 1000), ('2025-05-03 09:00:00', -900)])
+    path = capital_path(monthly_path_inputs(trades), 300000, 'S1', CRITERIA, 25000, [3, 6, 9, 12])
+    assert path.loc['2025-05', 'happiness_incentive'] == 0
+    assert path.loc['2025-05', 'next_scale'] == 'S1'
+
+def test_top_scale_keeps_previous_kpis():
+    assert kpi_criteria(CRITERIA, 'S3') is CRITERIA['S2']
+
+def test_unknown_scale_raises_value_error(trade_check_module):
+    with pytest.raises(ValueError, match="'S9'"):
+        kpi_criteria(CRITERIA, 'S9')
+    with pytest.raises(ValueError, match="'S9'"):
+        capital_path(monthly_path_inputs(_trades([('2025-05-02 09:00:00', 5000)])), 100000, 'S9', CRITERIA, 0, [])
+
+    auditor = trade_check_module.TradeAuditor(100000, 'S1', 10)
+    # Previously a TypeError from subscripting None.
+    with pytest.raises(ValueError, match="'S9'"):
+        auditor._calculate_happiness_incentive(5000, 0.5, 2.0, 'S9')
+    with pytest.raises(ValueError, match="'S0'"):
+        trade_check_module.TradeAuditor(100000, 'S1', 10, start_scale='S0')
+
+def test_path_starts_at_configured_start_scale(trade_check_module):
+    trades = _trades([('2025-05-02 09:00:00', 5000), ('2025-06-02 09:00:00', 5000)])
+    path = capital_path(monthly_path_inputs(trades), 100000, 'S2', CRITERIA, 0, [])
+    assert path['scale'].tolist() == ['S2', 'S2']
+    assert trade_check_module.TradeAuditor(100000, 'S2', 10).start_scale == 'S2'
+    assert trade_check_module.TradeAuditor(100000, 'S2', 10, start_scale='S1').start_scale == 'S1'
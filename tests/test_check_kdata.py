@@ -0,0 +1,87 @@
+import os
+import sys
+import sqlite3
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from check_kdata import scan_bars, scan_market_data
+from import_kdata import create_market_data_table
+
+# --- Test Setup ---
+
+def _session_bars(day):
+    """A full day session (08:45-13:44) of clean 1-minute bars as arrays."""
+    index = pd.date_range(f'{day} 08:45', periods=300, freq='1min', tz='Asia/Taipei')
+    price = 23000.0 + np.arange(300)
+    return {
+        'epoch': index.as_unit('s').asi8,
+        'open': price, 'high': price + 2, 'low': price - 1, 'close': price + 1, 'volume': np.full(300, 10.0),
+    }
+
+def _take(bars, positions):
+    return {name: values[positions] for name, values in bars.items()}
+
+# --- Test Cases ---
+
+def test_clean_session_has_no_findings():
+    report = scan_bars(_session_bars('2025-08-01'))
+    summary = report['summary']
+    assert summary['bars'] == 300
+    assert all(summary[key] == 0 for key in (
+        'duplicates', 'out_of_order', 'gaps', 'off_session_bars', 'zero_volume_runs', 'spikes', 'high_below_low'))
+    # A day session alone covers 300 of the 1140 minutes of a trading day (day + night sessions).
+    assert report['coverage']['actual'].tolist() == [300]
+    assert report['heatmap'].loc[pd.Timestamp('2025-07-28').date(), 'Fri'] == 300 / 1140
+
+def test_scan_reports_each_kind_of_problem():
+    bars = _session_bars('2025-08-01')
+    bars['volume'][100:108] = 0
+    bars['high'][50] = bars['low'][50] - 5
+    bars['close'][200] *= 1.05
+    bars['high'][200] = bars['close'][200]
+    # Drop 09:00-09:09 and the last 4 minutes; repeat one row and swap two others.
+    positions = np.r_[0:15, 25:150, 149, 150, 152, 151, 153:296]
+    report = scan_bars(_take(bars, positions))
+    summary = report['summary']
+
+    assert (summary['duplicates'], summary['out_of_order']) == (1, 1)
+    gaps = report['gaps']
+    assert gaps['missing_bars'].tolist() == [10, 4]
+    assert gaps['start'].dt.strftime('%H:%M').tolist() == ['09:00', '13:41']
+    assert gaps['end'].dt.strftime('%H:%M').tolist() == ['09:10', '13:45']
+    assert report['zero_volume_runs']['bars'].tolist() == [8]
+    assert report['ohlc_issues']['time'].dt.strftime('%H:%M').tolist() == ['09:35']
+    assert 'high_below_low' in report['ohlc_issues']['issues'].iloc[0]
+    # The jump up and the fall back on the next bar.
+    assert report['spikes']['time'].dt.strftime('%H:%M').tolist() == ['12:05', '12:06']
+
+def test_scan_market_data_reads_one_symbol(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    bars = _session_bars('2025-08-04')
+    rows = zip(bars['epoch'].tolist(), bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+    conn.executemany("INSERT INTO market_data VALUES ('TXF', ?, ?, ?, ?, ?, ?)", rows)
+    conn.execute("INSERT INTO market_data VALUES ('MTX', ?, 1, 1, 1, 1, 1)", (int(bars['epoch'][0]),))
+    conn.commit()
+
+    assert scan_market_data(conn, 'TXF')['summary']['bars'] == 300
+    report = scan_market_data(conn, 'MTX')
+    assert report['summary']['bars'] == 1
+    assert report['summary']['missing_bars'] == 299
+    assert scan_market_data(conn, 'TMF')['summary']['bars'] == 0
+    conn.close()
+
+def test_scan_csv_file_does_not_load_the_importer(tmp_path):
+    csv_file = tmp_path / 'MTX_1m_data.csv'
+    csv_file.write_text("Datetime,Open,High,Low,Close,Volume\n"
+                        "2025-08-04 08:46:00,23000,23002,22999,23001,10\n", encoding='utf-8')
+    script = ("import sys; from check_kdata import scan_csv_file; "
+              f"report = scan_csv_file({str(csv_file)!r}); "
+              "print(report['summary']['bars'], 'import_kdata' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    assert result.stdout.split() == ['1', 'False']
@@ -0,0 +1,80 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from continuous_futures import (
+    build_continuous_series, store_continuous_series, contract_symbols, settlement_date, ROLLS_TABLE,
+)
+from import_kdata import create_market_data_table
+
+# --- Test Setup ---
+
+def _insert_contract(conn, symbol, days, price, volumes):
+    """One 08:45-08:49 day session per business day with a constant price and the day's volume per bar."""
+    rows = []
+    for day, volume in zip(days, volumes):
+        for ts in pd.date_range(f'{day} 08:45', periods=5, freq='1min', tz='Asia/Taipei'):
+            rows.append((symbol, int(ts.timestamp()), price, price + 1, price - 1, price, volume))
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+@pytest.fixture
+def contracts_db(tmp_path):
+    # MTX202508 settles on Wed 2025-08-20; MTX202509 trades 10 points higher and overtakes volume on 08-18.
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    days = pd.bdate_range('2025-08-14', '2025-08-22').strftime('%Y-%m-%d')
+    _insert_contract(conn, 'MTX202508', days[:5], 100.0, [50, 40, 10, 10, 10])
+    _insert_contract(conn, 'MTX202509', days, 110.0, [5, 5, 20, 20, 20, 50, 50])
+    conn.commit()
+    yield conn
+    conn.close()
+
+def _trading_dates(series):
+    return pd.to_datetime(series['epoch'], unit='s', utc=True).dt.tz_convert('Asia/Taipei').dt.strftime('%m-%d')
+
+# --- Test Cases ---
+
+def test_settlement_day_and_contract_symbols():
+    assert settlement_date(2025, 8) == pd.Timestamp('2025-08-20')
+    assert settlement_date(2024, 1) == pd.Timestamp('2024-01-17')
+    symbols = contract_symbols(pd.Series(['小型期09', '小型期01', '微型台指期05', '選擇權']),
+                               pd.Series(['2025-08-21 20:12', '2024-01-02 09:08', '2025-04-25 19:00', '2025-01-01 10:00']))
+    assert symbols[:3].tolist() == ['MTX202509', 'MTX202401', 'TMF202505']
+    assert pd.isna(symbols[3])
+
+def test_settlement_roll_with_back_adjustment(contracts_db):
+    series, rolls = build_continuous_series(contracts_db, 'MTX', 'settlement', 'difference')
+    dates = _trading_dates(series)
+    assert series.loc[dates < '08-20', 'contract'].unique().tolist() == ['MTX202508']
+    assert series.loc[dates >= '08-20', 'contract'].unique().tolist() == ['MTX202509']
+    assert rolls[['roll_date', 'from_contract', 'to_contract', 'gap']].values.tolist() == [
+        ['2025-08-20', 'MTX202508', 'MTX202509', 10.0]]
+    # Earlier prices are shifted onto the latest contract, so the series has no jump at the roll.
+    assert set(series['close']) == {110.0}
+
+    ratio, _ = build_continuous_series(contracts_db, 'MTX', 'settlement', 'ratio')
+    np.testing.assert_allclose(ratio['close'], 110.0)
+    raw, _ = build_continuous_series(contracts_db, 'MTX', 'settlement', 'none')
+    assert sorted(set(raw['close'])) == [100.0, 110.0]
+
+def test_volume_roll_and_stored_series(contracts_db):
+    series, rolls = build_continuous_series(contracts_db, 'MTX', 'volume', 'none')
+    # Volume crosses over on Monday 08-18, so the roll happens on the next trading day.
+    assert rolls['roll_date'].tolist() == ['2025-08-19']
+    assert series.loc[_trading_dates(series) == '08-18', 'contract'].unique().tolist() == ['MTX202508']
+
+    assert store_continuous_series(contracts_db, 'MTX', 'volume', 'none', ['1D']) == len(series) == 35
+    stored = contracts_db.execute("SELECT COUNT(*) FROM market_data WHERE symbol = 'MTXCONT'").fetchone()[0]
+    assert stored == 35
+    assert contracts_db.execute(f"SELECT to_contract FROM {ROLLS_TABLE}").fetchall() == [('MTX202509',)]
+    daily = contracts_db.execute("SELECT COUNT(*) FROM market_data_1d WHERE symbol = 'MTXCONT'").fetchone()[0]
+    assert daily == 7
+    # Rebuilding replaces the previous copy.
+    store_continuous_series(contracts_db, 'MTX', 'settlement', 'difference')
+    assert contracts_db.execute("SELECT COUNT(*) FROM market_data WHERE symbol = 'MTXCONT'").fetchone()[0] == 35
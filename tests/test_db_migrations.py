@@ -0,0 +1,109 @@
+import os
+import sys
+import sqlite3
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from db_migrations import apply_migrations, get_schema_version, Migration, LATEST_VERSION
+
+# --- Test Setup ---
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """A database with the tables created by server.init_database and no secondary indexes."""
+    conn = sqlite3.connect(tmp_path / 'trade_notes.db')
+    conn.executescript('''
+        CREATE TABLE trades (
+            trade_id TEXT PRIMARY KEY, trade_time DATETIME, action TEXT, net_pnl REAL, contracts INTEGER,
+            product_name TEXT, source_file TEXT, open_price REAL, close_price REAL, fee REAL, tax REAL
+        );
+        CREATE TABLE TransactionData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_time DATETIME NOT NULL, trade_type VARCHAR(4) NOT NULL,
+            product_name VARCHAR(20) NOT NULL, quantity INT NOT NULL, price DECIMAL(10, 2) NOT NULL,
+            commission_fee INT, transaction_tax INT, net_amount DECIMAL(12, 2), order_id VARCHAR(10) UNIQUE,
+            position_type VARCHAR(4)
+        );
+        CREATE TABLE market_data (
+            datetime TEXT PRIMARY KEY, open REAL NOT NULL, high REAL NOT NULL, low REAL NOT NULL,
+            close REAL NOT NULL, volume INTEGER NOT NULL
+        );
+        CREATE TABLE market_data_1h (
+            datetime TEXT PRIMARY KEY, open REAL NOT NULL, high REAL NOT NULL, low REAL NOT NULL,
+            close REAL NOT NULL, volume INTEGER NOT NULL
+        );
+        INSERT INTO market_data VALUES ('2025-08-01 08:45:00+08:00', 1, 2, 0.5, 1.5, 3);
+        INSERT INTO market_data VALUES ('2025-08-01 08:46:00', 1, 2, 0.5, 1.5, 4);
+        INSERT INTO market_data_1h VALUES ('2025-08-01 08:00:00+08:00', 1, 2, 0.5, 1.5, 7);
+    ''')
+    yield conn
+    conn.close()
+
+def _plan(conn, query, params=()):
+    return ' | '.join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+
+# --- Test Cases ---
+
+def test_legacy_database_upgrades_in_place(legacy_db):
+    assert get_schema_version(legacy_db) == 0
+    assert 'SCAN trades' in _plan(legacy_db, "SELECT * FROM trades WHERE source_file = ?", ('a.csv',))
+
+    assert apply_migrations(legacy_db) == LATEST_VERSION
+    assert get_schema_version(legacy_db) == LATEST_VERSION
+    # Re-running at startup is a no-op.
+    assert apply_migrations(legacy_db) == LATEST_VERSION
+
+def test_access_paths_use_indexes(legacy_db):
+    apply_migrations(legacy_db)
+    assert 'USING INDEX idx_trades_source_file' in _plan(
+        legacy_db, "SELECT * FROM trades WHERE source_file = ?", ('a.csv',))
+    assert 'USING INDEX idx_trades_trade_time' in _plan(
+        legacy_db, "SELECT * FROM trades WHERE trade_time >= ? AND trade_time < ?", ('2025-08-01', '2025-08-02'))
+    assert 'USING INDEX idx_trades_account_source_file' in _plan(
+        legacy_db, "SELECT * FROM trades WHERE account_id = ? AND source_file = ?", ('default', 'a.csv'))
+    assert 'USING INDEX idx_trades_account_trade_time' in _plan(
+        legacy_db, "SELECT * FROM trades WHERE account_id = ? AND trade_time >= ? AND trade_time < ?",
+        ('default', '2025-08-01', '2025-08-02'))
+    assert 'USING INDEX idx_transactiondata_transaction_time' in _plan(
+        legacy_db, "SELECT * FROM TransactionData WHERE transaction_time >= ?", ('2025-08-01',))
+    assert 'USING COVERING INDEX idx_transactiondata_open_fill' in _plan(
+        legacy_db,
+        "SELECT transaction_time FROM TransactionData WHERE position_type = ? AND product_name = ? AND price = ?",
+        ('新倉', 'MTX', 23000))
+
+def test_market_data_is_rekeyed_by_symbol_and_epoch(legacy_db):
+    apply_migrations(legacy_db)
+    # Naive legacy text is market time (UTC+8).
+    assert legacy_db.execute("SELECT symbol, epoch, volume FROM market_data ORDER BY epoch").fetchall() == [
+        ('TXF', 1754009100, 3), ('TXF', 1754009160, 4)]
+    assert legacy_db.execute("SELECT epoch, volume FROM market_data_1h").fetchall() == [(1754006400, 7)]
+    ddl = legacy_db.execute("SELECT sql FROM sqlite_master WHERE name = 'market_data'").fetchone()[0]
+    assert 'WITHOUT ROWID' in ddl
+    assert 'USING PRIMARY KEY' in _plan(
+        legacy_db, "SELECT * FROM market_data WHERE symbol = ? AND epoch >= ? AND epoch < ?", ('TXF', 0, 1))
+
+def test_failed_migration_rolls_back_to_last_version(legacy_db):
+    broken = [
+        Migration(1, "ok", ["CREATE INDEX idx_ok ON trades (action)"]),
+        Migration(2, "broken", ["CREATE INDEX idx_partial ON trades (fee)", "CREATE INDEX idx_bad ON missing (x)"]),
+    ]
+    with pytest.raises(sqlite3.OperationalError):
+        apply_migrations(legacy_db, broken)
+    assert get_schema_version(legacy_db) == 1
+    indexes = {row[0] for row in legacy_db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert 'idx_ok' in indexes
+    assert 'idx_partial' not in indexes
+
+def test_existing_fills_move_to_default_account(legacy_db):
+    legacy_db.execute("INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, order_id, "
+                      "position_type) VALUES ('2025-08-01 09:00:00', '買進', '小型期08', 1, 23000, 'o1', '新倉')")
+    apply_migrations(legacy_db)
+    assert legacy_db.execute("SELECT id, order_id, account_id FROM TransactionData").fetchall() == [(1, 'o1', 'default')]
+    # Order ids are unique per account.
+    legacy_db.execute("INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, order_id, "
+                      "position_type, account_id) VALUES ('2025-08-01 09:00:00', '買進', '小型期08', 1, 23000, 'o1', '新倉', 'b')")
+    with pytest.raises(sqlite3.IntegrityError):
+        legacy_db.execute("INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, order_id) "
+                          "VALUES ('2025-08-01 09:00:00', '買進', '小型期08', 1, 23000, 'o1')")
+    assert {row[1] for row in legacy_db.execute("PRAGMA table_info(trades_merged)")} >= {'account_id', 'open_fill_id'}
@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dna_sweep import dna_threshold_sweep, sweep_thresholds
+
+# --- Test Setup ---
+
+def make_trades(n=300, seed=7):
+    """Trades with mostly losing small moves, winning large moves and a few trades without points."""
+    rng = np.random.default_rng(seed)
+    points = rng.integers(-220, 221, n).astype(float)
+    points[rng.choice(n, 5, replace=False)] = np.nan
+    # Thresholds land exactly on some |points|, exercising the <= / > boundary.
+    points[:10] = [5, -5, 40, -40, 100, 200, -200, 0, 45, 195]
+    win = np.where(np.abs(np.nan_to_num(points)) > 170, rng.random(n) < 0.8, rng.random(n) < 0.1)
+    pnl = np.where(win, rng.integers(100, 3000, n), -rng.integers(100, 3000, n)).astype(float)
+    return pd.DataFrame({'points': points, 'net_pnl': pnl})
+
+# --- Test Cases ---
+
+def test_sweep_matches_single_threshold_diagnosis(trade_check_module, monkeypatch):
+    trade_check = trade_check_module
+    rules = trade_check.TRADING_DNA_RULES
+    trades = make_trades()
+    thresholds = sweep_thresholds(5, 200, 5)
+    assert thresholds.tolist() == list(range(5, 201, 5))
+
+    curve = dna_threshold_sweep(trades['points'], trades['net_pnl'], thresholds, rules)
+    auditor = trade_check.TradeAuditor(100000, 'S1', 10)
+    verdicts = set()
+    for entry in curve:
+        monkeypatch.setitem(rules, 'NOISE_ZONE_THRESHOLD', entry['threshold'])
+        diagnosis = auditor._run_trading_dna_diagnosis(trades)
+        for zone in ('noise_zone', 'trend_zone'):
+            swept = {key: value for key, value in entry[zone].items() if key != 'trade_ratio'}
+            assert swept == diagnosis[zone], (entry['threshold'], zone)
+            verdicts.add(swept['verdict'])
+    # The data reaches every verdict somewhere on the curve.
+    assert {"陷入泥淖 (Stuck in the Mud)", "防守得宜 (Good Defense)",
+            "獲利核心 (Profit Core)", "錯失行情 (Missed Trends)"} <= verdicts
@@ -0,0 +1,130 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from excursions import compute_excursions, update_trade_excursions
+from kline_data import load_bar_arrays
+from import_kdata import create_market_data_table
+from db_migrations import apply_migrations
+
+# --- Test Setup ---
+
+def _bar_db(tmp_path):
+    """1-minute bars from 08:45 Taipei; bar i has high 23002+i and low 22999+i."""
+    conn = sqlite3.connect(tmp_path / 'trade_notes.db')
+    create_market_data_table(conn)
+    index = pd.date_range('2025-08-01 08:45', periods=120, freq='1min', tz='Asia/Taipei')
+    rows = [('TXF', int(ts.timestamp()), 23000.0 + i, 23002.0 + i, 22999.0 + i, 23001.0 + i, 10) for i, ts in enumerate(index)]
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executescript('''
+        CREATE TABLE trades (
+            trade_id TEXT PRIMARY KEY, trade_time DATETIME, action TEXT, net_pnl REAL, contracts INTEGER,
+            product_name TEXT, source_file TEXT, open_price REAL, close_price REAL, fee REAL, tax REAL
+        );
+        CREATE TABLE TransactionData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_time DATETIME NOT NULL, trade_type VARCHAR(4) NOT NULL,
+            product_name VARCHAR(20) NOT NULL, quantity INT NOT NULL, price DECIMAL(10, 2) NOT NULL,
+            position_type VARCHAR(4) NOT NULL
+        );
+    ''')
+    apply_migrations(conn)
+    return conn
+
+def _epoch(text):
+    return int(pd.Timestamp(text, tz='Asia/Taipei').timestamp())
+
+# --- Tests ---
+
+def test_compute_excursions_matches_per_trade_scan(tmp_path):
+    conn = _bar_db(tmp_path)
+    bars = load_bar_arrays(conn)
+    rng = np.random.default_rng(7)
+    opens = _epoch('2025-08-01 08:40') + rng.integers(0, 7200, 50)
+    round_trips = pd.DataFrame({
+        'open_epoch': opens,
+        'close_epoch': opens + rng.integers(0, 1800, 50),
+        'direction': rng.choice([1, -1], 50),
+        'entry_price': rng.integers(23000, 23100, 50).astype(float),
+    })
+    result = compute_excursions(round_trips, bars)
+
+    for i, trip in round_trips.iterrows():
+        covered = (bars['time'] >= trip['open_epoch'] // 60 * 60) & (bars['time'] <= trip['close_epoch'])
+        assert result.loc[i, 'bars'] == covered.sum()
+        if not covered.any():
+            assert np.isnan(result.loc[i, 'mfe'])
+            continue
+        high, low = bars['high'][covered].max(), bars['low'][covered].min()
+        if trip['direction'] > 0:
+            expected_mfe, expected_mae = high - trip['entry_price'], trip['entry_price'] - low
+        else:
+            expected_mfe, expected_mae = trip['entry_price'] - low, high - trip['entry_price']
+        assert result.loc[i, 'mfe'] == max(expected_mfe, 0)
+        assert result.loc[i, 'mae'] == max(expected_mae, 0)
+        favorable = bars['high'] if trip['direction'] > 0 else bars['low']
+        extreme = high if trip['direction'] > 0 else low
+        first_bar = np.flatnonzero(covered & (favorable == extreme))[0]
+        assert result.loc[i, 'time_to_mfe_seconds'] == max(bars['time'][first_bar] - trip['open_epoch'], 0)
+    conn.close()
+
+def test_time_to_mfe_takes_first_bar_of_tied_extremes():
+    # Highs and lows repeat their extremes; windows overlap and are listed out of time order.
+    times = np.arange(10, dtype='int64') * 60
+    bars = {'time': times, 'high': np.array([5, 9, 7, 9, 9, 3, 8, 8, 2, 8.0]),
+            'low': np.array([4, 1, 6, 1, 5, 2, 7, 2, 2, 7.0])}
+    round_trips = pd.DataFrame({
+        'open_epoch': [300, 10, 0, 200, 5000],
+        'close_epoch': [590, 250, 590, 250, 5100],
+        'direction': [1, 1, -1, -1, 1],
+        'entry_price': [5.0, 5.0, 5.0, 5.0, 5.0],
+    })
+    result = compute_excursions(round_trips, bars)
+    # Long 05:00-09:50 peaks at 8 first at 06:00; long 00:10-04:10 at 9 first at 01:00; short over
+    # everything bottoms at 1 first at 01:00; short 03:20-04:10 at 03:00 (the bar holding the entry).
+    assert result['time_to_mfe_seconds'].tolist()[:4] == [60, 50, 60, 0]
+    assert result['mfe'].tolist()[:4] == [3, 4, 4, 4]
+    assert result.loc[4, 'bars'] == 0 and np.isnan(result.loc[4, 'time_to_mfe_seconds'])
+
+def test_update_trade_excursions_stores_by_trade_id(tmp_path):
+    conn = _bar_db(tmp_path)
+    conn.executemany("INSERT INTO trades_merged (trade_id, trade_time, action, open_price, open_trade_time) VALUES (?, ?, ?, ?, ?)", [
+        # Long from bar 10 (08:55) to bar 20 (09:05): high 23022 at 09:05, low 23009 at 08:55.
+        ('t1', '2025-08-01T09:05:30', '買進->賣出', 23010.0, '2025-08-01 08:55:10'),
+        ('t2', '2025-08-01T09:05:30', '賣出->買進', 23010.0, '2025-08-01 08:55:10'),
+        ('t3', '2025-08-02T09:05:30', '買進->賣出', 23010.0, '2025-08-02 08:55:10'),  # no bars yet
+        ('t4', '2025-08-01T09:05:30', '買進->賣出', 23010.0, 'N/A'),
+    ])
+    conn.commit()
+
+    assert update_trade_excursions(conn) == 2
+    stored = pd.read_sql_query("SELECT * FROM trade_excursions ORDER BY trade_id", conn).set_index('trade_id')
+    assert stored.loc['t1', ['mfe', 'mae']].tolist() == [12.0, 1.0]
+    assert stored.loc['t1', 'time_to_mfe_seconds'] == 600 - 10
+    assert stored.loc['t2', ['mfe', 'mae']].tolist() == [1.0, 12.0]
+    assert stored.loc['t2', 'direction'] == 'short'
+    # Already stored trades are not recomputed.
+    assert update_trade_excursions(conn) == 0
+    conn.close()
+
+def test_update_trade_excursions_uses_each_products_bars(tmp_path):
+    conn = _bar_db(tmp_path)
+    # MTX trades 10000 points below TXF in the same minutes.
+    index = pd.date_range('2025-08-01 08:45', periods=120, freq='1min', tz='Asia/Taipei')
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", [
+        ('MTX', int(ts.timestamp()), 13000.0 + i, 13002.0 + i, 12999.0 + i, 13001.0 + i, 10) for i, ts in enumerate(index)])
+    conn.executemany("INSERT INTO trades_merged (trade_id, trade_time, action, open_price, open_trade_time, product_name) "
+                     "VALUES (?, ?, ?, ?, ?, ?)", [
+        ('txf', '2025-08-01T09:05:30', '買進->賣出', 23010.0, '2025-08-01 08:55:10', '大型期08'),
+        ('mtx', '2025-08-01T09:05:30', '買進->賣出', 13010.0, '2025-08-01 08:55:10', '小型期08'),
+    ])
+    conn.commit()
+
+    assert update_trade_excursions(conn) == 2
+    stored = pd.read_sql_query("SELECT * FROM trade_excursions ORDER BY trade_id", conn).set_index('trade_id')
+    assert stored.loc['mtx', ['mfe', 'mae']].tolist() == stored.loc['txf', ['mfe', 'mae']].tolist() == [12.0, 1.0]
+    conn.close()
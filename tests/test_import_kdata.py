@@ -0,0 +1,87 @@
+import os
+import sys
+import queue
+import sqlite3
+import functools
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import import_kdata
+from import_kdata import run_kdata_import, MANIFEST_TABLE
+from kdata_csv import parse_csv_to_queue
+
+# --- Test Setup ---
+
+@pytest.fixture
+def kdata_dir(tmp_path, monkeypatch):
+    """Points the importer at a temporary KData directory and database."""
+    directory = tmp_path / 'KData'
+    directory.mkdir()
+    monkeypatch.setattr(import_kdata, 'KDATA_DIR', str(directory))
+    monkeypatch.setattr(import_kdata, 'DB_PATH', str(tmp_path / 'trade_notes.db'))
+    monkeypatch.setattr(import_kdata, 'CONFIG_PATH', str(tmp_path / 'config.ini'))
+    return directory
+
+def _write_kdata(path, start, periods=30):
+    index = pd.date_range(start, periods=periods, freq='1min', tz='Asia/Taipei')
+    pd.DataFrame({
+        'datetime': [ts.isoformat(sep=' ') for ts in index],
+        'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 1,
+    }).to_csv(path, index=False)
+
+def _manifest(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'trade_notes.db')
+    try:
+        return pd.read_sql_query(f"SELECT * FROM {MANIFEST_TABLE} ORDER BY path", conn).set_index('path')
+    finally:
+        conn.close()
+
+# --- Test Cases ---
+
+def test_manifest_skips_unchanged_files(kdata_dir, tmp_path):
+    _write_kdata(kdata_dir / 'TXF_a.csv', '2025-08-01 08:45')
+    _write_kdata(kdata_dir / 'MTX_b.csv', '2025-08-01 08:45')
+    _write_kdata(kdata_dir / 'TXF_c.csv', '2025-08-04 08:45')
+
+    # Three files are parsed by worker processes and written by this process.
+    assert 'New records: 90' in run_kdata_import(workers=2)
+    manifest = _manifest(tmp_path)
+    assert list(manifest.index) == ['MTX_b.csv', 'TXF_a.csv', 'TXF_c.csv']
+    assert manifest.loc['MTX_b.csv', 'symbols'] == 'MTX'
+    assert manifest.loc['TXF_c.csv', 'row_count'] == 30
+    assert manifest.loc['TXF_c.csv', 'last_epoch'] - manifest.loc['TXF_c.csv', 'first_epoch'] == 29 * 60
+
+    assert '3 unchanged and skipped. New records: 0, Skipped duplicates: 0' in run_kdata_import()
+
+    # Touching a file without changing its content only refreshes the manifest.
+    os.utime(kdata_dir / 'TXF_a.csv', ns=(1, 1))
+    assert '3 unchanged and skipped' in run_kdata_import()
+
+    # A changed file is re-imported; rows already stored are counted as duplicates.
+    _write_kdata(kdata_dir / 'TXF_a.csv', '2025-08-01 08:45', periods=40)
+    assert '2 unchanged and skipped. New records: 10, Skipped duplicates: 30' in run_kdata_import()
+    assert _manifest(tmp_path).loc['TXF_a.csv', 'row_count'] == 40
+
+def test_parallel_import_streams_chunks_and_isolates_bad_files(kdata_dir, tmp_path, monkeypatch):
+    # Small chunks so every file crosses the worker queue in several pieces.
+    monkeypatch.setattr(import_kdata, 'parse_csv_to_queue', functools.partial(parse_csv_to_queue, chunk_size=7))
+    _write_kdata(kdata_dir / 'TXF_a.csv', '2025-08-01 08:45')
+    (kdata_dir / 'TXF_bad.csv').write_text("when,price\n2025-08-01 08:45,1\n", encoding='utf-8')
+    _write_kdata(kdata_dir / 'TXF_c.csv', '2025-08-04 08:45', periods=50)
+
+    assert 'New records: 80' in run_kdata_import(workers=2)
+    manifest = _manifest(tmp_path)
+    assert list(manifest.index) == ['TXF_a.csv', 'TXF_c.csv']
+    assert manifest.loc['TXF_c.csv', 'row_count'] == 50
+
+def test_parse_worker_queues_chunks_then_sentinel(tmp_path):
+    _write_kdata(tmp_path / 'MTX_x.csv', '2025-08-01 08:45', periods=20)
+    chunk_queue = queue.Queue()
+    parse_csv_to_queue(str(tmp_path / 'MTX_x.csv'), chunk_queue, chunk_size=8)
+    items = [chunk_queue.get_nowait() for _ in range(chunk_queue.qsize())]
+    assert items[-1] is None
+    assert [len(rows) for rows, _ in items[:-1]] == [8, 8, 4]
+    assert set(items[0][0]['symbol']) == {'MTX'}
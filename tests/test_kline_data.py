@@ -0,0 +1,199 @@
+import os
+import sys
+import sqlite3
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from kline_data import load_bars, normalize_timeframe, to_epoch_seconds, epoch_to_market_time
+from import_kdata import create_market_data_table
+
+# --- Test Setup ---
+
+@pytest.fixture
+def market_db(tmp_path):
+    """Creates a database with two trading days of synthetic 1-minute bars (08:45-13:44)."""
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    rows = []
+    for day in ['2025-08-01', '2025-08-04']:
+        index = pd.date_range(f'{day} 08:45', periods=300, freq='1min', tz='Asia/Taipei')
+        for i, ts in enumerate(index):
+            price = 23000.0 + i
+            rows.append(('TXF', int(ts.timestamp()), price, price + 2, price - 1, price + 1, 10))
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    yield conn
+    conn.close()
+
+def _epoch(text):
+    return int(pd.Timestamp(text, tz='Asia/Taipei').timestamp())
+
+# --- Test Cases ---
+
+def test_normalize_timeframe_accepts_legacy_aliases():
+    assert normalize_timeframe('1T') == '1min'
+    assert normalize_timeframe('15T') == '15min'
+    assert normalize_timeframe('1H') == '1h'
+    assert normalize_timeframe('1D') == '1D'
+    with pytest.raises(ValueError):
+        normalize_timeframe('1W')
+
+def test_range_query_pads_to_whole_buckets(market_db):
+    # 08:47 is inside the 08:45 bucket; the bar must still include 08:45 and 08:46.
+    bars = load_bars(market_db, timeframe='5T', start=_epoch('2025-08-01 08:47'), end=_epoch('2025-08-01 09:01'))
+    assert list(bars.index.strftime('%H:%M')) == ['08:45', '08:50', '08:55', '09:00']
+    first = bars.iloc[0]
+    assert first['open'] == 23000.0
+    assert first['close'] == 23005.0
+    assert first['volume'] == 50
+    # The last bucket is complete even though `end` falls in its middle.
+    assert bars.iloc[-1]['volume'] == 50
+
+def test_limit_without_start_returns_latest_bars(market_db):
+    bars = load_bars(market_db, timeframe='1T', limit=3)
+    assert list(bars.index.strftime('%Y-%m-%d %H:%M')) == ['2025-08-04 13:42', '2025-08-04 13:43', '2025-08-04 13:44']
+
+def test_bars_before_timestamp_for_scroll_back(market_db):
+    before = _epoch('2025-08-04 08:45')
+    bars = load_bars(market_db, timeframe='1H', before=before, limit=2)
+    assert list(bars.index.strftime('%Y-%m-%d %H:%M')) == ['2025-08-01 12:00', '2025-08-01 13:00']
+    # The edge bucket is complete, not truncated by the row limit.
+    assert bars.iloc[0]['volume'] == 600
+
+def test_daily_bars_and_epoch_times(market_db):
+    bars = load_bars(market_db, timeframe='1D', limit=10)
+    assert len(bars) == 2
+    assert bars.iloc[0]['volume'] == 3000
+    epochs = to_epoch_seconds(bars.reset_index()['datetime'])
+    assert epoch_to_market_time(epochs.iloc[0]) == pd.Timestamp('2025-08-01', tz='Asia/Taipei')
+
+def test_import_maintains_aggregate_tables(tmp_path):
+    from import_kdata import import_csv_to_db
+    from kline_data import aggregate_table_name, resample_bars, _query_raw_bars, epochs_to_market_index
+
+    csv_path = tmp_path / 'TXF_1m_data_test.csv'
+    index = pd.date_range('2025-08-01 08:45', periods=120, freq='1min', tz='Asia/Taipei')
+    pd.DataFrame({
+        'datetime': [ts.isoformat(sep=' ') for ts in index],
+        'Open': range(120), 'High': range(1, 121), 'Low': range(120), 'Close': range(120), 'Volume': 1,
+    }).to_csv(csv_path, index=False)
+
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    assert import_csv_to_db(conn, str(csv_path), ['15T', '1H']) == (120, 0)
+
+    hourly = pd.read_sql_query(f"SELECT * FROM {aggregate_table_name('1H')} ORDER BY epoch", conn)
+    assert list(epochs_to_market_index(hourly['epoch']).strftime('%H:%M')) == ['08:00', '09:00', '10:00']
+    assert list(hourly['volume']) == [15, 60, 45]
+
+    # Served straight from the derived table, identical to resampling the raw bars.
+    served = load_bars(conn, timeframe='15T', limit=100)
+    expected = resample_bars(_query_raw_bars(conn, None, None), '15T')
+    pd.testing.assert_frame_equal(served, expected, check_dtype=False, check_freq=False)
+
+    # Re-importing the same file adds no rows and leaves the aggregates untouched.
+    assert import_csv_to_db(conn, str(csv_path), ['15T', '1H']) == (0, 120)
+    conn.close()
+
+def test_chunked_import_counts_and_normalizes_rows(tmp_path):
+    from import_kdata import import_csv_to_db
+
+    csv_path = tmp_path / 'TXF_1m_data_test.csv'
+    index = pd.date_range('2025-08-01 08:45', periods=25, freq='1min', tz='Asia/Taipei')
+    pd.DataFrame({
+        # Offsets are honoured when keying by epoch; one unparseable row is dropped.
+        '時間': [ts.tz_convert('UTC').isoformat() for ts in index[:-1]] + ['not a time'],
+        '開盤價': 1.0, '最高價': 2.0, '最低價': 0.5, '收盤價': 1.5, '成交量': 3,
+    }).to_csv(csv_path, index=False)
+
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    conn.execute("INSERT INTO market_data VALUES ('TXF', ?, 1, 2, 0.5, 1.5, 3)", (int(index[0].timestamp()),))
+    conn.commit()
+
+    assert import_csv_to_db(conn, str(csv_path), [], chunk_size=7) == (23, 1)
+    stored = [row[0] for row in conn.execute("SELECT epoch FROM market_data ORDER BY epoch")]
+    assert stored == [int(ts.timestamp()) for ts in index[:-1]]
+    conn.close()
+
+def test_symbols_are_imported_and_served_separately(tmp_path):
+    from import_kdata import import_csv_to_db
+    from kline_data import list_symbols
+
+    index = pd.date_range('2025-08-01 08:45', periods=60, freq='1min', tz='Asia/Taipei')
+    for name, price in (('TXF_1m_data_test.csv', 23000.0), ('MTX_1m_data_test.csv', 100.0)):
+        pd.DataFrame({
+            'datetime': [ts.isoformat(sep=' ') for ts in index],
+            'Open': price, 'High': price, 'Low': price, 'Close': price, 'Volume': 1,
+        }).to_csv(tmp_path / name, index=False)
+    # A symbol column overrides the file name.
+    pd.DataFrame({
+        'datetime': [ts.isoformat(sep=' ') for ts in index[:2]], 'Symbol': ['tmf', 'TMF'],
+        'Open': 5.0, 'High': 5.0, 'Low': 5.0, 'Close': 5.0, 'Volume': 1,
+    }).to_csv(tmp_path / 'TXF_extra.csv', index=False)
+
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    for name in ('TXF_1m_data_test.csv', 'MTX_1m_data_test.csv', 'TXF_extra.csv'):
+        import_csv_to_db(conn, str(tmp_path / name), ['15T'])
+    assert list_symbols(conn) == ['MTX', 'TMF', 'TXF']
+
+    for symbol, price, bars in (('TXF', 23000.0, 4), ('MTX', 100.0, 4), ('TMF', 5.0, 1)):
+        served = load_bars(conn, timeframe='15T', limit=100, symbol=symbol)
+        assert len(served) == bars
+        assert set(served['close']) == {price}
+    conn.close()
+
+def test_kline_cache_evicts_by_size_and_invalidates_overlapping_spans(market_db):
+    from kline_data import KlineCache
+
+    cache = KlineCache(max_bytes=10, max_entries=10)
+    cache.put('old', b'1234', 0, 100)
+    cache.put('tail', b'5678', 200, None)
+    assert cache.get('old') == b'1234'
+    cache.put('new', b'90', 300, 400)  # 10 bytes total still fits
+    cache.put('big', b'xyz', 500, 600)  # evicts the least recently used entry ('tail')
+    assert cache.get('tail') is None
+    assert cache.stats()['evictions'] == 1
+
+    # Only entries whose span overlaps the imported range are dropped.
+    assert cache.invalidate_range(350, 550) == 2
+    assert cache.get('old') == b'1234'
+
+    # An import of one symbol leaves the other symbols' entries alone.
+    cache.put('txf', b'1', 0, 100, 'TXF')
+    cache.put('mtx', b'2', 0, 100, 'MTX')
+    assert cache.invalidate_range(50, 60, 'MTX') == 2  # 'mtx' and the symbol-independent 'old'
+    assert (cache.get('txf'), cache.get('mtx')) == (b'1', None)
+
+    # A full tail page records the span it was computed from; older rows cannot change it.
+    bars = load_bars(market_db, timeframe='1H', limit=2)
+    lower, upper = bars.attrs['span']
+    assert lower == pd.Timestamp('2025-08-04 12:00', tz='Asia/Taipei')
+    assert upper is None
+
+def test_bars_to_columns_returns_parallel_arrays(market_db):
+    from kline_data import bars_to_columns
+
+    bars = load_bars(market_db, timeframe='1H', limit=2)
+    columns = bars_to_columns(bars)
+    assert list(columns) == ['time', 'open', 'high', 'low', 'close', 'value']
+    assert columns['time'] == [_epoch('2025-08-04 12:00'), _epoch('2025-08-04 13:00')]
+    assert columns['value'] == [600, 450]
+    assert all(len(values) == 2 for values in columns.values())
+
+def test_asof_close_prices_uses_latest_bar_at_or_before(market_db):
+    from kline_data import asof_close_prices
+
+    times = pd.Series(pd.DatetimeIndex([
+        '2025-08-04 08:45:00',  # exact bar
+        '2025-08-04 08:46:30',  # between bars -> 08:46 bar
+        '2025-08-02 12:00:00',  # weekend -> last Friday bar (13:44)
+        '2025-08-01 08:00:00',  # before any bar
+    ], tz='Asia/Taipei'))
+    prices = asof_close_prices(market_db, times)
+    assert list(prices[:3]) == [23001.0, 23002.0, 23300.0]
+    assert pd.isna(prices[3])
@@ -0,0 +1,100 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from market_context import (
+    update_market_indicators, trade_market_context, trade_symbols, regime_summary, INDICATORS_TABLE, WARMUP_BARS,
+)
+from import_kdata import create_market_data_table
+
+# --- Test Setup ---
+
+def _insert_bars(conn, start, periods, seed, symbol='TXF', scale=5):
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=periods, freq='1min', tz='Asia/Taipei')
+    close = 20000 + np.cumsum(rng.normal(0, scale, periods))
+    rows = [(symbol, int(ts.timestamp()), c, c + 3, c - 3, c, int(v))
+            for ts, c, v in zip(times, close, rng.integers(1, 500, periods))]
+    conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return times
+
+@pytest.fixture
+def market_db(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    yield conn
+    conn.close()
+
+def _stored(conn):
+    return pd.read_sql_query(f"SELECT * FROM {INDICATORS_TABLE} ORDER BY epoch", conn)
+
+# --- Test Cases ---
+
+def test_incremental_update_matches_full_recompute(market_db):
+    _insert_bars(market_db, '2025-08-04 15:00', WARMUP_BARS + 200, seed=1)
+    update_market_indicators(market_db)
+    later = _insert_bars(market_db, '2025-08-06 15:00', 300, seed=2)
+    written = update_market_indicators(market_db, first_epoch=int(later[0].timestamp()))
+    incremental = _stored(market_db)
+
+    assert written == 300
+    update_market_indicators(market_db)
+    full = _stored(market_db)
+    assert len(incremental) == len(full) == WARMUP_BARS + 500
+    pd.testing.assert_frame_equal(incremental, full)
+    # Values only exist once the window is full.
+    assert full['volume_percentile'].notna().sum() == len(full) - WARMUP_BARS + 1
+
+def test_trade_context_uses_last_completed_bar(market_db):
+    times = _insert_bars(market_db, '2025-08-04 08:45', 120, seed=3)
+    update_market_indicators(market_db)
+    stored = _stored(market_db).set_index('epoch')
+
+    trades = pd.DataFrame({
+        'trade_time': pd.to_datetime(['2025-08-04 09:50:30', '2025-08-04 08:45:10', '2025-08-20 10:00:00']),
+        'net_pnl': [100.0, -50.0, 30.0],
+    })
+    context = trade_market_context(market_db, trades['trade_time'])
+
+    # 09:50:30 sits in the 09:50 bar, so the context comes from the completed 09:49 bar.
+    completed = int(times[64].timestamp())
+    assert context.loc[0, 'atr'] == pytest.approx(stored.loc[completed, 'atr'])
+    assert context.loc[0, 'ma_distance'] == pytest.approx(stored.loc[completed, 'ma_distance'])
+    # No completed bar before the session's first minute, and none within the lag limit for the last trade.
+    assert np.isnan(context.loc[1, 'atr']) and np.isnan(context.loc[2, 'atr'])
+    assert context['session_phase'].tolist() == ['day_mid', 'day_open', 'day_mid']
+
+    summary = regime_summary(trades, context)
+    assert summary['trades_with_context'] == 1
+    assert summary['regimes']['session_phase']['day_mid']['trade_count'] == 2
+    assert sum(regime['trade_count'] for regime in summary['regimes']['trend'].values()) == 1
+
+def test_trades_join_their_own_products_indicators(market_db):
+    _insert_bars(market_db, '2025-08-04 08:45', 120, seed=4)
+    _insert_bars(market_db, '2025-08-04 08:45', 120, seed=5, symbol='MTX202509', scale=50)
+    for symbol in ('TXF', 'MTX202509'):
+        update_market_indicators(market_db, symbol)
+    stored = _stored(market_db).set_index(['symbol', 'epoch'])
+
+    times = pd.Series(pd.to_datetime(['2025-08-04 09:50:30'] * 4))
+    # The traded MTX contract has bars; TXF has no contract bars but root bars; the others have none.
+    products = pd.Series(['小型期09', '大型期09', '微型期09', '電子期09'])
+    symbols = trade_symbols(market_db, products, times)
+    assert symbols.tolist() == ['MTX202509', 'TXF', 'TXF', 'TXF']
+    # Bars stored only after the trades do not change the choice (TXF has no earlier bars either).
+    early = pd.Series(pd.to_datetime(['2025-08-04 08:30:00'] * 2))
+    assert trade_symbols(market_db, products[:2], early).tolist() == ['TXF', 'TXF']
+
+    context = trade_market_context(market_db, times, symbols)
+    completed = int(pd.Timestamp('2025-08-04 09:49', tz='Asia/Taipei').timestamp())
+    assert context.loc[0, 'atr'] == pytest.approx(stored.loc[('MTX202509', completed), 'atr'])
+    assert context.loc[1:, 'atr'].tolist() == pytest.approx([stored.loc[('TXF', completed), 'atr']] * 3)
+    assert context.loc[0, 'atr'] != pytest.approx(context.loc[1, 'atr'])
+    assert context['session_phase'].tolist() == ['day_mid'] * 4
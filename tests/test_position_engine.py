@@ -0,0 +1,72 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from position_engine import reconstruct_round_trips
+
+# --- Test Setup ---
+
+def _fills(rows):
+    """rows: (time, trade_type, position_type, quantity, price, fee, tax)"""
+    df = pd.DataFrame(rows, columns=['transaction_time', 'trade_type', 'position_type', 'quantity', 'price',
+                                     'commission_fee', 'transaction_tax'])
+    df.insert(0, 'id', range(1, len(df) + 1))
+    df['product_name'] = '小型期09'
+    df['order_id'] = [f"o{i}" for i in df['id']]
+    return df
+
+# --- Test Cases ---
+
+def test_fifo_splits_lots_across_partial_closes():
+    fills = _fills([
+        ('2025-08-01T09:00:00', '買進', '新倉', 2, 23000, 42, 48),
+        ('2025-08-01T09:05:00', '買進', '新倉', 1, 23010, 21, 24),
+        ('2025-08-01T09:10:00', '賣出', '平倉', 1, 23020, 21, 24),  # closes half of the first lot
+        ('2025-08-01T09:20:00', '賣出', '平倉', 2, 23030, 42, 48),  # rest of lot 1 and all of lot 2
+    ])
+    trips, open_lots = reconstruct_round_trips(fills)
+    assert open_lots.empty
+    assert list(trips['open_fill_id']) == [1, 1, 2]
+    assert list(trips['close_fill_id']) == [3, 4, 4]
+    assert list(trips['quantity']) == [1, 1, 1]
+    assert list(trips['points']) == [20.0, 30.0, 20.0]
+    assert list(trips['holding_seconds']) == [600, 1200, 900]
+    # Each fill's fee and tax are split per contract.
+    assert list(trips['fee']) == [42.0, 42.0, 42.0]
+    assert trips['tax'].sum() == 144.0
+
+def test_short_positions_and_open_lots_remaining():
+    fills = _fills([
+        ('2025-08-01T21:00:00', '賣出', '新倉', 3, 23000, 63, 72),
+        ('2025-08-02T01:00:00', '買進', '平倉', 2, 22950, 42, 48),
+        ('2025-08-02T02:00:00', '買進', '平倉', 5, 22900, 105, 120),  # only one lot left to close
+    ])
+    trips, open_lots = reconstruct_round_trips(fills)
+    assert list(trips['direction']) == ['short', 'short']
+    assert list(trips['quantity']) == [2, 1]
+    assert list(trips['points']) == [50.0, 100.0]
+    assert open_lots.empty
+
+    trips, open_lots = reconstruct_round_trips(fills.iloc[:2])
+    assert list(open_lots['quantity']) == [1]
+    assert open_lots['open_fill_id'].iloc[0] == 1
+
+def test_same_product_name_in_different_years_is_not_netted():
+    from position_engine import contract_keys
+
+    keys = contract_keys(pd.Series(['小型期09', '小型期09', '小型期09', '台指期']),
+                         pd.to_datetime(pd.Series(['2024-09-18', '2024-09-19', '2025-08-01', '2025-08-01'])))
+    # 2024-09-18 is the 2024 settlement day; the next day already trades the 2025 contract.
+    assert list(keys) == ['小型期09@2024', '小型期09@2025', '小型期09@2025', '台指期']
+
+    fills = _fills([
+        ('2024-09-10T09:00:00', '買進', '新倉', 1, 21000, 21, 24),  # settled at expiry, never closed
+        ('2025-08-01T09:00:00', '買進', '新倉', 1, 23000, 21, 24),
+        ('2025-08-01T10:00:00', '賣出', '平倉', 1, 23010, 21, 24),
+    ])
+    trips, open_lots = reconstruct_round_trips(fills)
+    assert list(trips['open_fill_id']) == [2]
+    assert list(open_lots['open_fill_id']) == [1]
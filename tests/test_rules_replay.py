@@ -0,0 +1,81 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rules_replay import replay_rules, monthly_replay_summary, total_replay_summary, daily_stop_tags, daily_stop_impact
+
+# --- Test Setup ---
+
+NIGHT_WINDOWS = [{"name": "Night Session Hedging 1", "start": "21:15:00", "end": "21:45:00"}]
+
+def _trades(rows):
+    trades = pd.DataFrame(rows, columns=['trade_time', 'net_pnl'])
+    trades['trade_time'] = pd.to_datetime(trades['trade_time'])
+    return trades
+
+# --- Test Cases ---
+
+def test_daily_stop_and_night_window():
+    # Rows are out of order on purpose; the replay follows trade time.
+    trades = _trades([
+        ('2025-08-01 10:00:00', -100),
+        ('2025-08-01 09:00:00', -100),
+        ('2025-08-01 21:30:00', -100),   # night window: skipped and not counted as a daily loss
+        ('2025-08-01 09:30:00', 300),
+        ('2025-08-01 11:00:00', -100),   # 3rd counted loss: still taken
+        ('2025-08-01 12:00:00', 500),    # after the 3rd loss: daily stop
+        ('2025-08-02 09:00:00', 200),    # new day
+    ])
+    replay = replay_rules(trades, 1_000_000, NIGHT_WINDOWS)
+
+    assert replay['skip_reason'].tolist() == ['', '', 'night_window', '', '', 'daily_stop', '']
+    assert replay['losses_before'].tolist() == [1, 0, 3, 1, 2, 3, 0]
+
+    total = total_replay_summary(trades, replay)
+    assert total['actual']['total_pnl'] == 600
+    assert total['rules_followed']['total_pnl'] == 200
+    assert total['pnl_difference'] == -400
+    assert total['skipped']['daily_stop'] == {"trade_count": 1, "pnl": 500.0}
+    assert total['skipped']['night_window'] == {"trade_count": 1, "pnl": -100.0}
+
+def test_capital_halt_per_month():
+    trades = _trades([
+        ('2025-07-01 09:00:00', -10_000),
+        ('2025-07-02 09:00:00', -6_000),   # reaches -15% of 100,000: counted, then halted
+        ('2025-07-03 09:00:00', 4_000),
+        ('2025-07-04 09:00:00', -1_000),
+        ('2025-08-01 09:00:00', 2_000),    # a new month trades again
+    ])
+    replay = replay_rules(trades, 100_000, NIGHT_WINDOWS)
+    assert replay['skip_reason'].tolist() == ['', '', 'capital_halt', 'capital_halt', '']
+
+    monthly = monthly_replay_summary(trades, replay)
+    assert list(monthly) == ['2025-07', '2025-08']
+    july = monthly['2025-07']
+    assert july['actual']['trade_count'] == 4
+    assert july['rules_followed'] == {"total_pnl": -16_000.0, "win_rate": "0.00%", "risk_reward_ratio": "0.0", "trade_count": 2}
+    assert july['skipped']['capital_halt'] == {"trade_count": 2, "pnl": 3_000.0}
+    assert monthly['2025-08']['rules_followed']['risk_reward_ratio'] == "Infinity"
+
+def test_daily_stop_tags_follow_trade_order():
+    trades = _trades([
+        ('2025-08-01 09:00:00', -100),
+        ('2025-08-01 09:10:00', 400),
+        ('2025-08-01 09:20:00', -100),
+        ('2025-08-01 09:30:00', -100),   # 3rd loss triggers the stop
+        ('2025-08-01 09:40:00', 250),    # after the stop, even though it wins
+        ('2025-08-01 09:50:00', -300),
+        ('2025-08-04 09:00:00', -100),
+    ]).iloc[::-1]
+    tags = daily_stop_tags(trades).loc[trades.index.sort_values()]
+    assert tags['daily_loss_rank'].tolist() == [1, 0, 2, 3, 0, 4, 1]
+    assert tags['after_daily_stop'].tolist() == [False, False, False, False, True, True, False]
+
+    impact = daily_stop_impact(trades, daily_stop_tags(trades))
+    assert impact['post_stop_trade_count'] == 2
+    assert impact['post_stop_pnl'] == -50.0
+    assert impact['days'] == [{"date": "2025-08-01", "trade_count": 2, "pnl": -50.0}]
+    assert [trade['trade_time'] for trade in impact['trades']] == ['2025-08-01 09:40:00', '2025-08-01 09:50:00']
@@ -0,0 +1,66 @@
+import os
+import sys
+import sqlite3
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from trade_cube import add_trades_to_cube, rebuild_trade_cube, rollup_cube, CUBE_TABLE
+
+# --- Test Setup ---
+
+TRADES = pd.DataFrame({
+    'trade_id': ['a', 'b', 'c', 'd', 'e'],
+    # Mon 09:xx twice, Mon 21:xx, Tue 09:xx (next month), Tue 09:xx
+    'trade_time': ['2025-07-28T09:05:00', '2025-07-28T09:40:00', '2025-07-28T21:10:00',
+                   '2025-08-05T09:15:00', '2025-08-05T09:30:00'],
+    'action': ['買進->賣出', '買進->賣出', '賣出->買進', '買進->賣出', '賣出->買進'],
+    'net_pnl': [300.0, -100.0, -50.0, 200.0, -200.0],
+    'product_name': ['小型期08', '小型期08', '小型期08', '小型期08 ', '微型台指期08'],
+})
+
+@pytest.fixture
+def trades_db(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'trades.db')
+    conn.execute("CREATE TABLE trades (trade_id TEXT PRIMARY KEY, trade_time DATETIME, action TEXT, net_pnl REAL, "
+                 "product_name TEXT)")
+    yield conn
+    conn.close()
+
+# --- Test Cases ---
+
+def test_incremental_adds_match_rebuild(trades_db):
+    for batch in (TRADES.iloc[:2], TRADES.iloc[2:]):
+        batch.to_sql('trades', trades_db, if_exists='append', index=False)
+        add_trades_to_cube(trades_db, batch)
+    incremental = pd.read_sql_query(f"SELECT * FROM {CUBE_TABLE} ORDER BY hour, weekday, month, product, action", trades_db)
+
+    rebuild_trade_cube(trades_db)
+    rebuilt = pd.read_sql_query(f"SELECT * FROM {CUBE_TABLE} ORDER BY hour, weekday, month, product, action", trades_db)
+    pd.testing.assert_frame_equal(incremental, rebuilt)
+    # Both Monday 09:xx trades share a cell; the product name is stripped.
+    assert len(rebuilt) == 4
+    assert rebuilt['trade_count'].sum() == 5
+
+def test_rollup_any_subset_of_dimensions(trades_db):
+    add_trades_to_cube(trades_db, TRADES)
+
+    total = rollup_cube(trades_db, [])
+    assert total.loc[0, 'trade_count'] == 5
+    assert total.loc[0, 'total_pnl'] == 150.0
+    assert total.loc[0, 'win_rate'] == 0.4
+    # Average win 250 / average loss 350/3
+    assert total.loc[0, 'risk_reward_ratio'] == pytest.approx(2.14)
+
+    heatmap = rollup_cube(trades_db, ['weekday', 'hour'])
+    assert heatmap[['weekday', 'hour', 'trade_count']].values.tolist() == [[0, 9, 2], [0, 21, 1], [1, 9, 2]]
+
+    longs = rollup_cube(trades_db, ['month'], {'action': '買進->賣出', 'product': '小型期08'})
+    assert longs['month'].tolist() == ['2025-07', '2025-08']
+    assert longs['total_pnl'].tolist() == [200.0, 200.0]
+    assert pd.isna(rollup_cube(trades_db, ['month'], {'month': '2025-08', 'action': '買進->賣出'}).loc[0, 'risk_reward_ratio'])
+
+    with pytest.raises(ValueError):
+        rollup_cube(trades_db, ['trade_id'])
@@ -0,0 +1,35 @@
+import sqlite3
+
+import pandas as pd
+
+# --- Test Setup ---
+
+TRADES_CSV = """成交時間,買賣別,商品名稱,口數,新倉價,平倉價,手續費,期交稅,平倉損益淨額
+2025/08/01 09:00:30,買進->賣出,小型期08,1,"13,000","13,010",42,48,"1,910"
+2025/08/01 09:00:30,買進->賣出,大型期08,1,"23,000","23,010",42,48,"1,910"
+"""
+
+def add_bars(db_file, symbol, close):
+    index = pd.date_range('2025-08-01 08:45', periods=30, freq='1min', tz='Asia/Taipei')
+    conn = sqlite3.connect(db_file)
+    try:
+        conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         [(symbol, int(ts.timestamp()), close, close, close, close, 1) for ts in index])
+        conn.commit()
+    finally:
+        conn.close()
+
+# --- Test Cases ---
+
+def test_markers_use_each_trades_product_or_the_charted_symbol(server_env):
+    add_bars(server_env.db_file, 'TXF', 23000.0)
+    add_bars(server_env.db_file, 'MTX', 13000.0)
+    (server_env.path / 'tradedata' / 'trades.csv').write_text(TRADES_CSV, encoding='utf-8')
+    server_env.client.post('/api/import_trades', json={'filename': 'trades.csv'})
+    window = {'start_time': int(pd.Timestamp('2025-08-01 08:45', tz='Asia/Taipei').timestamp()),
+              'end_time': int(pd.Timestamp('2025-08-01 13:45', tz='Asia/Taipei').timestamp())}
+
+    trades = server_env.client.get("/api/trade_data", params=window).json()
+    assert {t['product_name']: t['marker_price'] for t in trades} == {'小型期08': 13000.0, '大型期08': 23000.0}
+    charted = server_env.client.get('/api/trade_data', params={**window, 'symbol': 'mtx'}).json()
+    assert [t['marker_price'] for t in charted] == [13000.0, 13000.0]
@@ -0,0 +1,132 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from trade_matching import match_open_times, update_merged_trades
+from db_migrations import apply_migrations
+
+# --- Test Setup ---
+
+def _legacy_match(trades_df, transactions_df):
+    """The original per-trade scan from merge_trade_data, kept as the reference behaviour."""
+    opening = transactions_df[transactions_df['position_type'] == '新倉'].copy()
+    open_times = []
+    for _, pnl_record in trades_df.iterrows():
+        candidates = opening[
+            (opening['product_name'].str.contains(pnl_record['product_name'], na=False)) &
+            (opening['price'] == pnl_record['open_price']) &
+            (opening['transaction_time'] < pnl_record['trade_time'])
+        ].copy()
+        if not candidates.empty:
+            candidates['time_diff'] = pnl_record['trade_time'] - candidates['transaction_time']
+            open_times.append(candidates.loc[candidates['time_diff'].idxmin()]['transaction_time'])
+        else:
+            open_times.append(None)
+    return pd.Series(pd.to_datetime(open_times), index=trades_df.index).astype('datetime64[ns]')
+
+def _random_book(seed, quantity):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2025-08-01 08:45')
+    fills = pd.DataFrame({
+        # Whole minutes so that several fills share a timestamp.
+        'transaction_time': start + pd.to_timedelta(rng.integers(0, 3000, 400), unit='min'),
+        'product_name': rng.choice(['小型期09', '小型期10', '微型期09'], 400),
+        'price': rng.integers(23000, 23010, 400).astype(float),
+        'position_type': rng.choice(['新倉', '平倉'], 400),
+        'quantity': quantity,
+    })
+    trades = pd.DataFrame({
+        'trade_time': start + pd.to_timedelta(rng.integers(0, 3600, 300), unit='min'),
+        'product_name': rng.choice(['小型期09', '小型期10', '型期09'], 300),
+        'open_price': rng.integers(23000, 23012, 300).astype(float),
+        'contracts': 1,
+    })
+    return trades, fills
+
+def _trade_db(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'trade_notes.db')
+    conn.executescript('''
+        CREATE TABLE trades (
+            trade_id TEXT PRIMARY KEY, trade_time DATETIME, action TEXT, net_pnl REAL, contracts INTEGER,
+            product_name TEXT, source_file TEXT, open_price REAL, close_price REAL, fee REAL, tax REAL
+        );
+        CREATE TABLE TransactionData (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_time DATETIME NOT NULL, trade_type VARCHAR(4) NOT NULL,
+            product_name VARCHAR(20) NOT NULL, quantity INT NOT NULL, price DECIMAL(10, 2) NOT NULL,
+            commission_fee INT, transaction_tax INT, net_amount DECIMAL(12, 2), order_id VARCHAR(10) UNIQUE,
+            position_type VARCHAR(4)
+        );
+    ''')
+    apply_migrations(conn)
+    return conn
+
+def _add_trade(conn, trade_id, close_time, open_price):
+    conn.execute("INSERT INTO trades (trade_id, trade_time, action, net_pnl, contracts, product_name, source_file, "
+                 "open_price, close_price, fee, tax) VALUES (?, ?, '買進->賣出', 100, 1, '小型期09', 'a.csv', ?, ?, 42, 48)",
+                 (trade_id, close_time, open_price, open_price + 5))
+
+def _add_fill(conn, order_id, time, price):
+    conn.execute("INSERT INTO TransactionData (transaction_time, trade_type, product_name, quantity, price, order_id, position_type) "
+                 "VALUES (?, '買進', '小型期09', 1, ?, ?, '新倉')", (time, price, order_id))
+
+# --- Test Cases ---
+
+def test_matches_legacy_scan_when_fills_have_capacity():
+    for seed in range(3):
+        trades, fills = _random_book(seed, quantity=1000)
+        open_times, match_count = match_open_times(trades, fills)
+        expected = _legacy_match(trades, fills)
+        pd.testing.assert_series_equal(open_times, expected, check_names=False, check_dtype=False)
+        assert match_count == expected.notna().sum()
+
+def test_opening_fill_is_not_reused_beyond_its_quantity():
+    fills = pd.DataFrame({
+        'transaction_time': pd.to_datetime(['2025-08-01 09:00', '2025-08-01 09:05']),
+        'product_name': ['小型期09', '小型期09'],
+        'price': [23000.0, 23000.0],
+        'position_type': ['新倉', '新倉'],
+        'quantity': [1, 1],
+    })
+    trades = pd.DataFrame({
+        'trade_time': pd.to_datetime(['2025-08-01 09:20', '2025-08-01 09:10', '2025-08-01 09:30']),
+        'product_name': ['小型期09'] * 3,
+        'open_price': [23000.0] * 3,
+        'contracts': [1, 1, 1],
+    })
+    open_times, match_count = match_open_times(trades, fills)
+    # The 09:10 close takes the 09:05 fill; the 09:20 close falls back to 09:00; nothing is left for 09:30.
+    assert list(open_times.dt.strftime('%H:%M').fillna('N/A')) == ['09:00', '09:05', 'N/A']
+    assert match_count == 2
+
+def test_incremental_merge_matches_new_data_and_retries_unmatched(tmp_path):
+    conn = _trade_db(tmp_path)
+    _add_fill(conn, 'o1', '2025-08-01T09:00:00', 23000)
+    _add_trade(conn, 't1', '2025-08-01T09:30:00', 23000)
+    _add_trade(conn, 't2', '2025-08-01T10:30:00', 23100)  # its fill is imported later
+    conn.commit()
+    assert update_merged_trades(conn)['matched'] == 1
+
+    # Day two: one new trade and the missing fill for t2.
+    _add_fill(conn, 'o2', '2025-08-01T10:00:00', 23100)
+    _add_fill(conn, 'o3', '2025-08-02T09:00:00', 23000)
+    _add_trade(conn, 't3', '2025-08-02T09:10:00', 23000)
+    conn.commit()
+    summary = update_merged_trades(conn)
+    assert (summary['new_trades'], summary['retried'], summary['matched']) == (1, 1, 2)
+
+    incremental = dict(conn.execute("SELECT trade_id, open_trade_time FROM trades_merged"))
+    update_merged_trades(conn, full=True)
+    assert incremental == dict(conn.execute("SELECT trade_id, open_trade_time FROM trades_merged"))
+    assert incremental == {'t1': '2025-08-01 09:00:00', 't2': '2025-08-01 10:00:00', 't3': '2025-08-02 09:00:00'}
+
+    # A fill consumed by an earlier merge is not handed out again.
+    _add_trade(conn, 't4', '2025-08-01T09:45:00', 23000)
+    conn.commit()
+    update_merged_trades(conn)
+    assert conn.execute("SELECT open_trade_time FROM trades_merged WHERE trade_id = 't4'").fetchone()[0] == 'N/A'
+    conn.close()
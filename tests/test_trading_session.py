@@ -0,0 +1,90 @@
+import os
+import sys
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from trading_session import assign_sessions, build_session_bars, session_bucket_bounds
+from kline_data import load_bars, refresh_aggregate_tables, aggregate_table_name
+from import_kdata import create_market_data_table
+
+# --- Test Setup ---
+
+def _minute_bars(start, periods):
+    index = pd.date_range(start, periods=periods, freq='1min', tz='Asia/Taipei', name='datetime')
+    prices = np.arange(periods, dtype=float)
+    return pd.DataFrame({'open': prices, 'high': prices + 1, 'low': prices - 1, 'close': prices, 'volume': 1}, index=index)
+
+def _friday_night_and_monday_day():
+    # Friday night session 15:00 -> Saturday 05:00, then Monday day session 08:45 -> 13:45.
+    return pd.concat([_minute_bars('2025-08-01 15:00', 840), _minute_bars('2025-08-04 08:45', 300)])
+
+# --- Test Cases ---
+
+def test_night_session_belongs_to_next_trading_day():
+    sessions = assign_sessions(pd.DatetimeIndex(['2025-08-01 10:00', '2025-08-01 16:00', '2025-08-02 03:00'], tz='Asia/Taipei'))
+    assert list(sessions['session']) == ['day', 'night', 'night']
+    # Friday's night session (including Saturday early morning) trades for Monday.
+    assert list(sessions['trading_date'].dt.strftime('%Y-%m-%d')) == ['2025-08-01', '2025-08-04', '2025-08-04']
+    assert sessions['session_open'].iloc[2] == pd.Timestamp('2025-08-01 15:00', tz='Asia/Taipei')
+
+def test_daily_bars_combine_night_and_following_day_session():
+    bars = build_session_bars(_friday_night_and_monday_day(), '1D')
+    assert list(bars.index.strftime('%Y-%m-%d')) == ['2025-08-04']
+    assert bars['volume'].iloc[0] == 1140
+    assert bars['open'].iloc[0] == 0.0
+
+def test_intraday_buckets_are_offsets_from_session_open():
+    bars = build_session_bars(_minute_bars('2025-08-04 08:45', 300), '1h')
+    assert list(bars.index.strftime('%H:%M')) == ['08:45', '09:45', '10:45', '11:45', '12:45']
+    assert (bars['volume'] == 60).all()
+    assert bars['high'].iloc[0] == 60.0
+    assert bars['close'].iloc[-1] == 299.0
+
+def test_bucket_bounds_cover_whole_trading_day():
+    lower, upper = session_bucket_bounds(pd.Timestamp('2025-08-04 10:00', tz='Asia/Taipei'), '1D')
+    assert lower == pd.Timestamp('2025-08-01 15:00', tz='Asia/Taipei')
+    assert upper == pd.Timestamp('2025-08-04 15:00', tz='Asia/Taipei')
+
+def test_session_aligned_tables_match_on_the_fly_build(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    raw = _friday_night_and_monday_day()
+    conn.executemany(
+        "INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [('TXF', int(ts.timestamp()), r.open, r.high, r.low, r.close, r.volume) for ts, r in raw.iterrows()],
+    )
+
+    on_the_fly = load_bars(conn, timeframe='1H', limit=100, align='session')
+    refresh_aggregate_tables(conn, raw.index[0], raw.index[-1], ['1H'])
+    assert conn.execute(f"SELECT COUNT(*) FROM {aggregate_table_name('1H', 'session')}").fetchone()[0] == len(on_the_fly)
+
+    from_table = load_bars(conn, timeframe='1H', limit=100, align='session')
+    pd.testing.assert_frame_equal(from_table, on_the_fly, check_dtype=False, check_freq=False, check_index_type=False)
+    conn.close()
+
+def test_weekend_bars_roll_to_next_trading_day():
+    sessions = assign_sessions(pd.DatetimeIndex(['2025-08-02 09:00', '2025-08-02 16:00', '2025-08-04 09:00'], tz='Asia/Taipei'))
+    assert list(sessions['trading_date'].dt.strftime('%Y-%m-%d')) == ['2025-08-04', '2025-08-04', '2025-08-04']
+
+def test_session_bars_follow_the_symbols_calendar(tmp_path, monkeypatch):
+    from trading_session import SESSION_CALENDARS
+    monkeypatch.setitem(SESSION_CALENDARS, 'XYZ', {
+        'sessions': [{'name': 'day', 'open': '09:00', 'close': '13:30', 'next_trading_day': False}],
+    })
+    conn = sqlite3.connect(tmp_path / 'market.db')
+    create_market_data_table(conn)
+    raw = _minute_bars('2025-08-04 09:00', 120)
+    for symbol in ('TXF', 'XYZ'):
+        conn.executemany("INSERT INTO market_data VALUES (?, ?, ?, ?, ?, ?, ?)", [
+            (symbol, int(ts.timestamp()), *row) for ts, row in zip(raw.index, raw.itertuples(index=False, name=None))])
+    conn.commit()
+
+    txf = load_bars(conn, timeframe='1h', align='session', limit=10, symbol='TXF')
+    xyz = load_bars(conn, timeframe='1h', align='session', limit=10, symbol='XYZ')
+    assert list(txf.index.strftime('%H:%M')) == ['08:45', '09:45', '10:45']
+    assert list(xyz.index.strftime('%H:%M')) == ['09:00', '10:00']
+    conn.close()
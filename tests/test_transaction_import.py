@@ -0,0 +1,25 @@
+import sqlite3
+
+# --- Test Setup ---
+
+TRANSACTION_CSV = """成交時間,買賣別,商品名稱,成交口數,成交價,手續費,交易稅,成交收付,委託書號,倉別
+2025/08/18 9:09:47,賣出,小型期09,1,"23,390",21,16,0,s02dB,新倉
+2025/08/18 9:12:16,買進,小型期09,1,"23,412",21,16,"-1,100",s02ov,平倉
+2025/08/18 9:12:16,買進,小型期09,1,"23,412",21,16,"-1,100",s02ov,平倉
+"""
+
+# --- Test Cases ---
+
+def test_transaction_csv_rows_are_committed(server_env):
+    (server_env.path / 'TransactionData' / 'fills.csv').write_text(TRANSACTION_CSV, encoding='utf-8')
+
+    response = server_env.client.post('/api/import_transaction_csv', json={'filename': 'fills.csv'})
+    assert response.status_code == 200
+    assert (response.json()['new'], response.json()['skipped']) == (2, 1)
+
+    conn = sqlite3.connect(server_env.db_file)
+    try:
+        rows = conn.execute("SELECT order_id, price, net_amount, position_type FROM TransactionData ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    assert rows == [('s02dB', 23390, 0, '新倉'), ('s02ov', 23412, -1100, '平倉')]
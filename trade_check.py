@@ -12,9 +12,17 @@ import argparse
 import sys
 import hashlib
 import sqlite3
+import multiprocessing
 
 import shutil
 
+from rules_replay import (DAILY_STOP_MAX_LOSSES, CAPITAL_CIRCUIT_BREAKER_RATIO, replay_rules,
+                          monthly_replay_summary, total_replay_summary, daily_stop_tags, daily_stop_impact)
+from market_context import INDICATOR_COLUMNS, trade_symbols, trade_market_context, regime_summary
+from accounts import DEFAULT_ACCOUNT, read_config, load_account_config
+from dna_sweep import sweep_thresholds, dna_threshold_sweep
+from capital_path import HAPPINESS_INCENTIVE_RATE, kpi_criteria, monthly_path_inputs, capital_path, capital_path_summary
+
 # --- Logging Setup ---
 def archive_old_logs():
     """Archives log files older than today into the LOG/ directory."""
@@ -63,7 +71,10 @@ def archive_old_logs():
             archiver_logger.error(f"An unexpected error occurred while archiving {file_path}: {e}")
 
 # --- Run Archiving and Set Up Main Logger ---
-archive_old_logs()
+# Spawned worker processes (e.g. K-line parse workers started from server.py) re-import the main
+# module; only the parent process archives.
+if multiprocessing.parent_process() is None:
+    archive_old_logs()
 
 # Configure main logger to write to a date-stamped file and the console
 today_str = datetime.now().strftime('%Y-%m-%d')
@@ -107,6 +118,9 @@ TRADING_DNA_RULES = {
     "MONTHLY_POINT_TARGET": 30,
 }
 
+# 2.1 Trading DNA threshold sweep: noise-zone thresholds (points) from MIN to MAX in STEP increments
+DNA_SWEEP_RANGE = {"MIN": 5, "MAX": 200, "STEP": 5}
+
 # 2.4 SOP Risk Stress Test Rules
 SOP_RISK_STRESS_TEST = {
     "MAX_EXPOSURE_POINTS": 1500,
@@ -158,17 +172,23 @@ class TradeAuditor:
     """
     Automated audit system for D-Pro Protocol V7.3.
     """
-    def __init__(self, monthly_start_capital: float, current_scale: str, operation_contracts: int):
-        logger.info(f"Initializing TradeAuditor for scale {current_scale} with monthly start capital {monthly_start_capital}.")
+    def __init__(self, monthly_start_capital: float, current_scale: str, operation_contracts: int,
+                 account_id: str = DEFAULT_ACCOUNT, start_scale: str = None):
+        logger.info(f"Initializing TradeAuditor for account '{account_id}', scale {current_scale} with monthly start capital {monthly_start_capital}.")
         if current_scale not in UPGRADE_CRITERIA:
             log_msg = f"Invalid scale '{current_scale}'. Must be one of {list(UPGRADE_CRITERIA.keys())}"
             logger.error(log_msg)
             raise ValueError(log_msg)
+        # The capital path starts the first month of history at this scale (default: the current one).
+        self.start_scale = start_scale or current_scale
+        kpi_criteria(UPGRADE_CRITERIA, self.start_scale)
             
         self.current_capital = monthly_start_capital  # Initialize with start capital, will be updated in run_audit
         self.monthly_start_capital = monthly_start_capital
         self.current_scale = current_scale
         self.operation_contracts = operation_contracts
+        # Trades are loaded from, and trade IDs scoped to, this account.
+        self.account_id = account_id
         self.report_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     def load_transactions_from_csv(self, file_path: str) -> pd.DataFrame:
@@ -211,15 +231,15 @@ class TradeAuditor:
             raise
 
     def load_transactions_from_db(self, source_file: str) -> pd.DataFrame:
-        """Loads transaction data from the SQLite database for a specific source file."""
-        logger.info(f"Loading transactions from database for source_file: {source_file}")
+        """Loads the auditor's account's transaction data from the SQLite database for a specific source file."""
+        logger.info(f"Loading transactions from database for account '{self.account_id}', source_file: {source_file}")
         try:
             conn = sqlite3.connect(DB_FILE)
             # Read data into a pandas DataFrame
             df = pd.read_sql_query(
-                "SELECT * FROM trades WHERE source_file = ?", 
+                "SELECT * FROM trades WHERE account_id = ? AND source_file = ?", 
                 conn, 
-                params=(source_file,)
+                params=(self.account_id, source_file)
             )
             conn.close()
 
@@ -266,7 +286,7 @@ class TradeAuditor:
         return trades
 
     def _generate_trade_ids(self, trades: pd.DataFrame) -> pd.DataFrame:
-        """Generates a unique ID for each trade."""
+        """Generates a unique ID for each trade. IDs of accounts other than the default one include the account."""
         if trades.empty:
             return trades
 
@@ -281,6 +301,9 @@ class TradeAuditor:
             
             # Combine the elements into a single string
             unique_string = f"{trade_time_str}-{product_name_str}-{net_pnl_str}-{contracts_str}"
+            if self.account_id != DEFAULT_ACCOUNT:
+                # Identical fills in two accounts are different trades (and keep separate notes).
+                unique_string = f"{self.account_id}-{unique_string}"
             
             # Create a SHA256 hash
             return hashlib.sha256(unique_string.encode()).hexdigest()
@@ -377,6 +400,31 @@ class TradeAuditor:
             }
         }
 
+    def run_dna_sweep(self, source_file: str, min_threshold: float = DNA_SWEEP_RANGE['MIN'],
+                      max_threshold: float = DNA_SWEEP_RANGE['MAX'], step: float = DNA_SWEEP_RANGE['STEP']) -> Dict[str, Any]:
+        """Runs the Trading DNA diagnosis for every noise threshold in [min_threshold, max_threshold] and returns the curve."""
+        logger.info(f"--- Starting DNA threshold sweep for source_file: {source_file} ({min_threshold}-{max_threshold}, step {step}) ---")
+        thresholds = sweep_thresholds(min_threshold, max_threshold, step)
+        trades = self.load_transactions_from_db(source_file)
+        if trades.empty:
+            return {
+                "report_date": self.report_date,
+                "error": f"No trade data found in the database for the file '{source_file}'. Please import the file first."
+            }
+        trades = self._add_trade_points_column(trades)
+        if trades['points'].isnull().all():
+            logger.warning("'points' column all null. Skipping DNA threshold sweep.")
+            curve = []
+        else:
+            curve = dna_threshold_sweep(trades['points'], trades['net_pnl'], thresholds, TRADING_DNA_RULES)
+        return {
+            "report_date": self.report_date,
+            "source_file": source_file,
+            "current_threshold": TRADING_DNA_RULES['NOISE_ZONE_THRESHOLD'],
+            "total_trades": int(len(trades)),
+            "curve": curve,
+        }
+
     def _run_sop_risk_stress_test(self, trades: pd.DataFrame) -> Dict[str, Any]:
         """Runs the SOP Risk Stress Test based on D-Pro V2.99."""
         logger.info("Running SOP Risk Stress Test.")
@@ -416,16 +464,22 @@ class TradeAuditor:
         }
 
 
-    def _check_safety_valves(self, trades: pd.DataFrame) -> Dict[str, Any]:
-        """4.1.B & 2.2.3: Checks for daily stop, monthly capital, and strategy circuit breakers."""
+    def _check_safety_valves(self, trades: pd.DataFrame, stop_tags: pd.DataFrame = None) -> Dict[str, Any]:
+        """
+        4.1.B & 2.2.3: Checks for daily stop, monthly capital, and strategy circuit breakers.
+        `stop_tags` are the daily_stop_tags of `trades` when the caller already has them.
+        """
         logger.info("Checking safety valves: Daily Stop, Monthly Capital, and Strategy Circuit Breaker.")
         
-        # Daily Stop (Intraday Risk Control)
-        daily_loss_counts = trades[trades['net_pnl'] < 0].groupby(trades['trade_time'].dt.date).size()
-        daily_stop_violation_days = int((daily_loss_counts > 3).sum())
+        # Daily Stop (Intraday Risk Control): any trade after the day's 3rd loss is a violation.
+        if stop_tags is None:
+            stop_tags = daily_stop_tags(trades)
+        after_stop = stop_tags['after_daily_stop']
+        post_stop_pnl = float(trades.loc[after_stop, 'net_pnl'].sum())
+        daily_stop_violation_days = int(trades.loc[after_stop, 'trade_time'].dt.date.nunique())
         daily_stop_triggered = daily_stop_violation_days > 0
         if daily_stop_triggered:
-            logger.warning(f"Daily Stop violation detected on {daily_stop_violation_days} day(s).")
+            logger.warning(f"Daily Stop violation detected on {daily_stop_violation_days} day(s): {int(after_stop.sum())} trade(s) after the stop, PnL {post_stop_pnl:,.2f}.")
 
         # Strategy Circuit Breaker (Monthly)
         strategy_circuit_breaker_triggered = daily_stop_violation_days > STRATEGY_CIRCUIT_BREAKER_THRESHOLD
@@ -434,13 +488,15 @@ class TradeAuditor:
 
         # Capital Circuit Breaker (Monthly)
         monthly_pnl = trades['net_pnl'].sum()
-        monthly_loss_threshold = - (self.monthly_start_capital * 0.15)
+        monthly_loss_threshold = - (self.monthly_start_capital * CAPITAL_CIRCUIT_BREAKER_RATIO)
         capital_circuit_breaker = "BREACHED" if monthly_pnl <= monthly_loss_threshold else "SAFE"
         if capital_circuit_breaker == "BREACHED":
             logger.warning(f"Monthly Capital Circuit Breaker breached. PnL {monthly_pnl:,.2f} <= Threshold {monthly_loss_threshold:,.2f}")
         
         return {
             "daily_stop_violated_days": daily_stop_violation_days,
+            "post_stop_trade_count": int(after_stop.sum()),
+            "post_stop_pnl": post_stop_pnl,
             "strategy_circuit_breaker_triggered": bool(strategy_circuit_breaker_triggered),
             "capital_circuit_breaker_status": capital_circuit_breaker,
         }
@@ -465,14 +521,20 @@ class TradeAuditor:
                     logger.warning(f"Night session violation found: {violation_details}")
         return violations
 
-    def _evaluate_capital_management(self, win_rate: float, risk_reward_ratio: Any, trade_month: int) -> Dict[str, Any]:
-        """2.3: Evaluates upgrade eligibility, including quarterly cost deduction."""
-        logger.info(f"Evaluating capital management for scale {self.current_scale}.")
-        criteria = UPGRADE_CRITERIA.get(self.current_scale, {})
+    def _evaluate_capital_management(self, win_rate: float, risk_reward_ratio: Any, trade_month: int,
+                                     capital: float = None, scale: str = None) -> Dict[str, Any]:
+        """
+        2.3: Evaluates upgrade eligibility, including quarterly cost deduction.
+        `capital` and `scale` default to the current ones; historical months pass their point on the capital path.
+        """
+        capital = self.current_capital if capital is None else capital
+        scale = scale or self.current_scale
+        logger.info(f"Evaluating capital management for scale {scale}.")
+        criteria = UPGRADE_CRITERIA.get(scale, {})
         upgrade_eligible = False
         reason = "沒有可用的升級路徑 (No further upgrade path from this scale)."
         
-        adjusted_capital = self.current_capital
+        adjusted_capital = capital
         cost_deducted = 0
 
         # 2.3.1 Quarterly Cost Deduction ('中哥費')
@@ -515,25 +577,26 @@ class TradeAuditor:
             "current_criteria": criteria if criteria else None,
             "capital_adjustment": {
                 "quarterly_cost_deducted": cost_deducted,
-                "capital_before_adjustment": self.current_capital,
+                "capital_before_adjustment": capital,
                 "capital_after_adjustment": adjusted_capital
             }
         }
 
-    def _calculate_happiness_incentive(self, monthly_pnl: float, win_rate: float, risk_reward_ratio: Any) -> Dict[str, Any]:
-        """2.3.2: Calculates the Happiness Incentive based on monthly performance."""
+    def _calculate_happiness_incentive(self, monthly_pnl: float, win_rate: float, risk_reward_ratio: Any,
+                                       scale: str = None) -> Dict[str, Any]:
+        """2.3.2: Calculates the Happiness Incentive based on monthly performance at `scale` (default: current)."""
         logger.info("Calculating Happiness Incentive.")
         
-        # Happiness Incentive
-        kpi_criteria = UPGRADE_CRITERIA[self.current_scale]
+        # Happiness Incentive; the top scale keeps the KPIs of the scale that leads to it.
+        criteria = kpi_criteria(UPGRADE_CRITERIA, scale or self.current_scale)
         
         # KPI check, handling 'Infinity' RR
-        rr_ok = (risk_reward_ratio == "Infinity") or (risk_reward_ratio >= kpi_criteria['rr_key'])
-        wr_ok = win_rate >= kpi_criteria['wr_key']
+        rr_ok = (risk_reward_ratio == "Infinity") or (risk_reward_ratio >= criteria['rr_key'])
+        wr_ok = win_rate >= criteria['wr_key']
         kpi_met = rr_ok and wr_ok
 
         if monthly_pnl > 0 and kpi_met:
-            incentive_amount = monthly_pnl * 0.10
+            incentive_amount = monthly_pnl * HAPPINESS_INCENTIVE_RATE
             result = {
                 "eligible": True,
                 "amount": int(round(incentive_amount)),
@@ -569,9 +632,13 @@ class TradeAuditor:
         logger.info(f"Generated annual summaries for {len(annual_summaries)} years.")
         return annual_summaries
 
-    def calculate_monthly_summary(self, trades: pd.DataFrame) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+    def calculate_monthly_summary(self, trades: pd.DataFrame, rules_replay: Dict[str, Dict[str, Any]] = None,
+                                  path: pd.DataFrame = None) -> Tuple[List[Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
         """
         Groups all trades by month and calculates summary statistics and detailed trades.
+        When `rules_replay` (from monthly_replay_summary) is given, each month also shows its rules-followed figures.
+        When `path` (from capital_path) is given, each month is evaluated with the capital and scale it actually had on
+        that path instead of the current ones.
         Returns a tuple of (summary_list, monthly_trades_dict).
         """
         if trades.empty:
@@ -579,8 +646,13 @@ class TradeAuditor:
         
         logger.info("Calculating historical monthly summary and trade details.")
         trades['trade_time'] = pd.to_datetime(trades['trade_time'])
+        # Days never span months, so the tags of the whole history (from run_audit when present) slice per month.
+        if 'after_daily_stop' in trades.columns:
+            stop_tags = trades[['daily_loss_rank', 'after_daily_stop']]
+        else:
+            stop_tags = daily_stop_tags(trades)
 
-        monthly_groups = trades.groupby(pd.Grouper(key='trade_time', freq='M'))
+        monthly_groups = trades.groupby(pd.Grouper(key='trade_time', freq='ME'))
         
         summary_list = []
         monthly_trades_dict = {}
@@ -594,10 +666,15 @@ class TradeAuditor:
             
             # --- Monthly Calculations & Evaluations ---
             win_rate, rr, pnl = self._calculate_kpis(group)
-            risk_check = self._check_safety_valves(group)
-            # Note: Historical evaluations use the *current* capital context, which might not be accurate for past months.
-            evaluation = self._evaluate_capital_management(win_rate, rr, trade_month)
-            incentive = self._calculate_happiness_incentive(pnl, win_rate, rr)
+            risk_check = self._check_safety_valves(group, stop_tags.loc[group.index])
+            if path is not None and month_str in path.index:
+                point = path.loc[month_str]
+                evaluation = self._evaluate_capital_management(win_rate, rr, trade_month, float(point['capital_after_pnl']), point['scale'])
+                incentive = self._calculate_happiness_incentive(pnl, win_rate, rr, point['scale'])
+            else:
+                # Without a capital path, past months are evaluated against the current capital and scale.
+                evaluation = self._evaluate_capital_management(win_rate, rr, trade_month)
+                incentive = self._calculate_happiness_incentive(pnl, win_rate, rr)
             
             summary = {
                 "month": month_str,
@@ -609,6 +686,8 @@ class TradeAuditor:
                 "capital_assessment": evaluation,
                 "happiness_incentive": incentive,
             }
+            if rules_replay is not None and month_str in rules_replay:
+                summary["rules_replay"] = rules_replay[month_str]
             summary_list.append(summary)
             
             # Prepare detailed trades for this month, ensuring JSON compliance
@@ -662,8 +741,26 @@ class TradeAuditor:
             self.current_capital = self.monthly_start_capital + total_pnl
             logger.info(f"Capital updated. Start: {self.monthly_start_capital:,.0f}, PnL: {total_pnl:,.0f}, Current: {self.current_capital:,.0f}")
 
-            risk_audit = self._check_safety_valves(trades)
+            # Tag each trade taken after its day's stop once; the safety valves, the monthly summary
+            # and detailed_trades all use these flags.
+            stop_tags = daily_stop_tags(trades)
+            risk_audit = self._check_safety_valves(trades, stop_tags)
             risk_audit['night_session_violations'] = self._check_night_session(trades)
+
+            trades['daily_loss_rank'] = stop_tags['daily_loss_rank']
+            trades['after_daily_stop'] = stop_tags['after_daily_stop']
+            risk_audit['daily_stop_trades'] = daily_stop_impact(trades, stop_tags)
+
+            # --- Market Context (precomputed bar indicators joined as-of to each trade) ---
+            conn = sqlite3.connect(DB_FILE)
+            try:
+                symbols = trade_symbols(conn, trades['product_name'], trades['trade_time'])
+                context = trade_market_context(conn, trades['trade_time'], symbols)
+            finally:
+                conn.close()
+            for column in INDICATOR_COLUMNS:
+                trades[column] = context[column].to_numpy()
+            market_context = regime_summary(trades, context)
             
             dna_diagnosis = self._run_trading_dna_diagnosis(trades)
             stress_test = self._run_sop_risk_stress_test(trades)
@@ -671,8 +768,25 @@ class TradeAuditor:
             capital_assessment = self._evaluate_capital_management(win_rate, risk_reward_ratio, latest_trade_month)
             capital_assessment['happiness_incentive'] = self._calculate_happiness_incentive(total_pnl, win_rate, risk_reward_ratio)
 
+            # --- Rules Replay (counterfactual PnL had every D-Pro rule been followed) ---
+            replay = replay_rules(trades, self.monthly_start_capital, NIGHT_SESSION_VIOLATIONS)
+            monthly_replay = monthly_replay_summary(trades, replay)
+            rules_replay = {
+                "rules": {
+                    "daily_stop_max_losses": DAILY_STOP_MAX_LOSSES,
+                    "capital_circuit_breaker_ratio": CAPITAL_CIRCUIT_BREAKER_RATIO,
+                    "night_session_windows": NIGHT_SESSION_VIOLATIONS,
+                },
+                "total": total_replay_summary(trades, replay),
+                "monthly": monthly_replay,
+            }
+
+            # --- Capital Path (months chained from the start capital and scale) ---
+            path = capital_path(monthly_path_inputs(trades), self.monthly_start_capital, self.start_scale,
+                                UPGRADE_CRITERIA, QUARTERLY_COST, QUARTERLY_MONTHS)
+
             # --- Historical Summary ---
-            monthly_summary, monthly_trades = self.calculate_monthly_summary(trades)
+            monthly_summary, monthly_trades = self.calculate_monthly_summary(trades, monthly_replay, path)
 
             # --- Annual Summary ---
             annual_summary = self._calculate_annual_summary(trades)
@@ -684,6 +798,7 @@ class TradeAuditor:
                 "startDate": trades['trade_time'].min().strftime('%Y-%m-%d'),
                 "endDate": trades['trade_time'].max().strftime('%Y-%m-%d'),
                 "account_summary": {
+                    "account_id": self.account_id,
                     "scale": self.current_scale, 
                     "monthly_start_capital": self.monthly_start_capital,
                     "current_balance": self.current_capital, 
@@ -698,6 +813,9 @@ class TradeAuditor:
                 "sop_risk_stress_test": stress_test,
                 "capital_assessment": capital_assessment,
                 "historical_summary": monthly_summary,
+                "rules_replay": rules_replay,
+                "capital_path": capital_path_summary(path),
+                "market_context": market_context,
                 "annual_summary": annual_summary,
                 "detailed_trades": monthly_trades,
                 "static_rules": {
@@ -729,43 +847,44 @@ if __name__ == '__main__':
     
     parser = argparse.ArgumentParser(description="Run a trade audit on previously imported data.")
     parser.add_argument('--source', type=str, required=True, help='The source filename of the trade data to audit from the database.')
+    parser.add_argument('--account', type=str, default=DEFAULT_ACCOUNT,
+                        help="Account to audit; its parameters come from the [Account:<id>] section of config.ini (default: [Account]).")
+    parser.add_argument('--dna-sweep', action='store_true',
+                        help=f"Print the Trading DNA noise/trend curve for thresholds {DNA_SWEEP_RANGE['MIN']}-{DNA_SWEEP_RANGE['MAX']} instead of running the audit.")
     args = parser.parse_args()
 
-    config = configparser.ConfigParser()
     config_file = 'config.ini'
     
     try:
-        if not os.path.exists(config_file):
-            raise FileNotFoundError(f"Configuration file '{config_file}' not found.")
-            
-        config.read(config_file)
-        
         # --- Load Parameters from Config ---
-        account_section = config['Account']
-        monthly_start_capital = account_section.getfloat('monthly_start_capital')
-        current_scale = account_section.get('current_scale')
-        operation_contracts = account_section.getint('operation_contracts')
+        account = load_account_config(read_config(config_file), args.account)
         
-        logger.info(f"Loaded parameters from {config_file}:")
-        logger.info(f"  - Monthly Start Capital: {monthly_start_capital:,.0f}")
-        logger.info(f"  - Current Scale: {current_scale}")
-        logger.info(f"  - Operation Contracts: {operation_contracts}")
+        logger.info(f"Loaded parameters for account '{account.account_id}' from {config_file}:")
+        logger.info(f"  - Monthly Start Capital: {account.monthly_start_capital:,.0f}")
+        logger.info(f"  - Current Scale: {account.current_scale}")
+        logger.info(f"  - Operation Contracts: {account.operation_contracts}")
 
         # --- Run Audit from DB ---
         auditor = TradeAuditor(
-            monthly_start_capital=monthly_start_capital,
-            current_scale=current_scale,
-            operation_contracts=operation_contracts
+            monthly_start_capital=account.monthly_start_capital,
+            current_scale=account.current_scale,
+            operation_contracts=account.operation_contracts,
+            account_id=account.account_id,
+            start_scale=account.start_scale
         )
-        report = auditor.run_audit(args.source)
-        
-        # --- Save Report ---
-        output_filename = 'audit_report.json'
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            json.dump(report, f, indent=4, ensure_ascii=False, cls=NpEncoder)
-            
-        logger.info(f"Successfully generated audit report for source '{args.source}': '{output_filename}'")
-        print(f"\nAudit complete. Report saved to '{output_filename}'.")
+        if args.dna_sweep:
+            sweep = auditor.run_dna_sweep(args.source)
+            print(json.dumps(sweep, indent=4, ensure_ascii=False, cls=NpEncoder))
+        else:
+            report = auditor.run_audit(args.source)
+
+            # --- Save Report ---
+            output_filename = 'audit_report.json'
+            with open(output_filename, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4, ensure_ascii=False, cls=NpEncoder)
+
+            logger.info(f"Successfully generated audit report for source '{args.source}': '{output_filename}'")
+            print(f"\nAudit complete. Report saved to '{output_filename}'.")
 
     except FileNotFoundError as e:
         logger.error(f"Error: {e}", exc_info=True)
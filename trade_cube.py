@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import argparse
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from kline_data import _table_exists
+from accounts import DEFAULT_ACCOUNT
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, 'trade_notes.db')
+CUBE_TABLE = 'trade_cube'
+# 彙總維度: 帳戶、平倉時間的小時、星期 (0 = 週一)、月份 (YYYY-MM)、商品名稱、買賣別
+CUBE_DIMENSIONS = ('account_id', 'hour', 'weekday', 'month', 'product', 'action')
+# 可加總的量值，勝率與風險報酬比在查詢時由這些欄位算出
+CUBE_MEASURES = ('trade_count', 'win_count', 'loss_count', 'total_pnl', 'win_pnl', 'loss_pnl')
+
+logger = logging.getLogger(__name__)
+
+
+def create_cube_table(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CUBE_TABLE} (
+            account_id TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            product TEXT NOT NULL,
+            action TEXT NOT NULL,
+            trade_count INTEGER NOT NULL,
+            win_count INTEGER NOT NULL,
+            loss_count INTEGER NOT NULL,
+            total_pnl REAL NOT NULL,
+            win_pnl REAL NOT NULL,
+            loss_pnl REAL NOT NULL,
+            PRIMARY KEY (account_id, hour, weekday, month, product, action)
+        ) WITHOUT ROWID
+    """)
+
+
+def cube_cells(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates `trades` (`trade_time`, `net_pnl`, `product_name`, `action`, optional `account_id`) into
+    cube cells with one groupby. Trades without an account belong to the default account.
+    """
+    times = pd.to_datetime(trades['trade_time'], format='ISO8601')
+    pnl = pd.to_numeric(trades['net_pnl'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    accounts = trades['account_id'].to_numpy() if 'account_id' in trades else DEFAULT_ACCOUNT
+    frame = pd.DataFrame({
+        'account_id': accounts,
+        'hour': times.dt.hour.to_numpy(),
+        'weekday': times.dt.weekday.to_numpy(),
+        'month': times.dt.strftime('%Y-%m').to_numpy(),
+        'product': trades['product_name'].astype(str).str.strip().to_numpy(),
+        'action': trades['action'].astype(str).to_numpy(),
+        'trade_count': 1,
+        'win_count': (pnl > 0).astype('int64'),
+        'loss_count': (pnl < 0).astype('int64'),
+        'total_pnl': pnl,
+        'win_pnl': np.where(pnl > 0, pnl, 0.0),
+        'loss_pnl': np.where(pnl < 0, pnl, 0.0),
+    })
+    return frame.groupby(list(CUBE_DIMENSIONS), as_index=False)[list(CUBE_MEASURES)].sum()
+
+
+def add_trades_to_cube(conn: sqlite3.Connection, trades: pd.DataFrame) -> int:
+    """
+    Adds newly inserted `trades` to the cube: their cells are aggregated and summed into the stored
+    cells with an upsert. Does not commit, so callers can keep it in the insert's transaction.
+    Returns the number of cells touched.
+    """
+    if trades.empty:
+        return 0
+    create_cube_table(conn)
+    cells = cube_cells(trades)
+    updates = ', '.join(f"{measure} = {measure} + excluded.{measure}" for measure in CUBE_MEASURES)
+    columns = CUBE_DIMENSIONS + CUBE_MEASURES
+    conn.executemany(
+        f"INSERT INTO {CUBE_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+        f"ON CONFLICT ({', '.join(CUBE_DIMENSIONS)}) DO UPDATE SET {updates}",
+        cells[list(columns)].itertuples(index=False, name=None),
+    )
+    return len(cells)
+
+
+def rebuild_trade_cube(conn: sqlite3.Connection) -> int:
+    """Rebuilds the cube from every row of `trades` (without committing). Returns the number of cells."""
+    create_cube_table(conn)
+    conn.execute(f"DELETE FROM {CUBE_TABLE}")
+    if not _table_exists(conn, 'trades'):
+        return 0
+    columns = ['trade_time', 'net_pnl', 'product_name', 'action']
+    # Databases before the accounts migration have no account column yet.
+    if 'account_id' in [row[1] for row in conn.execute("PRAGMA table_info(trades)")]:
+        columns.append('account_id')
+    trades = pd.read_sql_query(f"SELECT {', '.join(columns)} FROM trades", conn)
+    return add_trades_to_cube(conn, trades)
+
+
+def rollup_cube(conn: sqlite3.Connection, dimensions: List[str],
+                filters: Optional[Dict[str, object]] = None) -> pd.DataFrame:
+    """
+    Rolls the cube up to `dimensions` (any subset of CUBE_DIMENSIONS; empty for a grand total),
+    keeping only cells equal to `filters` ({dimension: value}). Sums the stored measures and derives
+    `win_rate` and `risk_reward_ratio` (average win / average loss, NaN without losses).
+    Reads only the cube, never the raw trades.
+    """
+    filters = filters or {}
+    unknown = [d for d in list(dimensions) + list(filters) if d not in CUBE_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unknown cube dimension(s) {unknown}. Valid dimensions: {list(CUBE_DIMENSIONS)}")
+
+    if not _table_exists(conn, CUBE_TABLE):
+        return pd.DataFrame(columns=list(dimensions) + list(CUBE_MEASURES) + ['win_rate', 'risk_reward_ratio'])
+
+    sums = ', '.join(f"SUM({measure}) AS {measure}" for measure in CUBE_MEASURES)
+    query = f"SELECT {''.join(f'{d}, ' for d in dimensions)}{sums} FROM {CUBE_TABLE}"
+    if filters:
+        query += " WHERE " + " AND ".join(f"{d} = ?" for d in filters)
+    if dimensions:
+        query += f" GROUP BY {', '.join(dimensions)} ORDER BY {', '.join(dimensions)}"
+    cube = pd.read_sql_query(query, conn, params=list(filters.values()))
+    cube = cube[cube['trade_count'].fillna(0) > 0].reset_index(drop=True)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cube['win_rate'] = (cube['win_count'] / cube['trade_count']).round(4)
+        average_win = np.where(cube['win_count'] > 0, cube['win_pnl'] / cube['win_count'], 0.0)
+        average_loss = -cube['loss_pnl'] / cube['loss_count']
+        cube['risk_reward_ratio'] = np.where(cube['loss_count'] > 0, average_win / average_loss, np.nan).round(2)
+    return cube
+
+
+def main():
+    """Rebuilds the trade cube from the trades table."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Rebuild the trade performance cube from the trades table.")
+    parser.parse_args()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        cells = rebuild_trade_cube(conn)
+        conn.commit()
+        print(f"{CUBE_TABLE}: {cells} cells")
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+import logging
+import sqlite3
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+# 倉別欄位中代表「新倉」的值
+OPENING_POSITION_TYPE = '新倉'
+TRADES_TABLE = 'trades'
+TRANSACTION_DATA_TABLE = 'TransactionData'
+MERGED_TABLE = 'trades_merged'
+# 記錄上次合併處理到的 trades.rowid 與 TransactionData.id
+WATERMARKS_TABLE = 'merge_watermarks'
+MERGED_COLUMNS = [
+    'trade_id', 'trade_time', 'action', 'net_pnl', 'contracts', 'product_name', 'source_file',
+    'open_price', 'close_price', 'fee', 'tax', 'open_trade_time', 'open_fill_id', 'account_id',
+]
+UNMATCHED_OPEN_TIME = 'N/A'
+# 單一 SQL `IN (...)` 查詢的參數上限
+SQL_IN_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_product_key(name) -> str:
+    """Normalizes a product name for matching (e.g. ' 小型期09 ' -> '小型期09'); missing names become ''."""
+    if name is None or (isinstance(name, float) and np.isnan(name)):
+        return ''
+    return str(name).strip()
+
+
+def _product_aliases(trade_products, fill_products) -> Dict[str, List[str]]:
+    """
+    Maps every trade product key to the fill product keys that contain it, mirroring the old
+    `str.contains(product)` filter but evaluated once per distinct pair instead of once per trade.
+    """
+    return {
+        product: [name for name in fill_products if product in name]
+        for product in trade_products if product
+    }
+
+
+class _FillPool:
+    """
+    Opening fills sharing one (account, product, price) key, ordered so that walking left from a position
+    visits fills from the latest to the earliest time and, within one time, in their original order.
+    Remaining contract capacity is tracked per fill; exhausted fills are skipped with a
+    path-compressed "nearest free fill to the left" pointer.
+    """
+    def __init__(self, times: np.ndarray, positions: np.ndarray, capacity: np.ndarray):
+        order = np.lexsort((-positions, times))
+        self.times = times[order]
+        self.positions = positions[order]
+        self.capacity = capacity[order].astype(float)
+        self._free_left = np.arange(len(order))
+        # Fills already used up by earlier matches are skipped from the start.
+        exhausted = np.flatnonzero(self.capacity <= 0)
+        self._free_left[exhausted] = exhausted - 1
+
+    def _find_free(self, i: int) -> int:
+        root = i
+        while root >= 0 and self._free_left[root] != root:
+            root = self._free_left[root]
+        while i >= 0 and self._free_left[i] != i:
+            self._free_left[i], i = root, self._free_left[i]
+        return root
+
+    def take_latest_before(self, close_time: np.datetime64, contracts: float) -> int:
+        """Consumes the latest fill strictly before `close_time` with capacity left; returns its original position or -1."""
+        i = self._find_free(int(np.searchsorted(self.times, close_time, side='left')) - 1)
+        if i < 0:
+            return -1
+        self.capacity[i] -= contracts
+        if self.capacity[i] <= 0:
+            self._free_left[i] = i - 1
+        return int(self.positions[i])
+
+
+def match_open_fills(trades_df: pd.DataFrame, transactions_df: pd.DataFrame,
+                     used_contracts: Optional[pd.Series] = None) -> pd.Series:
+    """
+    Finds the opening fill ('新倉') of every closed trade: the latest fill of the same product and
+    price that happened strictly before the trade's close time. When both frames have `account_id`,
+    a trade only takes fills of its own account.
+
+    Fills are grouped by (product, price) and sorted once, so each trade is resolved with a binary
+    search instead of a scan over all fills. Trades are resolved in close-time order and a fill
+    serves at most its `quantity` in contracts, so one fill is never reused for more contracts
+    than it opened; the next earlier fill is used instead. `used_contracts` (indexed like
+    `transactions_df`) holds contracts already consumed by earlier matches.
+
+    `trades_df` needs `trade_time`, `product_name`, `open_price` (and optionally `contracts`);
+    `transactions_df` needs `transaction_time`, `product_name`, `price`, `position_type` (and
+    optionally `quantity`). Returns the `transactions_df` index label of each trade's fill,
+    aligned to `trades_df.index`, with NA where unmatched.
+    """
+    matched_fills = pd.Series(pd.NA, index=trades_df.index, dtype='object')
+    opening = transactions_df[transactions_df['position_type'] == OPENING_POSITION_TYPE]
+    if trades_df.empty or opening.empty:
+        return matched_fills
+
+    fill_times = pd.to_datetime(opening['transaction_time']).to_numpy(dtype='datetime64[ns]')
+    fill_products = opening['product_name'].map(normalize_product_key).to_numpy()
+    fill_prices = opening['price'].to_numpy(dtype=float)
+    if 'quantity' in opening:
+        fill_capacity = opening['quantity'].fillna(1).to_numpy(dtype=float)
+    else:
+        fill_capacity = np.ones(len(opening))
+    if used_contracts is not None:
+        fill_capacity = fill_capacity - used_contracts.reindex(opening.index).fillna(0).to_numpy(dtype=float)
+
+    by_account = 'account_id' in opening and 'account_id' in trades_df
+    fill_accounts = opening['account_id'].to_numpy() if by_account else np.full(len(opening), None)
+
+    # Group fill row positions by (account, product, price) once.
+    fill_groups = defaultdict(list)
+    for position, key in enumerate(zip(fill_accounts, fill_products, fill_prices)):
+        fill_groups[key].append(position)
+
+    trade_times = pd.to_datetime(trades_df['trade_time']).to_numpy(dtype='datetime64[ns]')
+    trade_accounts = trades_df['account_id'].to_numpy() if by_account else np.full(len(trades_df), None)
+    trade_products = trades_df['product_name'].map(normalize_product_key).to_numpy()
+    trade_prices = trades_df['open_price'].to_numpy(dtype=float)
+    if 'contracts' in trades_df:
+        trade_contracts = trades_df['contracts'].fillna(1).clip(lower=1).to_numpy(dtype=float)
+    else:
+        trade_contracts = np.ones(len(trades_df))
+
+    aliases = _product_aliases(set(trade_products), sorted(set(fill_products)))
+    pools: Dict[Tuple[Optional[str], str, float], _FillPool] = {}
+    matched = np.full(len(trades_df), -1)
+
+    for t in np.argsort(trade_times, kind='stable'):
+        account, product, price = trade_accounts[t], trade_products[t], trade_prices[t]
+        if np.isnan(price) or np.isnat(trade_times[t]) or not aliases.get(product):
+            continue
+        pool = pools.get((account, product, price))
+        if pool is None:
+            members = [p for name in aliases[product] for p in fill_groups.get((account, name, price), [])]
+            if not members:
+                continue
+            members = np.array(members)
+            pool = pools[(account, product, price)] = _FillPool(fill_times[members], members, fill_capacity[members])
+        matched[t] = pool.take_latest_before(trade_times[t], trade_contracts[t])
+
+    found = np.flatnonzero(matched >= 0)
+    matched_fills.iloc[found] = opening.index.to_numpy()[matched[found]]
+    return matched_fills
+
+
+def match_open_times(trades_df: pd.DataFrame, transactions_df: pd.DataFrame) -> Tuple[pd.Series, int]:
+    """
+    Returns the open time of every trade's opening fill (NaT where unmatched, aligned to
+    `trades_df.index`) and the number of matched trades. See `match_open_fills`.
+    """
+    matched_fills = match_open_fills(trades_df, transactions_df)
+    found = matched_fills.notna()
+    open_times = pd.Series(pd.NaT, index=trades_df.index, dtype='datetime64[ns]')
+    fill_times = pd.to_datetime(transactions_df['transaction_time']).astype('datetime64[ns]')
+    open_times[found] = fill_times.loc[matched_fills[found].to_numpy()].to_numpy()
+    match_count = int(found.sum())
+    logger.info(f"Matched open times for {match_count} of {len(trades_df)} trades.")
+    return open_times, match_count
+
+
+def _read_watermark(conn: sqlite3.Connection, name: str) -> int:
+    row = conn.execute(f"SELECT last_id FROM {WATERMARKS_TABLE} WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def _write_watermark(conn: sqlite3.Connection, name: str, last_id: int):
+    conn.execute(f"INSERT OR REPLACE INTO {WATERMARKS_TABLE} (name, last_id) VALUES (?, ?)", (name, int(last_id)))
+
+
+def _read_where_in(conn: sqlite3.Connection, query: str, values, params=()) -> pd.DataFrame:
+    """Runs `query` (containing one `{placeholders}` slot) over `values` in chunks and concatenates the results."""
+    values = list(values)
+    frames = []
+    for start in range(0, len(values), SQL_IN_CHUNK_SIZE):
+        chunk = values[start:start + SQL_IN_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        frames.append(pd.read_sql_query(query.format(placeholders=placeholders), conn, params=[*params, *chunk]))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def reset_merged_trades(conn: sqlite3.Connection):
+    """Empties `trades_merged` and its watermarks so the next merge starts from scratch."""
+    conn.execute(f"DELETE FROM {MERGED_TABLE}")
+    conn.execute(f"DELETE FROM {WATERMARKS_TABLE}")
+
+
+def drop_merged_trades(conn: sqlite3.Connection, where: str, params=()) -> int:
+    """
+    Deletes the `trades_merged` rows of the trades selected by `where` (a condition on `trades`), to be
+    called before those trades are deleted. `trades` has no AUTOINCREMENT, so trades imported later may
+    reuse the freed rowids; the 'trades' watermark is lowered below them so the next merge reads those
+    rowids again. Does not commit. Returns the number of merged rows deleted.
+    """
+    first_rowid = conn.execute(f"SELECT MIN(rowid) FROM {TRADES_TABLE} WHERE {where}", params).fetchone()[0]
+    if first_rowid is None:
+        return 0
+    deleted = conn.execute(
+        f"DELETE FROM {MERGED_TABLE} WHERE trade_id IN (SELECT trade_id FROM {TRADES_TABLE} WHERE {where})", params,
+    ).rowcount
+    if _read_watermark(conn, 'trades') >= first_rowid:
+        _write_watermark(conn, 'trades', first_rowid - 1)
+    return deleted
+
+
+def update_merged_trades(conn: sqlite3.Connection, full: bool = False) -> Dict[str, int]:
+    """
+    Brings `trades_merged` up to date with `trades` and `TransactionData`.
+
+    Only trades added since the last merge (above the `trades.rowid` watermark and not merged yet) are matched,
+    plus previously unmatched trades whose open price appears among newly added opening fills.
+    Only opening fills at those prices are read, with the contracts already consumed by earlier
+    merges deducted, and results are upserted by `trade_id`. The cost of a merge therefore follows
+    the size of the new data rather than the whole history.
+
+    Earlier matches are kept as they are; `full=True` (or a cleared `trades` table) discards them
+    and re-matches everything. Returns counts of the work done.
+    """
+    trades_mark = 0 if full else _read_watermark(conn, 'trades')
+    fills_mark = 0 if full else _read_watermark(conn, 'fills')
+    last_trade_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {TRADES_TABLE}").fetchone()[0]
+    last_fill_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TRANSACTION_DATA_TABLE}").fetchone()[0]
+    if last_trade_rowid < trades_mark or last_fill_id < fills_mark:
+        logger.warning("Source tables shrank since the last merge; rebuilding trades_merged from scratch.")
+        full, trades_mark, fills_mark = True, 0, 0
+
+    try:
+        if full:
+            reset_merged_trades(conn)
+
+        # Trades above the watermark that are already merged (the watermark was lowered by a clear) keep their match.
+        new_trades = pd.read_sql_query(
+            f"SELECT * FROM {TRADES_TABLE} t WHERE rowid > ? "
+            f"AND NOT EXISTS (SELECT 1 FROM {MERGED_TABLE} m WHERE m.trade_id = t.trade_id)",
+            conn, params=(trades_mark,))
+        # Unmatched trades that a newly imported opening fill might now satisfy.
+        retried = pd.read_sql_query(
+            f"""
+            SELECT * FROM {MERGED_TABLE}
+            WHERE open_fill_id IS NULL AND open_price IN (
+                SELECT DISTINCT price FROM {TRANSACTION_DATA_TABLE} WHERE id > ? AND position_type = ?
+            )
+            """,
+            conn, params=(fills_mark, OPENING_POSITION_TYPE),
+        ).drop(columns=['open_trade_time', 'open_fill_id'])
+        candidates = pd.concat([new_trades, retried], ignore_index=True).drop_duplicates('trade_id')
+
+        matched_count = 0
+        if not candidates.empty:
+            prices = candidates['open_price'].dropna().unique().tolist()
+            fills = _read_where_in(
+                conn,
+                f"SELECT * FROM {TRANSACTION_DATA_TABLE} WHERE position_type = ? AND price IN ({{placeholders}})",
+                prices, (OPENING_POSITION_TYPE,),
+            )
+            used = pd.Series(dtype=float)
+            if not fills.empty:
+                fills = fills.set_index('id')
+                used = _read_where_in(
+                    conn,
+                    f"SELECT open_fill_id, SUM(contracts) AS used FROM {MERGED_TABLE} "
+                    f"WHERE open_fill_id IN ({{placeholders}}) GROUP BY open_fill_id",
+                    fills.index.tolist(),
+                ).set_index('open_fill_id')['used']
+
+            candidates['trade_time'] = pd.to_datetime(candidates['trade_time'], format='ISO8601')
+            if fills.empty:
+                matched_fills = pd.Series(pd.NA, index=candidates.index, dtype='object')
+            else:
+                matched_fills = match_open_fills(candidates, fills, used)
+            found = matched_fills.notna()
+            matched_count = int(found.sum())
+
+            candidates['open_fill_id'] = matched_fills.astype('Int64')
+            candidates['open_trade_time'] = UNMATCHED_OPEN_TIME
+            if matched_count:
+                open_times = pd.to_datetime(fills.loc[matched_fills[found].to_numpy(), 'transaction_time'])
+                candidates.loc[found, 'open_trade_time'] = open_times.dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+            candidates['trade_time'] = candidates['trade_time'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+            rows = candidates[MERGED_COLUMNS].astype(object).where(candidates[MERGED_COLUMNS].notna(), None)
+            updates = ', '.join(f"{column} = excluded.{column}" for column in MERGED_COLUMNS[1:])
+            conn.executemany(
+                f"INSERT INTO {MERGED_TABLE} ({', '.join(MERGED_COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(MERGED_COLUMNS))}) "
+                f"ON CONFLICT(trade_id) DO UPDATE SET {updates}",
+                rows.itertuples(index=False, name=None),
+            )
+
+        _write_watermark(conn, 'trades', last_trade_rowid)
+        _write_watermark(conn, 'fills', last_fill_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    total, unmatched = conn.execute(
+        f"SELECT COUNT(*), COALESCE(SUM(open_fill_id IS NULL), 0) FROM {MERGED_TABLE}").fetchone()
+    summary = {
+        'full': int(full),
+        'new_trades': len(new_trades),
+        'retried': len(retried),
+        'matched': matched_count,
+        'total': total,
+        'unmatched_total': unmatched,
+    }
+    logger.info(f"trades_merged update: {summary}")
+    return summary
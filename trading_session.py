@@ -0,0 +1,155 @@
+import logging
+from typing import Dict, Any, Tuple
+
+import numpy as np
+import pandas as pd
+
+# --- Configuration ---
+MARKET_TZ = 'Asia/Taipei'
+DEFAULT_SYMBOL = 'TXF'
+
+# 台灣期交所交易時段 (TAIFEX trading sessions).
+# 夜盤 (盤後交易) 15:00 開盤，跨日至次日 05:00 收盤，並歸屬於「下一個交易日」。
+SESSION_CALENDARS: Dict[str, Dict[str, Any]] = {
+    'TXF': {
+        'sessions': [
+            {'name': 'day', 'open': '08:45', 'close': '13:45', 'next_trading_day': False},
+            {'name': 'night', 'open': '15:00', 'close': '05:00', 'next_trading_day': True},
+        ],
+    },
+}
+# 小台 (MTX) 與微台 (TMF) 與大台使用相同的交易時段
+SESSION_CALENDARS['MTX'] = SESSION_CALENDARS['TXF']
+SESSION_CALENDARS['TMF'] = SESSION_CALENDARS['TXF']
+
+logger = logging.getLogger(__name__)
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def get_session_calendar(symbol: str = DEFAULT_SYMBOL) -> Dict[str, Any]:
+    """Returns the session calendar for a symbol, falling back to the TXF calendar."""
+    return SESSION_CALENDARS.get(symbol, SESSION_CALENDARS[DEFAULT_SYMBOL])
+
+
+def _sorted_sessions(symbol: str):
+    sessions = sorted(get_session_calendar(symbol)['sessions'], key=lambda s: _minutes(s['open']))
+    opens = np.array([_minutes(s['open']) for s in sessions], dtype='int64')
+    return sessions, opens
+
+
+def _to_market_index(index) -> pd.DatetimeIndex:
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        return index.tz_localize(MARKET_TZ)
+    return index.tz_convert(MARKET_TZ)
+
+
+def _roll_to_business_day(dates: np.ndarray) -> np.ndarray:
+    return np.busday_offset(dates.astype('datetime64[D]'), 0, roll='forward')
+
+
+def assign_sessions(index, symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Maps each timestamp to its trading session in a single vectorized pass.
+
+    A bar belongs to the latest session that opened at or before it, so bars outside the
+    official hours (e.g. after 13:45) stay attached to the preceding session instead of
+    being dropped. Returns a frame with `session`, `session_open` and `trading_date` columns.
+    """
+    index = _to_market_index(index)
+    sessions, opens = _sorted_sessions(symbol)
+
+    wall = index.tz_localize(None)
+    dates = wall.normalize().values.astype('datetime64[D]')
+    minute_of_day = (wall.hour * 60 + wall.minute).to_numpy()
+
+    # Position of the latest session open at or before each bar; -1 wraps to the previous day.
+    position = np.searchsorted(opens, minute_of_day, side='right') - 1
+    wrapped = position < 0
+    position = np.where(wrapped, len(sessions) - 1, position)
+    open_dates = dates - wrapped.astype('int64')
+
+    # Sessions opening on a weekend (or flagged as trading for the next day) roll to the next business day.
+    next_day_flags = np.array([s['next_trading_day'] for s in sessions])[position]
+    trading_dates = _roll_to_business_day(open_dates + next_day_flags.astype('int64'))
+
+    session_open = open_dates.astype('datetime64[m]') + opens[position].astype('timedelta64[m]')
+    return pd.DataFrame({
+        'session': np.array([s['name'] for s in sessions])[position],
+        'session_open': pd.DatetimeIndex(session_open).tz_localize(MARKET_TZ),
+        'trading_date': pd.DatetimeIndex(trading_dates.astype('datetime64[ns]')).tz_localize(MARKET_TZ),
+    }, index=index)
+
+
+def session_bucket_ids(index, timeframe: str, symbol: str = DEFAULT_SYMBOL) -> pd.DatetimeIndex:
+    """
+    Computes the session-aligned bucket label of every timestamp.
+    Intraday buckets are offsets from the session open and never span two sessions;
+    daily buckets are labelled with the TAIFEX trading date (night session + following day session).
+    """
+    step = pd.Timedelta(timeframe)
+    sessions = assign_sessions(index, symbol)
+    if step >= pd.Timedelta('1D'):
+        return pd.DatetimeIndex(sessions['trading_date'])
+
+    opens = pd.DatetimeIndex(sessions['session_open'])
+    offsets = (sessions.index - opens) // step
+    return opens + offsets * step
+
+
+def build_session_bars(df: pd.DataFrame, timeframe: str, symbol: str = DEFAULT_SYMBOL) -> pd.DataFrame:
+    """
+    Aggregates time-sorted 1-minute OHLCV bars into session-aligned `timeframe` bars.
+    Bucket ids are computed once and reduced with `np.ufunc.reduceat`, so no per-bucket Python runs.
+    """
+    if df.empty:
+        return df
+
+    bucket_index = session_bucket_ids(df.index, timeframe, symbol)
+    buckets = bucket_index.asi8
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(buckets)] - 1
+
+    bars = pd.DataFrame({
+        'open': df['open'].to_numpy()[starts],
+        'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+        'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+        'close': df['close'].to_numpy()[ends],
+        'volume': np.add.reduceat(df['volume'].to_numpy(), starts),
+    }, index=bucket_index[starts].rename(df.index.name))
+    return bars
+
+
+def session_bucket_bounds(ts: pd.Timestamp, timeframe: str, symbol: str = DEFAULT_SYMBOL) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    Returns the [lower, upper) span of 1-minute bars that make up the session bucket containing `ts`.
+    Both bounds are session opens or bucket edges, so reading raw bars between them never truncates a bucket.
+    """
+    ts = _to_market_index([ts])[0]
+    step = pd.Timedelta(timeframe)
+    sessions, opens = _sorted_sessions(symbol)
+    info = assign_sessions([ts], symbol).iloc[0]
+
+    if step >= pd.Timedelta('1D'):
+        trading_date = info['trading_date'].tz_localize(None).to_datetime64().astype('datetime64[D]')
+        overnight = [s for s in sessions if s['next_trading_day']]
+        if overnight:
+            open_offset = pd.Timedelta(minutes=_minutes(overnight[0]['open']))
+            previous_day = np.busday_offset(trading_date, -1, roll='backward')
+            lower = pd.Timestamp(previous_day) + open_offset
+            upper = pd.Timestamp(trading_date) + open_offset
+        else:
+            lower = pd.Timestamp(trading_date) + pd.Timedelta(minutes=int(opens[0]))
+            upper = pd.Timestamp(trading_date) + pd.Timedelta('1D')
+        return lower.tz_localize(MARKET_TZ), upper.tz_localize(MARKET_TZ)
+
+    session_open = info['session_open']
+    lower = session_open + ((ts - session_open) // step) * step
+    following = [session_open.normalize() + pd.Timedelta(minutes=int(m)) + pd.Timedelta(days=d)
+                 for d in (0, 1) for m in opens]
+    next_open = min(t for t in following if t > session_open)
+    return lower, min(lower + step, next_open)